@@ -1,9 +1,20 @@
+import json
+import sys
+from pathlib import Path
+
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from models import ConsumerConfig, create_session, init_db
+from models import ConsumerConfig, get_engine, init_db
 from sqlalchemy.orm import scoped_session, sessionmaker
 from utils.logger import logger
 
+# The profiles are validated with the rules of the workers which apply them (framework/etl/profiles.py of the worker
+# template): copied into the image by the Dockerfile, imported from the worker template when run from a checkout
+WORKER_TEMPLATE = Path(__file__).resolve().parent.parent.parent / 'workers' / 'worker-template-jaeger'
+if WORKER_TEMPLATE.is_dir():
+    sys.path.append(str(WORKER_TEMPLATE))
+from framework.etl.profiles import PRODUCER_PROFILE, CONSUMER_PROFILE, parse_profile  # noqa: E402
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes and allow all origins
 
@@ -11,12 +22,24 @@ CORS(app)  # Enable CORS for all routes and allow all origins
 init_db()
 
 # Create a scoped session
-Session = scoped_session(sessionmaker(bind=create_session().bind))
+Session = scoped_session(sessionmaker(bind=get_engine()))
 
 @app.route('/api/health')
 def health():
     return jsonify({"status": "ok"}), 200
 
+def dump_profile(profile, settings, worker_name):
+    """Validate a Kafka client profile sent as a JSON object (or its text) and return its text to store."""
+    if profile is None or profile == '':
+        return None
+    text = profile if isinstance(profile, str) else json.dumps(profile)
+    try:
+        parse_profile(text, settings)
+    except ValueError as e:
+        raise ValueError(f"Invalid Kafka client profile for {worker_name}: {e}")
+    return text
+
+
 @app.route('/api/consumer_configs', methods=['GET'])
 def get_consumer_configs():
     session = Session()
@@ -31,7 +54,16 @@ def get_consumer_configs():
                 "topics_output": config.topics_output,
                 "metadatas": config.metadatas,
                 "kafka_bootstrap_server": config.kafka_bootstrap_server,
-                "timeout": config.timeout  # Include timeout
+                "timeout": config.timeout,  # Include timeout
+                "batch_size": config.batch_size,
+                "batch_wait_ms": config.batch_wait_ms,
+                "aggregation_store": config.aggregation_store,
+                "timeout_policy": config.timeout_policy,
+                "codec": config.codec,
+                "producer_profile": json.loads(config.producer_profile) if config.producer_profile else None,
+                "consumer_profile": json.loads(config.consumer_profile) if config.consumer_profile else None,
+                "process_module": config.process_module,
+                "updated_at": config.updated_at.isoformat() if config.updated_at else None
             } for config in configs
         ]
         logger.info(f"Successfully retrieved {len(result)} consumer configs.")
@@ -62,13 +94,27 @@ def update_consumer_configs():
                 topics_output=config['topics_output'],
                 metadatas=config.get('metadatas'),
                 kafka_bootstrap_server=config.get('kafka_bootstrap_server', "localhost:9092"),  # Get default if missing
-                timeout=config.get('timeout')  # Include timeout
+                timeout=config.get('timeout'),  # Include timeout
+                batch_size=config.get('batch_size'),
+                batch_wait_ms=config.get('batch_wait_ms'),
+                aggregation_store=config.get('aggregation_store'),
+                timeout_policy=config.get('timeout_policy'),
+                codec=config.get('codec'),
+                producer_profile=dump_profile(config.get('producer_profile'), PRODUCER_PROFILE,
+                                              config['worker_name']),
+                consumer_profile=dump_profile(config.get('consumer_profile'), CONSUMER_PROFILE,
+                                              config['worker_name']),
+                process_module=config.get('process_module')
             )
             session.add(new_config)
 
         session.commit()
         logger.info("Consumer configs updated successfully.")
         return jsonify({"message": "Consumer configs updated successfully."}), 200
+    except ValueError as e:
+        session.rollback()
+        logger.error(f"Rejected consumer configs: {str(e)}")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         session.rollback()
         logger.error(f"Error updating consumer configs: {str(e)}")
@@ -1,6 +1,7 @@
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import Column, String, Integer, DateTime, create_engine, func, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateColumn
 from config import DB_TABLE_NAME, DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
 
 Base = declarative_base()
@@ -16,18 +17,66 @@ class ConsumerConfig(Base):
     metadatas = Column(String(8192), nullable=True)
     kafka_bootstrap_server = Column(String(255), nullable=False)
     timeout = Column(Integer, nullable=True)
+    batch_size = Column(Integer, nullable=True)
+    batch_wait_ms = Column(Integer, nullable=True)
+    aggregation_store = Column(String(32), nullable=True)
+    timeout_policy = Column(String(32), nullable=True)
+    codec = Column(String(32), nullable=True)
+    producer_profile = Column(String(2048), nullable=True)
+    consumer_profile = Column(String(2048), nullable=True)
+    process_module = Column(String(255), nullable=True)
+    # set on every write, polled by the workers to reload their configuration without restarting
+    updated_at = Column(DateTime, nullable=True, default=func.now(), onupdate=func.now(),
+                        server_default=text('CURRENT_TIMESTAMP'))
+
+
+# Columns added to the table after its first release, which `create_all` does not add to an existing table
+ADDED_COLUMNS = ('batch_size', 'batch_wait_ms', 'aggregation_store', 'timeout_policy', 'codec', 'producer_profile',
+                 'consumer_profile', 'process_module', 'updated_at')
+
+
+_engine = None
+_session_factory = None
 
 
 def get_engine():
-    return create_engine(f'mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}')
+    """The process-wide engine: its connection pool is shared by every session."""
+    global _engine
+    if _engine is None:
+        _engine = create_engine(
+            f'mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}',
+            # MySQL closes idle connections: check them out alive and renew them before they are dropped
+            pool_pre_ping=True,
+            pool_recycle=3600
+        )
+    return _engine
 
 
 def create_session():
-    engine = get_engine()
-    Session = sessionmaker(bind=engine)
-    return Session()
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = sessionmaker(bind=get_engine())
+    return _session_factory()
 
 
 def init_db():
     engine = get_engine()
     Base.metadata.create_all(engine)
+    upgrade_db(engine)
+
+
+def upgrade_db(engine):
+    """Add the ADDED_COLUMNS missing from an existing table (the workers and the editor both run it at startup)."""
+    table = ConsumerConfig.__table__
+    existing = {column['name'] for column in inspect(engine).get_columns(table.name)}
+    for name in ADDED_COLUMNS:
+        if name in existing:
+            continue
+        ddl = CreateColumn(table.c[name]).compile(dialect=engine.dialect)
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(f"ALTER TABLE {table.name} ADD {ddl}"))
+        except Exception:
+            # added meanwhile by another process starting at the same time
+            if name not in {column['name'] for column in inspect(engine).get_columns(table.name)}:
+                raise
@@ -2,12 +2,12 @@
 # MySQL
 import ast
 from datetime import timedelta
-from os import environ, path
+from os import environ, path, cpu_count
 
 from dotenv import load_dotenv
 
 from framework.auth.keys import load_private_key, load_public_key
-from framework.commons.logger import logger
+from framework.commons.logger import configure_logging
 
 basedir = path.abspath(path.dirname(__file__))
 load_dotenv(dotenv_path=path.join(basedir, '.env'))
@@ -20,6 +20,8 @@ class Config:
     DB_USER = environ.get('DB_USER')
     DB_PASSWORD = environ.get('DB_PASSWORD')
     DB_TABLE_NAME = environ.get('DB_TABLE_NAME')
+    # the consumer configurations are reloaded when their updated_at changes, checked every CONFIG_REFRESH_INTERVAL_S
+    CONFIG_REFRESH_INTERVAL_S = int(environ.get('CONFIG_REFRESH_INTERVAL_S', 10))
 
 
     # redis
@@ -31,6 +33,10 @@ class Config:
     # region worker
     DISABLE_KAFKA = environ.get('DISABLE_KAFKA')
     WORKER_NAME = environ.get('WORKER_NAME')
+    # host mode: run the consumers listed in WORKER_NAMES (comma-separated) in this process instead of WORKER_NAME
+    WORKER_NAMES = [name for name in environ.get('WORKER_NAMES', '').split(',') if name]
+    # module defining process() (and optionally process_batch()), unless ConsumerConfig.process_module is set
+    PROCESS_MODULE = environ.get('PROCESS_MODULE', 'ops_service.worker_kafka')
     IS_AGGREGATOR = False
 
     # endregion
@@ -77,9 +83,77 @@ class Config:
 
     # GENERIC - LOGGER
     LOGGING_LEVEL = environ.get('LOGGING_LEVEL')
-    logger.setLevel(LOGGING_LEVEL)
+    # text or json (one object per line)
+    LOG_FORMAT = environ.get('LOG_FORMAT', 'text')
+    # the records are written to the console by a background thread, at most LOG_QUEUE_SIZE of them wait for it
+    LOG_ASYNC = environ.get('LOG_ASYNC', 'true').lower() == 'true'
+    LOG_QUEUE_SIZE = int(environ.get('LOG_QUEUE_SIZE', 10000))
+    # per-message records below WARNING: share kept and maximum per second (0: no limit)
+    LOG_MESSAGE_SAMPLE_RATE = float(environ.get('LOG_MESSAGE_SAMPLE_RATE', 1.0))
+    LOG_MESSAGE_RATE_LIMIT = int(environ.get('LOG_MESSAGE_RATE_LIMIT', 0))
+    # log the content of the processed messages (DEBUG), costly with large payloads
+    LOG_PAYLOADS = environ.get('LOG_PAYLOADS', 'false').lower() == 'true'
+    configure_logging(LOGGING_LEVEL, LOG_FORMAT, LOG_ASYNC, LOG_QUEUE_SIZE, LOG_MESSAGE_SAMPLE_RATE,
+                      LOG_MESSAGE_RATE_LIMIT)
 
     # GENERIC - KAFKA
     NACK_TIME = 2
     RETRY_COUNT = 5
+    # delays (in seconds) of the retry topics: the n-th retry goes to the n-th topic, the last one is reused
+    RETRY_DELAYS = [5, 60, 600]
     ERROR_TOPIC = 'dead_letter'
+    # codec of the messages and of the aggregation parts (json, orjson or msgpack), unless ConsumerConfig.codec is set
+    CODEC = environ.get('CODEC', 'json')
+    # Kafka client library: kafka-python or confluent (librdkafka)
+    KAFKA_BACKEND = environ.get('KAFKA_BACKEND', 'kafka-python')
+    # the outputs, retries and input offsets of every poll are committed in a single Kafka transaction (confluent only)
+    KAFKA_EXACTLY_ONCE = environ.get('KAFKA_EXACTLY_ONCE', 'false').lower() == 'true'
+    BATCH_WAIT_MS = 100
+    POLL_TIMEOUT_MS = 1000
+    # completed offsets are committed asynchronously every COMMIT_INTERVAL_MS or every COMMIT_EVERY messages
+    COMMIT_INTERVAL_MS = 1000
+    COMMIT_EVERY = 500
+
+    # fetching is paused once MAX_IN_FLIGHT records are fetched but not completed, and resumed at RESUME_IN_FLIGHT
+    # (MAX_IN_FLIGHT / 2 by default); 0 disables the backpressure
+    MAX_IN_FLIGHT = int(environ.get('MAX_IN_FLIGHT', 5000))
+    RESUME_IN_FLIGHT = int(environ['RESUME_IN_FLIGHT']) if environ.get('RESUME_IN_FLIGHT') else None
+
+    # GENERIC - METRICS (GET /metrics)
+    # lag (end offset - position) of the assigned partitions measured every METRICS_LAG_INTERVAL_S, 0 disables it
+    METRICS_LAG_INTERVAL_S = int(environ.get('METRICS_LAG_INTERVAL_S', 30))
+
+    # GENERIC - STAGE TIMING (GET /monitoring/stages)
+    # percentiles of the last STAGE_TIMING_WINDOW durations of every stage, and the SLOW_MESSAGES slowest messages of
+    # the last SLOW_MESSAGES_MAX_AGE_S seconds
+    STAGE_TIMING_WINDOW = int(environ.get('STAGE_TIMING_WINDOW', 2048))
+    SLOW_MESSAGES = int(environ.get('SLOW_MESSAGES', 20))
+    SLOW_MESSAGES_MAX_AGE_S = int(environ.get('SLOW_MESSAGES_MAX_AGE_S', 3600))
+
+    # GENERIC - AGGREGATION TIMEOUTS
+    # expired aggregations (ConsumerConfig.timeout) are swept every AGGREGATION_SWEEP_INTERVAL_MS, at most
+    # AGGREGATION_SWEEP_BATCH at a time, and handled according to ConsumerConfig.timeout_policy
+    AGGREGATION_SWEEP_INTERVAL_MS = int(environ.get('AGGREGATION_SWEEP_INTERVAL_MS', 1000))
+    AGGREGATION_SWEEP_BATCH = int(environ.get('AGGREGATION_SWEEP_BATCH', 500))
+    # upper bounds (in seconds) of the buckets of the pending aggregations age histogram
+    AGGREGATION_AGE_BUCKETS = [1, 5, 10, 30, 60, 300, 600, 1800, 3600]
+
+    # GENERIC - LOCAL AGGREGATION STORE (ConsumerConfig.aggregation_store = 'local')
+    LOCAL_AGGREGATION_MAX_BYTES = int(environ.get('LOCAL_AGGREGATION_MAX_BYTES', 256 * 1024 * 1024))
+    # hand the pending aggregations of revoked partitions off to Redis instead of dropping them
+    LOCAL_AGGREGATION_HANDOFF = environ.get('LOCAL_AGGREGATION_HANDOFF', 'true').lower() == 'true'
+
+    # GENERIC - SUPERVISOR (supervisor.py)
+    # consumer processes forked in the consumer group of WORKER_NAME, restarted after a backoff of SUPERVISOR_BACKOFF_S
+    # doubled on every consecutive crash (up to SUPERVISOR_MAX_BACKOFF_S), killed SUPERVISOR_STOP_TIMEOUT_S after SIGTERM
+    SUPERVISOR_PROCESSES = int(environ.get('SUPERVISOR_PROCESSES', cpu_count() or 1))
+    SUPERVISOR_BACKOFF_S = 1
+    SUPERVISOR_MAX_BACKOFF_S = 60
+    SUPERVISOR_STOP_TIMEOUT_S = int(environ.get('SUPERVISOR_STOP_TIMEOUT_S', 30))
+
+    # GENERIC - EXECUTION ENGINE
+    # sync: process on the Kafka listener thread, thread/process: process on EXECUTOR_WORKERS lanes
+    EXECUTOR_TYPE = environ.get('EXECUTOR_TYPE', 'sync')
+    EXECUTOR_WORKERS = int(environ.get('EXECUTOR_WORKERS', cpu_count() or 1))
+    # records queued per lane before the poll loop waits for it (one poll of max_poll_records by default)
+    EXECUTOR_QUEUE_SIZE = int(environ.get('EXECUTOR_QUEUE_SIZE', 500))
@@ -0,0 +1,32 @@
+from typing import Optional
+
+from framework.etl import supervisor
+from framework.etl.context import contexts
+from framework.etl.timeouts import timeout_managers
+
+
+def aggregation_stats(app, operation: Optional[str] = None, request=None, **kwargs):
+    """
+    Backlog of the aggregators running in this worker: pending aggregations, their age histogram and how many
+    timed out, by consumer name.
+    """
+    return {consumer_name: manager.stats() for consumer_name, manager in list(timeout_managers.items())}
+
+
+def worker_stats(app, operation: Optional[str] = None, request=None, **kwargs):
+    """
+    Consumer processes of the supervisor (`supervisor.py`): pid, uptime, restarts, records completed and throughput
+    (records per second) of each, empty if the worker does not run under the supervisor.
+    """
+    if supervisor.active_supervisor is None:
+        return {}
+    return supervisor.active_supervisor.stats()
+
+
+def stage_stats(app, operation: Optional[str] = None, request=None, **kwargs):
+    """
+    Where the time goes in the message handling loops of this worker, by consumer name: rolling percentiles of the
+    decode, aggregation, process, produce and commit stages, and the slowest messages with their stage durations.
+    """
+    return {consumer_name: ctx.stage_timer.stats() for consumer_name, ctx in list(contexts.items())
+            if ctx.stage_timer}
@@ -0,0 +1,89 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CODECS = ('json', 'orjson', 'msgpack')
+
+
+class Codec:
+    """
+    Serialization of the Kafka messages and of the aggregation parts stored in Redis.
+
+    `dumps` always returns bytes, `loads` accepts bytes (and str for the text codecs). `binary` codecs need a
+    Redis client which does not decode its responses.
+    """
+
+    name = None
+    binary = False
+
+    def dumps(self, obj):
+        raise NotImplementedError
+
+    def loads(self, data):
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("The orjson codec requires the orjson package")
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    name = 'msgpack'
+    binary = True
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("The msgpack codec requires the msgpack package")
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+_codec_classes = {codec.name: codec for codec in (JsonCodec, OrjsonCodec, MsgpackCodec)}
+_codecs = {}
+
+
+def get_codec(name=None):
+    """
+    Get the (shared) codec named `name`, `json` if None.
+
+    :param name: One of CODECS
+    :return: Codec
+    """
+    name = name or 'json'
+    if name not in _codec_classes:
+        raise ValueError(f"Unknown codec: {name}. Expected one of {CODECS}")
+    if name not in _codecs:
+        _codecs[name] = _codec_classes[name]()
+    return _codecs[name]
@@ -1,5 +1,13 @@
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
 from colorama import Fore, Style, init, Back
@@ -27,18 +35,109 @@ COLOR_MAP = {
     "gray_back": Back.LIGHTBLACK_EX
 }
 
+LOG_FORMATS = ('text', 'json')
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# attributes of every LogRecord, the others were passed in `extra` and are added to the JSON records
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'color'}
+
 
 # Custom Logger to handle color argument
 class CustomLogger(logging.Logger):
     def _log(self, level, msg, args, exc_info=None, extra=None, stack_info=False, stacklevel=1):
-        # Handle optional color argument (last positional argument)
-        if isinstance(args, tuple) and len(args) > 0 and isinstance(args[-1], str) and args[-1].lower() in COLOR_MAP:
-            color = args[-1].lower()
-            msg = f"{COLOR_MAP[color]}{msg}{Style.RESET_ALL}"
+        # Handle optional color argument (last positional argument), applied by the text formatter
+        if args and isinstance(args[-1], str) and args[-1].lower() in COLOR_MAP:
+            extra = dict(extra, color=args[-1].lower()) if extra else {'color': args[-1].lower()}
             args = args[:-1]  # Remove the color argument from args
         super()._log(level, msg, args, exc_info, extra, stack_info, stacklevel)
 
 
+class ColorFormatter(logging.Formatter):
+    """Text formatter colouring the message with the color argument of the logging call."""
+
+    def formatMessage(self, record):
+        color = getattr(record, 'color', None)
+        if color is None:
+            return super().formatMessage(record)
+        message = record.message
+        record.message = f"{COLOR_MAP[color]}{message}{Style.RESET_ALL}"
+        try:
+            return super().formatMessage(record)
+        finally:
+            record.message = message
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, thread, message, exception and the `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Hands the records over to the listener thread, which formats and writes them: the logging call only creates the
+    record. The message is rendered by the listener, so the arguments must not be changed after the call.
+
+    When the queue is full, records below WARNING are dropped (and counted) rather than blocking the caller.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class MessageSampler(logging.Filter):
+    """
+    Thins out the per-message records: keeps a `sample_rate` share of the records below WARNING, and at most
+    `rate_limit` of them per second (0: no limit). Warnings and errors are always kept.
+    """
+
+    def __init__(self, sample_rate=1.0, rate_limit=0):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self._lock = threading.Lock()
+        self._second = 0
+        self._count = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        if self.rate_limit:
+            with self._lock:
+                second = int(time.monotonic())
+                if second != self._second:
+                    self._second, self._count = second, 0
+                if self._count >= self.rate_limit:
+                    return False
+                self._count += 1
+        return True
+
+
 # Set the custom logger as the default logger
 logging.setLoggerClass(CustomLogger)
 
@@ -46,6 +145,11 @@ logging.setLoggerClass(CustomLogger)
 logger = logging.getLogger("RotatingLog")
 logger.setLevel(logging.DEBUG)  # Set minimum log level to DEBUG
 
+# Records logged for every message on the hot path (sampled, see `configure_logging`)
+message_sampler = MessageSampler()
+message_logger = logger.getChild("messages")
+message_logger.addFilter(message_sampler)
+
 # Create the logs directory if it doesn't exist
 try:
     Path('logs').mkdir(parents=True, exist_ok=True)
@@ -64,6 +168,59 @@ except Exception as e:
 
 # Add Stream Handler for console logging
 console_handler = logging.StreamHandler()
-console_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+console_formatter = ColorFormatter(TEXT_FORMAT)
 console_handler.setFormatter(console_formatter)
 logger.addHandler(console_handler)
+
+queue_handler = None
+_listener = None
+
+
+def configure_logging(level=None, log_format='text', asynchronous=True, queue_size=10000, sample_rate=1.0,
+                      rate_limit=0):
+    """
+    Apply the logging settings of `Config` (called once the environment is loaded).
+
+    :param log_format: One of LOG_FORMATS
+    :param asynchronous: Write the records from a background thread (see AsyncQueueHandler)
+    :param queue_size: Records waiting for the background thread
+    :param sample_rate: Share of the records of `message_logger` kept
+    :param rate_limit: Maximum records of `message_logger` per second, 0 for no limit
+    """
+    global queue_handler, _listener
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format: {log_format}. Expected one of {LOG_FORMATS}")
+    if level:
+        logger.setLevel(level)
+    console_handler.setFormatter(JsonFormatter() if log_format == 'json' else console_formatter)
+    message_sampler.sample_rate = sample_rate
+    message_sampler.rate_limit = rate_limit
+
+    if asynchronous and _listener is None:
+        queue_handler = AsyncQueueHandler(queue.Queue(queue_size))
+        _listener = QueueListener(queue_handler.queue, console_handler, respect_handler_level=True)
+        _listener.start()
+        logger.removeHandler(console_handler)
+        logger.addHandler(queue_handler)
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write the records still queued and stop the background thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_listener():
+    # the listener thread does not survive a fork (supervisor): the child gets its own queue and thread
+    global _listener
+    if _listener is None:
+        return
+    queue_handler.queue = queue.Queue(queue_handler.queue.maxsize)
+    _listener = QueueListener(queue_handler.queue, console_handler, respect_handler_level=True)
+    _listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_listener)
@@ -0,0 +1,157 @@
+"""
+Prometheus metrics of the worker, updated by the ETL loop, the aggregation store, the producers and the Flask API,
+and served on `GET /metrics` (see `register_metrics_endpoint`).
+
+When the consumers run in several processes (`supervisor.py`), set `PROMETHEUS_MULTIPROC_DIR` to an empty
+directory: every process writes its metrics there and `/metrics` aggregates them.
+"""
+import os
+import time
+
+from flask import Response, request
+
+# loads .env: PROMETHEUS_MULTIPROC_DIR must be set before prometheus_client is imported
+from config import Config
+from framework.commons.logger import logger
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, \
+    generate_latest, multiprocess
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+MESSAGES_IN = Counter('etl_messages_in_total', 'Records fetched from Kafka', ['consumer', 'topic'])
+MESSAGES_OUT = Counter('etl_messages_out_total', 'Messages sent to the output topics', ['consumer', 'topic'])
+PRODUCE_ERRORS = Counter('etl_produce_errors_total', 'Output sends the brokers failed to acknowledge', ['consumer'])
+PROCESS_SECONDS = Histogram('etl_process_seconds', 'Duration of process() for one message', ['consumer'],
+                            buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+PROCESS_BATCH_SECONDS = Histogram('etl_process_batch_seconds', 'Duration of the processing of a whole batch',
+                                  ['consumer'], buckets=(.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+RETRIES = Counter('etl_retries_total', 'Messages sent to a retry topic', ['consumer', 'topic'])
+DEAD_LETTERS = Counter('etl_dead_letters_total', 'Messages sent to the dead letter topic', ['consumer'])
+CONSUMER_LAG = Gauge('etl_consumer_lag', 'Records between the consumer position and the end of the partition',
+                     ['consumer', 'topic', 'partition'], multiprocess_mode='liveall')
+AGGREGATION_SECONDS = Histogram('etl_aggregation_seconds', 'Round trip of an exchange with the aggregation store',
+                                ['consumer', 'store'],
+                                buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1))
+POLL_BUSY_SECONDS = Counter('etl_poll_busy_seconds_total', 'Time spent handling records between two polls',
+                            ['consumer'])
+POLL_IDLE_SECONDS = Counter('etl_poll_idle_seconds_total', 'Time spent waiting for records in poll()', ['consumer'])
+HTTP_REQUESTS = Counter('etl_http_requests_total', 'Requests served by the API', ['method', 'endpoint', 'status'])
+HTTP_SECONDS = Histogram('etl_http_request_seconds', 'Duration of the requests served by the API',
+                         ['method', 'endpoint'])
+
+
+class PollTimer:
+    """
+    Splits the time of a message handling loop between waiting in `poll()` (idle) and handling what it returned
+    (busy); `busy / (busy + idle)` is the saturation of the loop.
+    """
+
+    def __init__(self, consumer_name):
+        self.busy = POLL_BUSY_SECONDS.labels(consumer_name)
+        self.idle = POLL_IDLE_SECONDS.labels(consumer_name)
+        self._last = None
+
+    def before_poll(self):
+        now = time.monotonic()
+        if self._last is not None:
+            self.busy.inc(now - self._last)
+        self._last = now
+
+    def after_poll(self):
+        now = time.monotonic()
+        self.idle.inc(now - self._last)
+        self._last = now
+
+
+class LagMonitor:
+    """
+    Publishes the lag of every assigned partition (end offset minus consumer position) every `interval_s` seconds.
+    Called from the polling thread, `end_offsets` being a broker round trip.
+    """
+
+    def __init__(self, consumer, consumer_name, interval_s=None):
+        self.consumer = consumer
+        self.consumer_name = consumer_name
+        self.interval_s = interval_s if interval_s is not None else Config.METRICS_LAG_INTERVAL_S
+        self._next = time.monotonic()
+        self._published = set()
+
+    def maybe_update(self):
+        if not self.interval_s or time.monotonic() < self._next:
+            return
+        self._next = time.monotonic() + self.interval_s
+        try:
+            self.update()
+        except Exception as e:
+            logger.warning(f"Failed to measure the consumer lag of {self.consumer_name}: {e}", 'yellow')
+
+    def update(self):
+        assignment = self.consumer.assignment()
+        end_offsets = self.consumer.end_offsets(list(assignment)) if assignment else {}
+        published = set()
+        for topic_partition, end_offset in end_offsets.items():
+            position = self.consumer.position(topic_partition)
+            if position is None or end_offset is None:
+                continue
+            labels = (self.consumer_name, topic_partition.topic, str(topic_partition.partition))
+            CONSUMER_LAG.labels(*labels).set(max(end_offset - position, 0))
+            published.add(labels)
+        # revoked partitions are measured by the consumer they moved to
+        for labels in self._published - published:
+            CONSUMER_LAG.remove(*labels)
+        self._published = published
+
+    def clear(self):
+        for labels in self._published:
+            CONSUMER_LAG.remove(*labels)
+        self._published = set()
+
+
+def count_in(consumer_name, records):
+    """:param records: Dictionary of TopicPartition -> list of records, as returned by a poll"""
+    for topic_partition, messages in records.items():
+        if messages:
+            MESSAGES_IN.labels(consumer_name, topic_partition.topic).inc(len(messages))
+
+
+def count_out(consumer_name, topic, futures):
+    """Count the sends of `futures` to `topic`, and their failures once the brokers answer."""
+    MESSAGES_OUT.labels(consumer_name, topic).inc(len(futures))
+    errors = PRODUCE_ERRORS.labels(consumer_name)
+    for future in futures:
+        future.add_errback(lambda _error: errors.inc())
+
+
+def mark_process_dead(pid):
+    """Drop the live gauges of a consumer process which exited (multiprocess mode)."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+def _collect():
+    if not MULTIPROCESS:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def register_metrics_endpoint(app):
+    """Serve the metrics on `GET /metrics` and measure the requests served by `app`."""
+
+    @app.before_request
+    def start_timer():
+        request.environ['etl.request_start'] = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = request.environ.get('etl.request_start')
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        if start is not None and endpoint != '/metrics':
+            HTTP_REQUESTS.labels(request.method, endpoint, str(response.status_code)).inc()
+            HTTP_SECONDS.labels(request.method, endpoint).observe(time.perf_counter() - start)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(_collect(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,15 @@
+import math
+
+PERCENTILES = (50, 90, 99)
+
+
+def summarize(durations):
+    """Count, mean, percentiles (nearest rank) and max of durations in seconds, in milliseconds."""
+    durations = sorted(durations)
+    count = len(durations)
+    summary = {'count': count, 'mean_ms': round(sum(durations) / count * 1000, 3)}
+    for percentile in PERCENTILES:
+        rank = max(math.ceil(percentile / 100 * count), 1)
+        summary[f"p{percentile}_ms"] = round(durations[rank - 1] * 1000, 3)
+    summary['max_ms'] = round(durations[-1] * 1000, 3)
+    return summary
@@ -0,0 +1,325 @@
+import bisect
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
+from threading import Lock
+
+from config import Config
+from framework.commons.codec import get_codec
+from framework.commons.logger import logger
+from framework.etl.timing_wheel import HierarchicalTimingWheel
+
+AGGREGATION_STORES = ('redis', 'local')
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class AggregationStore(ABC):
+    """
+    Keeps the parts of the pending aggregations until every input topic delivered one.
+    """
+
+    @abstractmethod
+    def aggregate_many(self, aggregations, expected, ttl, partitions=None):
+        """
+        Add parts to their aggregations, then return and remove the aggregations which are complete.
+
+        :param aggregations: Dictionary of key -> dictionary of source -> serialized part to add
+        :param expected: Number of distinct sources completing an aggregation
+        :param ttl: Expiration time in seconds of an incomplete aggregation
+        :param partitions: Dictionary of key -> Kafka partition the parts were consumed from
+        :return: Dictionary of key -> (dictionary of source -> serialized part) for the completed aggregations
+        """
+        pass
+
+    @abstractmethod
+    def restore_many(self, aggregations, ttl, partitions=None):
+        """
+        Put back aggregations returned by `aggregate_many` (e.g. when processing them failed).
+        """
+        pass
+
+    @abstractmethod
+    def sweep(self, limit):
+        """
+        Remove and return the incomplete aggregations whose deadline (first part + ttl) passed.
+
+        :param limit: Maximum number of aggregations to return
+        :return: Dictionary of key -> (dictionary of source -> serialized part), oldest first
+        """
+        pass
+
+    @abstractmethod
+    def backlog(self, ttl, buckets):
+        """
+        :param ttl: Expiration time in seconds of an incomplete aggregation
+        :param buckets: Upper bounds in seconds of the age histogram buckets
+        :return: Dictionary with the number of pending aggregations and their age histogram (cumulative count of
+                 aggregations younger than every bucket bound, plus `+Inf`)
+        """
+        pass
+
+    def on_partitions_revoked(self, revoked):
+        pass
+
+    def on_partitions_assigned(self, assigned):
+        pass
+
+
+class RedisAggregationStore(AggregationStore):
+    """
+    Aggregation store shared by every consumer of the group, backed by `RedisUtils` server-side scripts.
+
+    The incomplete aggregations are tracked in the sorted set `<name>:pending`, scored by deadline, so any consumer
+    of the group can sweep the expired ones in bulk.
+    """
+
+    def __init__(self, redis_util, name):
+        self.redis_util = redis_util
+        self.pending = f"{name}:pending"
+
+    def aggregate_many(self, aggregations, expected, ttl, partitions=None):
+        return self.redis_util.aggregate_many(aggregations, expected, ttl, self.pending, now_ms() + ttl * 1000)
+
+    def restore_many(self, aggregations, ttl, partitions=None):
+        self.redis_util.restore_many(aggregations, ttl, self.pending, now_ms() + ttl * 1000)
+
+    def sweep(self, limit):
+        return self.redis_util.sweep_expired(self.pending, now_ms(), limit)
+
+    def backlog(self, ttl, buckets):
+        # score = first part + ttl, so an aggregation is younger than `bound` if its score is above now - bound + ttl
+        origin = now_ms() + ttl * 1000
+        pipeline = self.redis_util.redis.pipeline()
+        pipeline.zcard(self.pending)
+        for bound in buckets:
+            pipeline.zcount(self.pending, origin - bound * 1000, '+inf')
+        pending, *counts = pipeline.execute()
+        histogram = dict(zip((str(bound) for bound in buckets), counts))
+        histogram['+Inf'] = pending
+        return {'pending': pending, 'age_histogram': histogram}
+
+
+class LocalAggregationStore(AggregationStore):
+    """
+    In-process aggregation store, for pipelines where every input topic is keyed by `id` and co-partitioned (same
+    number of partitions, same partitioner), so all the parts of an id are consumed from the same partition number
+    by the same consumer. Aggregating then costs microseconds instead of a Redis round trip.
+
+    The aggregations are sharded by partition, expire through a hierarchical timing wheel and the total size of the
+    stored parts is capped at `max_bytes` (the oldest aggregations are evicted first).
+
+    When partitions are revoked, their shards are dropped or, if `handoff` (a `RedisUtils`) is set, handed off to
+    Redis and loaded back by whichever consumer gets the partitions assigned.
+    """
+
+    def __init__(self, name, max_bytes, handoff=None, codec=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.handoff = handoff
+        self.codec = codec or get_codec()
+
+        self._lock = Lock()
+        self._parts = {}
+        self._first_seen = {}
+        self._partition_of = {}
+        self._shards = defaultdict(set)
+        # insertion order of the pending aggregations, oldest first
+        self._order = OrderedDict()
+        self._wheel = HierarchicalTimingWheel(now_ms())
+        # expired aggregations waiting for `sweep`
+        self._timed_out = OrderedDict()
+
+        self.size_bytes = 0
+        self.completed = 0
+        self.expired = 0
+        self.evicted = 0
+        self.dropped = 0
+
+    def _handoff_key(self, partition):
+        return f"{self.name}:handoff:{partition}"
+
+    def _insert(self, key, partition, first_seen):
+        parts = self._parts[key] = {}
+        self._first_seen[key] = first_seen
+        self._partition_of[key] = partition
+        self._shards[partition].add(key)
+        self._order[key] = None
+        return parts
+
+    def _remove(self, key):
+        parts = self._parts.pop(key)
+        self._first_seen.pop(key, None)
+        self.size_bytes -= sum(len(part) for part in parts.values())
+        self._shards[self._partition_of.pop(key)].discard(key)
+        self._order.pop(key, None)
+        self._wheel.cancel(key)
+        return parts
+
+    def _add_parts(self, key, parts, partition, now):
+        stored = self._parts.get(key)
+        if stored is None:
+            stored = self._insert(key, partition, now)
+        for source, part in parts.items():
+            previous = stored.get(source)
+            if previous is not None:
+                self.size_bytes -= len(previous)
+            stored[source] = part
+            self.size_bytes += len(part)
+        return stored
+
+    def _expire(self, now):
+        for key in self._wheel.advance(now):
+            self._timed_out[key] = self._remove(key)
+            self.expired += 1
+
+    def _evict(self):
+        while self.size_bytes > self.max_bytes and self._order:
+            key = next(iter(self._order))
+            self._remove(key)
+            self.evicted += 1
+            logger.warning(f"Aggregation {key} evicted: local aggregation store is over {self.max_bytes} bytes")
+
+    def aggregate_many(self, aggregations, expected, ttl, partitions=None):
+        partitions = partitions or {}
+        now = now_ms()
+        completed = {}
+        with self._lock:
+            self._expire(now)
+            for key, parts in aggregations.items():
+                stored = self._add_parts(key, parts, partitions.get(key), now)
+                if len(stored) >= expected:
+                    completed[key] = self._remove(key)
+                    self.completed += 1
+                elif key not in self._wheel:
+                    # the deadline counts from the first part
+                    self._wheel.schedule(key, now + ttl * 1000)
+            self._evict()
+        return completed
+
+    def restore_many(self, aggregations, ttl, partitions=None):
+        partitions = partitions or {}
+        now = now_ms()
+        with self._lock:
+            for key, parts in aggregations.items():
+                self._add_parts(key, parts, partitions.get(key), now)
+                if key not in self._wheel:
+                    self._wheel.schedule(key, now + ttl * 1000)
+            self._evict()
+
+    def sweep(self, limit):
+        with self._lock:
+            self._expire(now_ms())
+            expired = {}
+            while self._timed_out and len(expired) < limit:
+                key, parts = self._timed_out.popitem(last=False)
+                expired[key] = parts
+            return expired
+
+    def backlog(self, ttl, buckets):
+        now = now_ms()
+        with self._lock:
+            ages = sorted((now - first_seen) / 1000 for first_seen in self._first_seen.values())
+        histogram = {str(bound): bisect.bisect_right(ages, bound) for bound in buckets}
+        histogram['+Inf'] = len(ages)
+        return {'pending': len(ages), 'age_histogram': histogram}
+
+    def on_partitions_revoked(self, revoked):
+        partitions = {topic_partition.partition for topic_partition in revoked}
+        with self._lock:
+            for partition in partitions:
+                keys = list(self._shards.get(partition, ()))
+                snapshot = {}
+                for key in keys:
+                    deadline = self._wheel.deadline(key)
+                    first_seen = self._first_seen.get(key)
+                    snapshot[key] = {'parts': self._remove(key), 'deadline': deadline, 'first_seen': first_seen}
+                self._shards.pop(partition, None)
+                if not snapshot:
+                    continue
+                if self.handoff:
+                    self._hand_off(partition, snapshot)
+                else:
+                    self.dropped += len(snapshot)
+                    logger.warning(f"{len(snapshot)} pending aggregations of partition {partition} dropped")
+
+    def _hand_off(self, partition, snapshot):
+        try:
+            ttl = max(entry['deadline'] or 0 for entry in snapshot.values()) - now_ms()
+            # the parts are embedded decoded, so any codec can serialize the entry
+            mapping = {
+                key: self.codec.dumps(dict(entry, parts={source: self.codec.loads(part)
+                                                         for source, part in entry['parts'].items()}))
+                for key, entry in snapshot.items()
+            }
+            pipeline = self.handoff.redis.pipeline()
+            pipeline.hset(self._handoff_key(partition), mapping=mapping)
+            pipeline.pexpire(self._handoff_key(partition), max(ttl, 1))
+            pipeline.execute()
+            logger.info(f"{len(snapshot)} pending aggregations of partition {partition} handed off")
+        except Exception as e:
+            self.dropped += len(snapshot)
+            logger.error(f"Failed to hand off the aggregations of partition {partition}: {e}", "red_back")
+
+    def on_partitions_assigned(self, assigned):
+        if not self.handoff:
+            return
+        partitions = sorted({topic_partition.partition for topic_partition in assigned})
+        try:
+            pipeline = self.handoff.redis.pipeline()
+            for partition in partitions:
+                pipeline.hgetall(self._handoff_key(partition))
+                pipeline.delete(self._handoff_key(partition))
+            results = pipeline.execute()[::2]
+        except Exception as e:
+            logger.error(f"Failed to load the handed off aggregations: {e}", "red_back")
+            return
+
+        now = now_ms()
+        with self._lock:
+            for partition, snapshot in zip(partitions, results):
+                for key, entry in snapshot.items():
+                    key = key.decode('utf-8') if isinstance(key, bytes) else key
+                    entry = self.codec.loads(entry)
+                    entry['parts'] = {source: self.codec.dumps(part) for source, part in entry['parts'].items()}
+                    if entry['deadline'] is None or entry['deadline'] <= now:
+                        # expired while handed off: let the timeout policy handle it
+                        self._timed_out[key] = entry['parts']
+                        self.expired += 1
+                        continue
+                    self._add_parts(key, entry['parts'], partition, entry.get('first_seen') or now)
+                    self._wheel.schedule(key, entry['deadline'])
+                if snapshot:
+                    logger.info(f"{len(snapshot)} pending aggregations of partition {partition} taken over")
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._parts),
+                'timed_out': len(self._timed_out),
+                'size_bytes': self.size_bytes,
+                'shards': {partition: len(keys) for partition, keys in self._shards.items() if keys},
+                'completed': self.completed,
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'dropped': self.dropped,
+            }
+
+
+def create_aggregation_store(config, consumer_name, redis_util, codec=None):
+    """
+    Create the aggregation store selected by `ConsumerConfig.aggregation_store` (`redis` by default).
+
+    :param redis_util: RedisUtils returning the values in the form `codec` decodes (bytes for a binary codec)
+    :param codec: Codec of the parts
+    """
+    store = config.aggregation_store or 'redis'
+    if store == 'redis':
+        return RedisAggregationStore(redis_util, consumer_name)
+    if store == 'local':
+        handoff = redis_util if Config.LOCAL_AGGREGATION_HANDOFF else None
+        return LocalAggregationStore(consumer_name, Config.LOCAL_AGGREGATION_MAX_BYTES, handoff, codec)
+    raise ValueError(f"Unknown aggregation store: {store}. Expected one of {AGGREGATION_STORES}")
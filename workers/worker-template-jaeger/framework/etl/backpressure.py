@@ -0,0 +1,76 @@
+from config import Config
+from framework.commons.logger import logger
+
+
+class Backpressure:
+    """
+    Bounds the records in flight: fetched but not completed yet (queued on the execution lanes, processing, or
+    waiting for the broker acknowledgement of their outputs).
+
+    Once `max_in_flight` records are in flight, every assigned partition is paused: the loop keeps polling, so the
+    consumer stays in its group, but nothing more is fetched. They are resumed once the records in flight drop to
+    `resume_in_flight`. The in-flight buffer is thus bounded by `max_in_flight` plus one poll (`max_poll_records`),
+    whatever the speed of `process()` and of the brokers.
+
+    The retry partitions held by the `RetryScheduler` stay paused when the backpressure is released, and the
+    scheduler leaves the partitions paused here alone when their retries become due.
+    """
+
+    def __init__(self, consumer, retry_scheduler, max_in_flight=None, resume_in_flight=None):
+        """
+        :param consumer: KafkaConsumer of the message handling loop
+        :param retry_scheduler: RetryScheduler pausing the retry partitions whose messages are not due yet
+        :param max_in_flight: High watermark, `MAX_IN_FLIGHT` by default
+        :param resume_in_flight: Low watermark, `RESUME_IN_FLIGHT` by default (half of the high watermark if not set)
+        """
+        self.consumer = consumer
+        self.retry_scheduler = retry_scheduler
+        self.max_in_flight = max_in_flight or Config.MAX_IN_FLIGHT
+        self.resume_in_flight = resume_in_flight if resume_in_flight is not None else \
+            Config.RESUME_IN_FLIGHT if Config.RESUME_IN_FLIGHT is not None else self.max_in_flight // 2
+
+        self._paused = set()
+        self._active = False
+        self._reassigned = False
+        self.pauses = 0
+
+    def holds(self, topic_partition):
+        """True if `topic_partition` is paused by the backpressure."""
+        return self._active and topic_partition in self._paused
+
+    def update(self, in_flight):
+        """
+        Pause or resume the assigned partitions according to the records in flight. Called from the polling thread,
+        before every poll.
+        """
+        if not self._active:
+            self._reassigned = False
+            if in_flight >= self.max_in_flight:
+                self._pause(self.consumer.assignment())
+                self._active = True
+                self.pauses += 1
+                logger.warning(f"{in_flight} records in flight: fetching paused until {self.resume_in_flight}",
+                               'yellow')
+            return
+
+        if in_flight <= self.resume_in_flight:
+            resumed = [topic_partition for topic_partition in self._paused & self.consumer.assignment()
+                       if not self.retry_scheduler.holds(topic_partition)]
+            if resumed:
+                self.consumer.resume(*resumed)
+            self._paused.clear()
+            self._active = False
+            logger.info(f"{in_flight} records in flight: fetching resumed", 'green')
+        elif self._reassigned:
+            # a rebalance resets the pause state of the partitions
+            self._pause(self.consumer.assignment())
+        self._reassigned = False
+
+    def on_partitions_assigned(self, assigned):
+        self._reassigned = True
+
+    def _pause(self, partitions):
+        partitions = set(partitions)
+        if partitions:
+            self.consumer.pause(*partitions)
+        self._paused = partitions
@@ -0,0 +1,104 @@
+from threading import Event, Lock, Thread
+
+from config import Config
+from framework.commons.logger import logger
+from models.models import ConsumerConfig, create_session
+
+# settings which apply to a running message handling loop, the others need a restart
+LIVE_SETTINGS = ('metadatas', 'timeout', 'topics_input', 'topics_output')
+RESTART_SETTINGS = tuple(name for name in ConsumerConfig.__table__.columns.keys()
+                         if name not in LIVE_SETTINGS + ('id', 'updated_at'))
+
+
+class ConsumerConfigCache:
+    """
+    In-memory `ConsumerConfig` of the consumers of this process, refreshed in the background.
+
+    Every `refresh_interval` seconds, a single query reads the version (id, updated_at) of the cached configurations
+    and only the rows whose version changed are loaded again (the editor rewrites the rows on every save, so a new id
+    is a change as well). A reloaded configuration replaces the cached object, which is never modified in place: a
+    reader always sees a consistent configuration.
+    """
+
+    def __init__(self, refresh_interval=None):
+        """
+        :param refresh_interval: Seconds between two refreshes, `CONFIG_REFRESH_INTERVAL_S` by default, 0 to disable
+        """
+        self.refresh_interval = refresh_interval if refresh_interval is not None else Config.CONFIG_REFRESH_INTERVAL_S
+
+        self._lock = Lock()
+        self._configs = {}
+        self._versions = {}
+        self._thread = None
+        self._stopped = Event()
+
+    def get(self, consumer_name):
+        """
+        :return: The latest known ConsumerConfig of `consumer_name` (detached from its session)
+        :raises Exception: if the consumer has no configuration
+        """
+        config = self._configs.get(consumer_name)
+        if config is None:
+            config = self._load(consumer_name)
+            self._start()
+        return config
+
+    def refresh(self):
+        """
+        Reload the cached configurations which changed in the database.
+
+        :return: Names of the consumers whose configuration was reloaded
+        """
+        names = list(self._configs)
+        if not names:
+            return []
+        session = create_session()
+        try:
+            rows = session.query(ConsumerConfig.consumer_name, ConsumerConfig.id, ConsumerConfig.updated_at) \
+                .filter(ConsumerConfig.consumer_name.in_(names)).all()
+        finally:
+            session.close()
+
+        versions = {name: (config_id, updated_at) for name, config_id, updated_at in rows}
+        changed = [name for name in names if name in versions and versions[name] != self._versions.get(name)]
+        for name in changed:
+            self._load(name)
+            logger.info(f"Configuration of {name} reloaded", 'blue')
+        return changed
+
+    def stop(self):
+        self._stopped.set()
+
+    def _load(self, consumer_name):
+        session = create_session()
+        try:
+            config = session.query(ConsumerConfig).filter_by(consumer_name=consumer_name).first()
+            if config:
+                session.expunge(config)
+        finally:
+            session.close()
+        if not config:
+            raise Exception(f"No configuration found for consumer: {consumer_name}")
+
+        with self._lock:
+            self._configs[consumer_name] = config
+            self._versions[consumer_name] = (config.id, config.updated_at)
+        return config
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None or not self.refresh_interval:
+                return
+            self._thread = Thread(target=self._run, name='config-refresh', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh the consumer configurations: {e}", "red_back")
+
+
+# shared by every message handling loop of the process
+config_cache = ConsumerConfigCache()
@@ -0,0 +1,61 @@
+import queue
+
+from config import Config
+
+# consumer name -> EtlContext of the running message handling loops (read by the supervisor and the monitoring API)
+contexts = {}
+
+
+class EtlContext:
+    """
+    State of one message handling loop: its configuration, Kafka clients and the components tracking offsets,
+    retries and parallel execution. It is created by `handle_message` and passed to every ETL step.
+    """
+
+    def __init__(self, consumer_name, config, consumer, producer, topics_input, output_topics):
+        self.consumer_name = consumer_name
+        self.config = config
+        self.consumer = consumer
+        self.producer = producer
+        self.topics_input = topics_input
+        self.output_topics = output_topics
+
+        self.process = None
+        self.process_batch = None
+        self.codec = None
+        self.offsets = None
+        self.aggregation_store = None
+        self.timeouts = None
+        self.retries = None
+        self.retry_scheduler = None
+        self.delivery = None
+        self.engine = None
+        # records the execution lanes failed to send to retry, nacked by the polling thread
+        self.nacks = queue.SimpleQueue()
+        self.backpressure = None
+        self.rebalance_listener = None
+        self.poll_timer = None
+        self.stage_timer = None
+        self.lag_monitor = None
+        self.stop_event = None
+        # exactly-once mode: the aggregations completed in the current transaction, put back if it is aborted
+        self.transactional = False
+        self.transaction_parts = None
+
+    @property
+    def stopped(self):
+        """True once the loop was asked to stop (see `handle_message`)."""
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    @property
+    def total_expected(self):
+        """Number of parts (one per input topic) expected for a message id."""
+        return len(self.topics_input)
+
+    @property
+    def aggregating(self):
+        return not (self.total_expected == 1 or Config.IS_AGGREGATOR is False)
+
+    @property
+    def batching(self):
+        return bool(self.config.batch_size and self.config.batch_size > 1)
@@ -0,0 +1,156 @@
+from threading import Lock
+
+from kafka import TopicPartition
+
+from framework.commons.logger import logger
+
+
+class _Delivery:
+    """Sends still unconfirmed for a group of input records."""
+
+    __slots__ = ('messages', 'remaining', 'failed', 'retry', 'on_confirmed', 'on_failed')
+
+    def __init__(self, messages, remaining, retry, on_confirmed=None, on_failed=None):
+        self.messages = messages
+        self.remaining = remaining
+        self.failed = False
+        self.retry = retry
+        self.on_confirmed = on_confirmed
+        self.on_failed = on_failed
+
+
+class DeliveryTracker:
+    """
+    Completes input records only once the messages produced from them are acknowledged by the brokers.
+
+    `producer.send` is asynchronous: the records are batched by the producer and the broker acknowledgements come
+    back on its I/O thread. Instead of waiting on every send (`future.get()`), a callback is attached to each send
+    future and the input offsets are handed to the `OffsetTracker` when the last one is confirmed, so a record is
+    never committed before its outputs are safely written (at-least-once end to end), while the sends stay
+    pipelined.
+
+    If a send fails, `on_failure(message, error)` is called for each input record: it moves the record to the retry
+    topics and tracks that send in turn (with `retry=False`). If even that fails, `on_undelivered(message)` hands the
+    record back to be read again from its offset (see `send_nack`), so its partition does not stop advancing.
+    """
+
+    def __init__(self, offsets, producers, on_failure, on_undelivered=None):
+        """
+        :param offsets: OffsetTracker completing the input records
+        :param producers: KafkaProducers of the tracked sends (outputs and retries), flushed by `flush`
+        :param on_failure: Called with (input record, error) when an output of the record failed to be sent, it must
+                           complete the record (e.g. through `track`) once it is safely retried
+        :param on_undelivered: Called with an input record whose output and retry both failed to be sent (on the
+                               producer I/O thread), it must have the record read again
+        """
+        self.offsets = offsets
+        self.producers = producers
+        self.on_failure = on_failure
+        self.on_undelivered = on_undelivered
+
+        self._lock = Lock()
+        self._pending = 0
+        self.confirmed = 0
+        self.failed = 0
+
+    def track(self, message, futures, retry=True):
+        """
+        Complete `message` once all `futures` are confirmed (immediately if there are none).
+
+        :param retry: Move the message to the retry topics if a send fails (False for the sends to the retry topics
+                      themselves)
+        """
+        self.track_many([message], futures, retry)
+
+    def track_many(self, messages, futures, retry=True):
+        """Complete all `messages` once all `futures` (e.g. the outputs of a whole batch) are confirmed."""
+        if not futures:
+            self._complete(messages)
+            return
+
+        delivery = _Delivery(messages, len(futures), retry)
+        with self._lock:
+            self._pending += 1
+        for future in futures:
+            future.add_callback(self._on_sent, delivery)
+            future.add_errback(self._on_error, delivery)
+
+    def track_sends(self, futures, on_confirmed, on_failed):
+        """
+        Sends which were not produced from an input record (e.g. the expired aggregations): `on_confirmed()` is
+        called once all `futures` are confirmed, `on_failed(error)` on the first failure (on the producer I/O thread).
+        They are waited for by `flush` like the tracked records.
+        """
+        if not futures:
+            on_confirmed()
+            return
+
+        delivery = _Delivery([], len(futures), False, on_confirmed, on_failed)
+        with self._lock:
+            self._pending += 1
+        for future in futures:
+            future.add_callback(self._on_sent, delivery)
+            future.add_errback(self._on_error, delivery)
+
+    def pending(self):
+        """Number of record groups waiting for a broker acknowledgement."""
+        with self._lock:
+            return self._pending
+
+    def flush(self, timeout=None):
+        """Wait until every pending send is acknowledged (or failed), so its input records can be committed."""
+        for producer in self.producers:
+            producer.flush(timeout=timeout)
+
+    def _on_sent(self, delivery, _record_metadata):
+        with self._lock:
+            delivery.remaining -= 1
+            done = delivery.remaining == 0 and not delivery.failed
+            if done:
+                self._pending -= 1
+                self.confirmed += 1
+        if done:
+            if delivery.on_confirmed:
+                self._call(delivery.on_confirmed)
+            self._complete(delivery.messages)
+
+    def _on_error(self, delivery, error):
+        with self._lock:
+            if delivery.failed:
+                return
+            delivery.failed = True
+            self._pending -= 1
+            self.failed += 1
+
+        if delivery.on_failed:
+            self._call(delivery.on_failed, error)
+            return
+        logger.error(f"Failed to send the output of {len(delivery.messages)} messages: {error}", "red_back")
+        if not delivery.retry:
+            self._undelivered(delivery.messages)
+            return
+        for message in delivery.messages:
+            try:
+                self.on_failure(message, error)
+            except Exception as e:
+                logger.error(f"Failed to send message to retry: {e}", "red_back")
+                self._undelivered([message])
+
+    def _undelivered(self, messages):
+        if self.on_undelivered is None:
+            logger.error(f"{len(messages)} messages will be consumed again after a restart", "red_back")
+            return
+        logger.warning(f"{len(messages)} messages will be read again from their offset", "yellow")
+        for message in messages:
+            self._call(self.on_undelivered, message)
+
+    @staticmethod
+    def _call(callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"Delivery callback failed: {e}", "red_back")
+
+    def _complete(self, messages):
+        for message in messages:
+            self.offsets.complete(TopicPartition(message.topic, message.partition), message.offset)
@@ -0,0 +1,91 @@
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from framework.commons.logger import logger
+
+EXECUTOR_TYPES = ('sync', 'thread', 'process')
+
+
+class ExecutionEngine:
+    """
+    Dispatches Kafka records to N worker lanes while keeping the order within each partition.
+
+    Every partition is pinned to one lane (a thread with its own FIFO queue), so records of the same partition
+    are always handled one after the other, in offset order. Records of different partitions run in parallel.
+
+    In `thread` mode, the task runs directly on the lane thread (best for I/O-bound `process()` functions).
+    In `process` mode, the lanes hand the CPU-heavy part (see `run`) to a pool of N processes, so a worker can
+    use every core of the pod.
+
+    Each lane queues at most `queue_size` records: once the lane of a partition is full, `submit` blocks the poll
+    loop until the lane catches up, so a slow partition does not pile up fetched records in memory.
+    """
+
+    def __init__(self, mode='thread', workers=1, queue_size=500):
+        if mode not in EXECUTOR_TYPES:
+            raise ValueError(f"Unknown executor type: {mode}. Expected one of {EXECUTOR_TYPES}")
+
+        self.mode = mode
+        self.workers = max(int(workers), 1)
+        self._process_pool = None
+        if self.mode == 'process':
+            # spawn: forking a process that already runs Kafka/Redis client threads is not safe
+            self._process_pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+
+        self._queues = [queue.Queue(maxsize=max(int(queue_size), 1)) for _ in range(self.workers)]
+        self._lanes = [
+            threading.Thread(target=self._run_lane, args=(lane_queue,), name=f"etl-lane-{index}", daemon=True)
+            for index, lane_queue in enumerate(self._queues)
+        ]
+        for lane in self._lanes:
+            lane.start()
+        logger.info(f"Execution engine started: {self.workers} {self.mode} lane(s)")
+
+    def _run_lane(self, lane_queue):
+        while True:
+            item = lane_queue.get()
+            try:
+                if item is None:
+                    return
+                task, args = item
+                task(*args)
+            except Exception as e:
+                logger.error(f"Unhandled error in execution lane: {e}", "red_back")
+            finally:
+                lane_queue.task_done()
+
+    def submit(self, topic_partition, task, *args):
+        """
+        Queue `task(*args)` on the lane owning `topic_partition`, waiting for room if its queue is full.
+        """
+        self._queues[hash(topic_partition) % self.workers].put((task, args))
+
+    def run(self, fn, *args):
+        """
+        Run `fn(*args)` from a lane: in the process pool in `process` mode, inline otherwise.
+        `fn` and its arguments must be picklable in `process` mode.
+        """
+        if self._process_pool:
+            return self._process_pool.submit(fn, *args).result()
+        return fn(*args)
+
+    def in_flight(self):
+        """Number of queued and running tasks."""
+        return sum(lane_queue.unfinished_tasks for lane_queue in self._queues)
+
+    def drain(self):
+        """Block until every queued task completed."""
+        for lane_queue in self._queues:
+            lane_queue.join()
+
+    def shutdown(self):
+        for lane_queue in self._queues:
+            lane_queue.put(None)
+        for lane in self._lanes:
+            lane.join()
+        if self._process_pool:
+            self._process_pool.shutdown(wait=True)
+        logger.info("Execution engine stopped.")
@@ -1,45 +1,121 @@
+import importlib
 import time
 from collections import defaultdict
+from socket import gethostname
 from time import sleep
 
-from kafka import KafkaConsumer, KafkaProducer, TopicPartition
+from kafka import TopicPartition
 from kafka.errors import NoBrokersAvailable, KafkaError
-import json
 
+from framework.commons.codec import get_codec
+from framework.commons.metrics import AGGREGATION_SECONDS, PROCESS_BATCH_SECONDS, PROCESS_SECONDS, LagMonitor, \
+    PollTimer, count_in, count_out
+from framework.etl.aggregation import create_aggregation_store
+from framework.etl.backpressure import Backpressure
+from framework.etl.config_cache import RESTART_SETTINGS, config_cache
+from framework.etl.context import EtlContext, contexts
+from framework.etl.delivery import DeliveryTracker
+from framework.etl.executor import ExecutionEngine
+from framework.etl.offsets import OffsetTracker, OffsetCommitListener
+from framework.etl.retry import RetryRouter, RetryScheduler, source_topic
+from framework.etl.stage_timing import StageTimer
+from framework.etl.timeouts import AggregationTimeoutManager, timeout_managers
 from framework.redis.redis_utils import RedisUtils
-from models.models import ConsumerConfig, create_session, init_db
+from framework.streams.backend import new_consumer, new_producer
+from models.models import init_db
 from config import Config
-from framework.commons.logger import logger
-from ops_service.worker_kafka import process
+from framework.commons.logger import logger, message_logger
 
 # Initialize the database
 init_db()
 
-retry_number = 0
-
 redis_util = RedisUtils(host=Config.REDIS_HOST, port=int(Config.REDIS_PORT), db=int(Config.REDIS_DB),
                         password=Config.REDIS_PASSWORD)
+# for the aggregation parts of binary codecs
+binary_redis_util = RedisUtils(host=Config.REDIS_HOST, port=int(Config.REDIS_PORT), db=int(Config.REDIS_DB),
+                               password=Config.REDIS_PASSWORD, binary=True)
 
 
 def fetch_configuration(consumer_name):
-    session = create_session()
-    config = session.query(ConsumerConfig).filter_by(consumer_name=consumer_name).first()
-    session.close()
-    if config:
-        return config
-    else:
-        raise Exception(f"No configuration found for consumer: {consumer_name}")
+    """The latest ConsumerConfig of `consumer_name`, from the configuration cache (no database round trip)."""
+    return config_cache.get(consumer_name)
+
+
+def refresh_configuration(ctx):
+    """
+    Switch the message handling loop to the latest configuration of its consumer, if it changed: `metadatas` and
+    `timeout` apply to the next messages, new topics are applied in place (see `resubscribe`), the other settings
+    after a restart. Called from the polling thread, between two polls.
+    """
+    config = config_cache.get(ctx.consumer_name)
+    if config is ctx.config:
+        return
+    restart = [name for name in RESTART_SETTINGS if getattr(config, name) != getattr(ctx.config, name)]
+    if restart:
+        logger.warning(f"Changes to {restart} of {ctx.consumer_name} apply after a restart", 'yellow')
+    previous, ctx.config = ctx.config, config
+    if ctx.timeouts:
+        ctx.timeouts.ttl = aggregation_ttl(ctx)
+    if (config.topics_input, config.topics_output) != (previous.topics_input, previous.topics_output):
+        resubscribe(ctx, config.topics_input.split(','), config.topics_output.split(','))
+    logger.info(f"Configuration of {ctx.consumer_name} updated", 'blue')
+
+
+def resubscribe(ctx, topics_input, output_topics):
+    """
+    Rewire a running message handling loop to new input and output topics, keeping its consumer and producer (no
+    reconnection, a single rebalance if the input topics changed).
+
+    What was fetched before is processed, delivered and committed first, so no record is sent to the new output
+    topics because of the switch and none is lost. Pending aggregations then expect one part per new input topic.
+    """
+    if ctx.engine:
+        ctx.engine.drain()
+    ctx.delivery.flush()
+    if not ctx.transactional:
+        ctx.offsets.commit(ctx.consumer)
+
+    ctx.output_topics = output_topics
+    if topics_input != ctx.topics_input:
+        ctx.topics_input = topics_input
+        ctx.consumer.subscribe(topics_input + ctx.retries.topics, listener=ctx.rebalance_listener)
+        if ctx.aggregating and not ctx.timeouts:
+            watch_timeouts(ctx)
+    logger.info(f"{ctx.consumer_name} now reads {ctx.topics_input} and writes {ctx.output_topics}", 'blue')
 
 
-def create_kafka_consumer(topics_input, bootstrap_servers):
+def watch_timeouts(ctx):
+    ctx.timeouts = AggregationTimeoutManager(ctx.aggregation_store, aggregation_ttl(ctx), ctx.config.timeout_policy)
+    timeout_managers[ctx.consumer_name] = ctx.timeouts
+
+
+def load_processors(module_path=None):
+    """
+    Import the processing functions of a consumer.
+
+    :param module_path: Module defining `process` and optionally `process_batch` (`ConsumerConfig.process_module`),
+                        `PROCESS_MODULE` if None
+    :return: (process, process_batch); workers that don't define process_batch get process() applied message by
+             message
+    """
+    module = importlib.import_module(module_path or Config.PROCESS_MODULE)
+    return module.process, getattr(module, 'process_batch', None)
+
+
+def create_kafka_consumer(topics_input, bootstrap_servers, profile=None, group_id=None):
+    """
+    :param profile: Consumer settings of the worker (see `CONSUMER_PROFILE`)
+    :param group_id: Consumer group, `WORKER_NAME` if None (the consumer name in host mode)
+    """
     while True:
         try:
-            consumer = KafkaConsumer(
-                *topics_input,
-                bootstrap_servers=bootstrap_servers,
+            consumer = new_consumer(
+                topics_input, bootstrap_servers, Config.KAFKA_BACKEND,
                 auto_offset_reset='earliest',
-                enable_auto_commit=True,
-                group_id=Config.WORKER_NAME
+                # offsets are committed explicitly, once the messages were processed
+                enable_auto_commit=False,
+                group_id=group_id or Config.WORKER_NAME,
+                **(profile or {})
             )
             logger.info(f"Kafka consumer connected to topics {topics_input}")
             return consumer
@@ -54,12 +130,22 @@ def create_kafka_consumer(topics_input, bootstrap_servers):
             time.sleep(5)
 
 
-def create_kafka_producer(bootstrap_servers, output_topics):
+def create_kafka_producer(bootstrap_servers, output_topics, codec=None, profile=None, transactional_id=None):
+    """
+    :param codec: Codec serializing the messages
+    :param profile: Producer settings of the worker (see `PRODUCER_PROFILE`), e.g. compression and batching
+    :param transactional_id: Transactional producer for the exactly-once mode (see `transactional_id`)
+    """
+    codec = codec or get_codec(Config.CODEC)
+    if transactional_id and Config.KAFKA_BACKEND != 'confluent':
+        raise ValueError("KAFKA_EXACTLY_ONCE requires KAFKA_BACKEND=confluent")
     while True:
         try:
-            producer = KafkaProducer(
-                bootstrap_servers=bootstrap_servers,
-                value_serializer=lambda v: json.dumps(v).encode('utf-8')
+            producer = new_producer(
+                bootstrap_servers, Config.KAFKA_BACKEND,
+                transactional_id=transactional_id,
+                value_serializer=codec.dumps,
+                **(profile or {})
             )
             logger.info(f"Kafka producer connected to topics {output_topics}")
             return producer
@@ -74,124 +160,728 @@ def create_kafka_producer(bootstrap_servers, output_topics):
             time.sleep(5)
 
 
-def send_ack(consumer, message):
+def transactional_id(consumer_name=Config.WORKER_NAME, instance=None):
+    """
+    Transactional id of the producer of this worker instance in exactly-once mode, None otherwise. It must be stable
+    across restarts of the instance, so a restarted producer fences off its zombie predecessor.
+
+    :param instance: Index of the consumer process on this host, when the supervisor runs several
+    """
+    if not Config.KAFKA_EXACTLY_ONCE:
+        return None
+    return f"{consumer_name}-{gethostname()}" + (f"-{instance}" if instance is not None else "")
+
+
+def send_ack(ctx, message):
     try:
-        # todo: sa-si tina valoarea actuala a rety-ului pt id-ul mesajul in Redis
-        global retry_number
-        if retry_number > 0:
-            retry_number = 0
-        # Commit the offset to acknowledge successful processing
-        consumer.commit()
-        logger.debug(f"Ack sent for message: {message}")
+        # Mark the offset as processed; it is committed by the offset tracker
+        ctx.offsets.complete(TopicPartition(message.topic, message.partition), message.offset)
+        message_logger.debug("Ack sent for message %s-%s@%s", message.topic, message.partition, message.offset)
     except Exception as e:
         logger.error(f"Failed to send ack: {e}")
 
 
-def send_nack(consumer, message):
+def send_nack(ctx, message):
+    """
+    Re-read a message from its offset in NACK_TIME seconds. Its partition is paused until then (see
+    `RetryScheduler.hold`) rather than the loop sleeping, so the other partitions keep flowing. Polling thread only.
+    """
     try:
-        # todo: retry-ul merge la infinit
-        # todo: sa-si tina valoarea actuala a rety-ului pt id-ul mesajul in Redis
-        global retry_number
-        retry_number += 1
-        logger.info(f"Retry number: {retry_number}")
-        # Create a TopicPartition instance for the current message
         topic_partition = TopicPartition(message.topic, message.partition)
-        time.sleep(Config.NACK_TIME)
-
-        # Seek to the message's offset to retry it on the next poll
-        consumer.seek(topic_partition, message.offset)
-        logger.warning(f"Nack sent for message: {message}. Will retry in the next poll.")
+        due = int(time.time() * 1000) + Config.NACK_TIME * 1000
+        ctx.retry_scheduler.hold(ctx.consumer, ctx.offsets, topic_partition, message.offset, due)
+        logger.warning("Nack sent for message %s-%s@%s. Will retry in %s s.", message.topic, message.partition,
+                       message.offset, Config.NACK_TIME)
+        if Config.LOG_PAYLOADS:
+            message_logger.debug("Nacked message: %s", message.value)
     except Exception as e:
         logger.error(f"Failed to send nack: {e}")
 
 
-def handle_message(consumer, producer, topics_input, output_topics, consumer_name=Config.WORKER_NAME):
+def release_nacks(ctx):
+    """
+    Nack the messages the execution lanes and the delivery callbacks could not send to retry (only the polling thread
+    can rewind). A partition is rewound once, to its lowest nacked offset, and only to a record still in flight: the
+    nacks of records already rewound (or revoked) would skip the records read again since.
+    """
+    lowest = {}
+    while not ctx.nacks.empty():
+        message = ctx.nacks.get()
+        topic_partition = TopicPartition(message.topic, message.partition)
+        if not ctx.offsets.in_flight(topic_partition, message.offset):
+            continue
+        if topic_partition not in lowest or message.offset < lowest[topic_partition].offset:
+            lowest[topic_partition] = message
+    for message in lowest.values():
+        send_nack(ctx, message)
+
+
+def send_to_retry(ctx, message, error):
+    """
+    Move a failed message to its next retry topic (or to the dead letter topic) and ack it once the retry topic
+    confirmed it.
+
+    :return: False if the message could not be moved and was nacked instead (its partition will be re-read from
+             its offset), True otherwise.
+    """
     try:
-        logger.info("Starting message handling loop...")
+        future = ctx.retries.retry(message, error)
+    except Exception as e:
+        logger.error(f"Failed to send message to retry: {e}", "red_back")
+        send_nack(ctx, message)
+        return False
+    ctx.delivery.track(message, [future], retry=False)
+    return True
 
-        config = fetch_configuration(consumer_name)
 
-        for message in consumer:
-            try:
-                if retry_number > Config.RETRY_COUNT:
-                    try:
-                        message_value = json.loads(message.value.decode('utf-8'))
-
-                    except Exception as e:
-                        # todo: implementat exceptie daca json-ul e corupt
-                        message_value = "Error parsing message_value"
-
-                    producer.send(Config.ERROR_TOPIC, message_value)
-                    logger.info("Message sent to dead_letter topic")
-                    # Send ack
-                    try:
-                        send_ack(consumer, message)
-                    except:
-                        logger.warn(f"Failed to send ack for message {message}", "yellow")
-                else:
-                    message_value = json.loads(message.value.decode('utf-8'))
-                    message_id = message_value.get('id')
-
-                    total_expected = len(topics_input)
-                    if total_expected == 1 or Config.IS_AGGREGATOR is False:
-                        process_and_forward(config, consumer, consumer_name, message_id, message_value,
-                                            output_topics, producer, total_expected)
-                    else:
-                        # check in redis how many messages i have for that key
-                        total_messages_for_key = redis_util.get_list_length(message_id)
-
-                        if total_messages_for_key + 1 == total_expected:
-                            ## pull messages from redis
-                            messages_from_redis = [
-                                json.loads(msg) for msg in redis_util.redis.lrange(message_id, 0, -1)
-                            ]
-
-                            ## add my message
-                            messages_from_redis.append(message_value)
-                            logger.info("message appended to redis")
-
-                            ## aggregate messages
-                            aggregated_message = aggregate_messages(messages_from_redis)
-
-                            ## process and forward
-                            process_and_forward(config, consumer, consumer_name, message_id, aggregated_message,
-                                                output_topics, producer, total_expected)
-
-                            ## clear redis
-                            redis_util.delete_key(message_id)
-                            logger.info("message deleted from redis")
-
-                        else:
-                            redis_util.redis.lpush(message_id, json.dumps(message_value))
-                            redis_util.redis.expire(message_id, config.timeout if config.timeout else 600)
+def retry_undelivered(ctx, message, error):
+    """Move a message whose output failed to be sent to the retry topics (called from the producer I/O thread)."""
+    ctx.delivery.track(message, [ctx.retries.retry(message, error)], retry=False)
+
+
+def decode_message(ctx, message):
+    return ctx.codec.loads(message.value)
+
+
+def aggregation_key(ctx, message_id):
+    return f"{ctx.consumer_name}:{message_id}"
+
+
+def aggregation_ttl(ctx):
+    return ctx.config.timeout if ctx.config.timeout else 600
+
+
+def collect_parts(ctx, message, message_id):
+    """
+    Add a message to the aggregation of its id in the aggregation store, as the part of its source topic.
+
+    The part is the record value as consumed: it is already serialized with the codec of the worker, so it is
+    stored without being encoded again.
+
+    :param ctx: EtlContext of the message handling loop
+    :param message: Kafka record
+    :param message_id: common identifier of the parts
+    :return: Dictionary of source topic -> serialized part once all parts arrived (they are removed from the
+             aggregation store), None if parts are still missing.
+    """
+    key = aggregation_key(ctx, message_id)
+    completed = aggregate_parts(ctx, {key: {source_topic(message): message.value}}, {key: message.partition})
+    if key in completed and ctx.transaction_parts is not None:
+        ctx.transaction_parts[message_id] = (completed[key], message.partition)
+    return completed.get(key)
+
+
+def collect_batch_parts(ctx, entries):
+    """
+    Add the parts of a whole poll to the aggregations of their ids in the aggregation store, in a single exchange.
+
+    :param ctx: EtlContext of the message handling loop
+    :param entries: List of (Kafka record, message id, decoded message)
+    :return: Dictionary of message id -> (dictionary of source topic -> serialized part) for the aggregations
+             completed by these entries (they are removed from the aggregation store).
+    """
+    parts_by_id = defaultdict(dict)
+    partitions = {}
+    for message, message_id, _ in entries:
+        parts_by_id[message_id][source_topic(message)] = message.value
+        partitions[aggregation_key(ctx, message_id)] = message.partition
+
+    keys = {message_id: aggregation_key(ctx, message_id) for message_id in parts_by_id}
+    completed = aggregate_parts(ctx, {keys[message_id]: parts for message_id, parts in parts_by_id.items()},
+                                partitions)
+    completed = {message_id: completed[key] for message_id, key in keys.items() if key in completed}
+    if ctx.transaction_parts is not None:
+        ctx.transaction_parts.update({message_id: (parts, partitions[keys[message_id]])
+                                      for message_id, parts in completed.items()})
+    return completed
+
+
+def aggregate_parts(ctx, aggregations, partitions):
+    """`AggregationStore.aggregate_many` for the consumer of `ctx`, timing the round trip with the store."""
+    start = time.perf_counter()
+    try:
+        return ctx.aggregation_store.aggregate_many(aggregations, ctx.total_expected, aggregation_ttl(ctx), partitions)
+    finally:
+        AGGREGATION_SECONDS.labels(ctx.consumer_name, ctx.config.aggregation_store or 'redis') \
+            .observe(time.perf_counter() - start)
+
+
+def merge_parts(ctx, parts):
+    """Aggregate the parts returned by `collect_parts`, in the order of the input topics."""
+    order = {topic: index for index, topic in enumerate(ctx.topics_input)}
+    sources = sorted(parts, key=lambda source: order.get(source, len(order)))
+    return aggregate_messages([ctx.codec.loads(parts[source]) for source in sources])
+
+
+def restore_parts(ctx, message_id, parts, partition=None):
+    """Put back the parts of an aggregation which failed to be processed, so its retry completes it again."""
+    restore_many_parts(ctx, {message_id: parts}, {message_id: partition})
+
+
+def restore_many_parts(ctx, parts_by_id, partitions=None):
+    """
+    :param partitions: Dictionary of message id -> Kafka partition its parts were consumed from
+    """
+    if not parts_by_id:
+        return
+    partitions = partitions or {}
+    try:
+        ctx.aggregation_store.restore_many(
+            {aggregation_key(ctx, message_id): parts for message_id, parts in parts_by_id.items()},
+            aggregation_ttl(ctx),
+            {aggregation_key(ctx, message_id): partitions.get(message_id) for message_id in parts_by_id}
+        )
+    except Exception as e:
+        logger.error(f"Failed to restore aggregation parts for IDs = {list(parts_by_id)}: {e}", "red_back")
+
+
+def sweep_timeouts(ctx):
+    """
+    Handle the aggregations which expired before all their parts arrived, according to the timeout policy.
+    Called from the polling thread; the sweep itself only runs every AGGREGATION_SWEEP_INTERVAL_MS.
+    """
+    if not ctx.timeouts:
+        return
+    try:
+        expired = ctx.timeouts.due_expired()
+    except Exception as e:
+        logger.error(f"Failed to sweep expired aggregations: {e}", "red_back")
+        return
+
+    prefix = len(aggregation_key(ctx, ''))
+    for key, parts in expired.items():
+        handle_timed_out(ctx, key[prefix:], parts)
+
+
+def handle_timed_out(ctx, message_id, parts):
+    """
+    Handle an aggregation which expired before all its parts arrived, according to the timeout policy. Its parts are
+    no longer in the aggregation store: they are put back if they cannot be sent anywhere, so it expires again later.
+    """
+    missing = [topic for topic in ctx.topics_input if topic not in parts]
+    logger.warning(f"Aggregation timed out for ID = {message_id}, missing parts from {missing}", 'yellow')
 
+    error = f"Aggregation timed out after {ctx.timeouts.ttl} s, missing parts from {missing}"
+    if ctx.timeouts.policy == 'partial':
+        try:
+            message_value = merge_parts(ctx, parts)
+            message_value['partial'] = True
+            message_value['missing_topics'] = missing
+            futures = forward(ctx, run_process(ctx, message_value))
+        except Exception as e:
+            logger.error(f"Error processing partial aggregation for ID = {message_id}: {e}", "red_back")
+            error = e
+        else:
+            def on_partial_failed(send_error):
+                logger.error(f"Failed to send partial aggregation for ID = {message_id}: {send_error}", "red_back")
+                dead_letter_timed_out(ctx, message_id, parts, missing, send_error)
+
+            ctx.delivery.track_sends(futures, lambda: ctx.timeouts.record('partial'), on_partial_failed)
+            return
+
+    dead_letter_timed_out(ctx, message_id, parts, missing, error)
+
+
+def dead_letter_timed_out(ctx, message_id, parts, missing, error):
+    def on_failed(send_error):
+        ctx.timeouts.record('failed')
+        logger.error(f"Failed to send expired aggregation for ID = {message_id} to {ctx.retries.error_topic}: "
+                     f"{send_error}", "red_back")
+        restore_parts(ctx, message_id, parts)
+
+    try:
+        value = ctx.codec.dumps({'id': message_id, 'missing_topics': missing,
+                                 'parts': {source: ctx.codec.loads(part) for source, part in parts.items()}})
+        future = ctx.retries.dead_letter(message_id, value, error, ctx.consumer_name)
+    except Exception as e:
+        on_failed(e)
+        return
+    count_out(ctx.consumer_name, ctx.retries.error_topic, [future])
+    ctx.delivery.track_sends([future], lambda: ctx.timeouts.record('dead_letter'), on_failed)
+
+
+def handle_record(ctx, message):
+    """
+    Handle a single Kafka record: decode, aggregate (if needed), process and forward.
+
+    :return: False if the record was nacked (its partition will be re-read from its offset), True otherwise.
+    """
+    try:
+        timing = ctx.stage_timer.start(message)
+        message_value = decode_message(ctx, message)
+        message_id = timing.message_id = message_value.get('id')
+        timing.mark('decode')
+
+        futures = []
+        if not ctx.aggregating:
+            futures = process_and_forward(ctx, message_id, message_value, timing)
+        else:
+            parts = collect_parts(ctx, message, message_id)
+            if parts is not None:
+                try:
+                    message_value = merge_parts(ctx, parts)
+                    timing.mark('aggregation')
+                    futures = process_and_forward(ctx, message_id, message_value, timing)
+                except Exception:
+                    restore_parts(ctx, message_id, parts, message.partition)
+                    raise
+            else:
+                timing.mark('aggregation')
+
+        # Ack once the outputs are confirmed by the brokers
+        ctx.delivery.track(message, futures)
+        ctx.stage_timer.finish_on_delivery(timing, futures)
+        return True
+
+    except Exception as e:
+        logger.error(f"Error processing message: {e}", "red_back")
+        return send_to_retry(ctx, message, e)
+
+
+def handle_records(ctx, records):
+    """
+    Handle the records of one poll. Aggregated records are added to Redis all at once (see
+    `handle_aggregated_records`), the others are handled one by one.
+    """
+    if ctx.aggregating:
+        handle_aggregated_records(ctx, records)
+        return
+
+    for topic_partition, messages in records.items():
+        for message in messages:
+            # once a record is nacked its partition is re-read from there, skip the rest of it
+            if not handle_record(ctx, message):
+                break
+
+
+def handle_aggregated_records(ctx, records):
+    """
+    Handle the records of one poll for an aggregating worker: all parts are added to their aggregations in a single
+    Redis exchange, then every completed aggregation is processed and forwarded.
+
+    If processing an aggregation fails, its parts are put back and the last record which contributed to it is sent
+    to retry; the other records are acked.
+    """
+    nacked = set()
+
+    def retry(message, error):
+        if not send_to_retry(ctx, message, error):
+            nacked.add(TopicPartition(message.topic, message.partition))
+
+    # the poll is decoded and aggregated as a whole, then every completed aggregation is timed on its own
+    poll_timing = ctx.stage_timer.start(size=sum(len(message.value or b'') for messages in records.values()
+                                                 for message in messages),
+                                        messages=sum(len(messages) for messages in records.values()))
+    entries = []
+    for messages in records.values():
+        for message in messages:
+            try:
+                message_value = decode_message(ctx, message)
+                entries.append((message, message_value.get('id'), message_value))
             except Exception as e:
-                logger.error(f"Error processing message: {e}", "red_back")
-                # Send nack
-                send_nack(consumer, message)
+                logger.error(f"Error decoding message: {e}", "red_back")
+                retry(message, e)
+    poll_timing.mark('decode')
+
+    try:
+        completed = collect_batch_parts(ctx, entries)
+    except Exception as e:
+        logger.error(f"Error aggregating {len(entries)} messages: {e}", "red_back")
+        for message, _, _ in entries:
+            if TopicPartition(message.topic, message.partition) not in nacked:
+                retry(message, e)
+        return
+    poll_timing.mark('aggregation')
+    if entries:
+        ctx.stage_timer.finish(poll_timing)
+
+    last_contributor = {message_id: message for message, message_id, _ in entries}
+    failed = {}
+    sent = {}
+    timings = {}
+    for message_id, parts in completed.items():
+        try:
+            timing = ctx.stage_timer.start(last_contributor[message_id],
+                                           size=sum(len(part) for part in parts.values()))
+            timing.message_id = message_id
+            sent[message_id] = process_and_forward(ctx, message_id, merge_parts(ctx, parts), timing)
+            timings[message_id] = timing
+        except Exception as e:
+            logger.error(f"Error processing message: {e}", "red_back")
+            failed[message_id] = (parts, e)
+    restore_many_parts(ctx, {message_id: parts for message_id, (parts, _) in failed.items()},
+                       {message_id: last_contributor[message_id].partition for message_id in failed})
+    for message, message_id, _ in entries:
+        if TopicPartition(message.topic, message.partition) in nacked:
+            # the partition is read again from the nacked record, the parts will be added again
+            continue
+        if message is not last_contributor[message_id]:
+            send_ack(ctx, message)
+        elif message_id in failed:
+            retry(message, failed[message_id][1])
+        else:
+            # the record completing the aggregation is acked once its outputs are confirmed
+            ctx.delivery.track(message, sent.get(message_id))
+            if message_id in timings:
+                ctx.stage_timer.finish_on_delivery(timings[message_id], sent[message_id])
+
+
+def poll_records(ctx, timeout_ms, max_records=None):
+    """
+    Poll Kafka, hold back the retry messages which are not due yet and track the offsets of the others.
+
+    :return: Dictionary of TopicPartition -> list of records to process now.
+    """
+    release_nacks(ctx)
+    if ctx.backpressure:
+        ctx.backpressure.update(ctx.offsets.pending())
+    ctx.lag_monitor.maybe_update()
+    ctx.poll_timer.before_poll()
+    records = ctx.consumer.poll(timeout_ms=timeout_ms, max_records=max_records)
+    ctx.poll_timer.after_poll()
+    count_in(ctx.consumer_name, records)
+    records = ctx.retry_scheduler.release_due(ctx.consumer, ctx.offsets, records)
+    for topic_partition, messages in records.items():
+        for message in messages:
+            ctx.offsets.track(topic_partition, message.offset)
+    return records
+
+
+def handle_message(consumer, producer, topics_input, output_topics, consumer_name=Config.WORKER_NAME, process=None,
+                   process_batch=None, retry_producer=None, close_producer=True, stop_event=None):
+    """
+    Run the message handling loop of a consumer until it fails or is interrupted.
+
+    :param process: Processing function, loaded from `ConsumerConfig.process_module` if None
+    :param process_batch: Batch processing function (only used along with `process`)
+    :param retry_producer: Producer without value serializer for the retry topics, shared by several loops (host
+                           mode), a dedicated one is created if None
+    :param close_producer: Close `producer` when the loop ends (False when it is shared)
+    :param stop_event: Event ending the loop gracefully once set: what was fetched is processed, delivered and committed
+    """
+    ctx = None
+    try:
+        logger.info(f"Starting message handling loop of {consumer_name}...")
+
+        config = fetch_configuration(consumer_name)
+        ctx = EtlContext(consumer_name, config, consumer, producer, topics_input, output_topics)
+        ctx.stop_event = stop_event
+        contexts[consumer_name] = ctx
+        if process:
+            ctx.process, ctx.process_batch = process, process_batch
+        else:
+            ctx.process, ctx.process_batch = load_processors(config.process_module)
+        ctx.codec = get_codec(config.codec or Config.CODEC)
+        ctx.offsets = OffsetTracker(Config.COMMIT_INTERVAL_MS, Config.COMMIT_EVERY)
+        ctx.poll_timer = PollTimer(consumer_name)
+        ctx.stage_timer = ctx.offsets.stage_timer = StageTimer()
+        ctx.lag_monitor = LagMonitor(consumer, consumer_name)
+        ctx.aggregation_store = create_aggregation_store(
+            config, consumer_name, binary_redis_util if ctx.codec.binary else redis_util, ctx.codec
+        )
+        ctx.transactional = Config.KAFKA_EXACTLY_ONCE
+        ctx.retries = RetryRouter(config.kafka_bootstrap_server.split(','), consumer_name,
+                                  producer=producer.without_serializer() if ctx.transactional else retry_producer)
+        ctx.retry_scheduler = RetryScheduler(ctx.retries.topics)
+        ctx.delivery = DeliveryTracker(ctx.offsets, [producer, ctx.retries.producer],
+                                       on_failure=lambda message, error: retry_undelivered(ctx, message, error),
+                                       on_undelivered=ctx.nacks.put)
+        if ctx.aggregating:
+            watch_timeouts(ctx)
+        if not ctx.transactional and not ctx.batching and Config.EXECUTOR_TYPE != 'sync':
+            ctx.engine = ExecutionEngine(Config.EXECUTOR_TYPE, Config.EXECUTOR_WORKERS, Config.EXECUTOR_QUEUE_SIZE)
+        if Config.MAX_IN_FLIGHT and not ctx.transactional:
+            ctx.backpressure = Backpressure(consumer, ctx.retry_scheduler)
+            ctx.retry_scheduler.backpressure = ctx.backpressure
+
+        # commit what was processed before a rebalance takes partitions away
+        ctx.rebalance_listener = OffsetCommitListener(
+            ctx.offsets, consumer, ctx.engine,
+            before_commit=[ctx.delivery.flush],
+            on_revoked=[ctx.retry_scheduler.clear, ctx.aggregation_store.on_partitions_revoked],
+            on_assigned=[ctx.aggregation_store.on_partitions_assigned] +
+                        ([ctx.backpressure.on_partitions_assigned] if ctx.backpressure else [])
+        )
+        consumer.subscribe(topics_input + ctx.retries.topics, listener=ctx.rebalance_listener)
+
+        if ctx.transactional:
+            handle_transactions(ctx)
+        elif ctx.batching:
+            handle_batches(ctx)
+        elif ctx.engine:
+            handle_parallel(ctx)
+        else:
+            while not ctx.stopped:
+                records = poll_records(ctx, Config.POLL_TIMEOUT_MS)
+                handle_records(ctx, records)
+                refresh_configuration(ctx)
+                sweep_timeouts(ctx)
+                ctx.offsets.maybe_commit(consumer)
 
     except KeyboardInterrupt:
         logger.info("Shutting down gracefully...")
     except Exception as e:
         logger.error(f"Unexpected error in main execution: {e}", "red_back")
     finally:
-        close_resources(consumer, producer)
-
-
-def process_and_forward(config, consumer, consumer_name, message_id, message_value, output_topics, producer,
-                        total_expected):
-    logger.info(
-        f"All {total_expected} messages received for ID = {message_id}. Processing...", 'green')
-    processed_message = process(message_value, consumer_name, config.metadatas)
-    logger.debug(f"Processed message: {processed_message}")
-    for output_topic in output_topics:
-        producer.send(output_topic, processed_message)
-        logger.debug(f"Processed message sent to Kafka topic {output_topic}", 'blue')
-    # Send ack
+        if ctx:
+            timeout_managers.pop(consumer_name, None)
+            contexts.pop(consumer_name, None)
+            if ctx.lag_monitor:
+                ctx.lag_monitor.clear()
+            if ctx.engine:
+                # let the lanes finish what was already fetched, so it can be committed
+                ctx.engine.drain()
+                ctx.engine.shutdown()
+            if ctx.delivery:
+                # wait for the outputs in flight, so their inputs can be committed
+                ctx.delivery.flush()
+            if not ctx.transactional:
+                ctx.offsets.commit(consumer)
+            if ctx.retries:
+                ctx.retries.close()
+        close_resources(consumer, producer if close_producer else None)
+
+
+def handle_transactions(ctx):
+    """
+    Exactly-once loop (KAFKA_EXACTLY_ONCE): the records of every poll are handled in a single Kafka transaction
+    holding their outputs, their retries, the expired aggregations swept meanwhile and the input offsets
+    (`send_offsets_to_transaction`). Consumers reading the outputs with `isolation.level=read_committed` see every
+    output exactly once, even across crashes and rebalances.
+
+    If the transaction fails, it is aborted and the polled partitions are rewound to its first records, so they are
+    handled again in the next one. The records are handled one by one on the polling thread (`batch_size` limits the
+    records of a transaction), the execution engine is not used in this mode.
+    """
+    max_records = ctx.config.batch_size or None
+    logger.info(f"Exactly-once mode: up to {max_records or 'all polled'} messages per transaction")
+
+    while not ctx.stopped:
+        # outside of any transaction: a topic change commits and resubscribes
+        refresh_configuration(ctx)
+        records = poll_records(ctx, Config.POLL_TIMEOUT_MS, max_records)
+        if not records and not ctx.timeouts:
+            continue
+
+        ctx.producer.begin_transaction()
+        ctx.transaction_parts = {}
+        try:
+            handle_records(ctx, records)
+            sweep_timeouts(ctx)
+            # the outputs are delivered (but not visible) before their inputs are completed and their offsets taken
+            ctx.delivery.flush()
+            ctx.offsets.commit_transaction(ctx.producer, ctx.consumer)
+        except Exception as e:
+            logger.error(f"Kafka transaction aborted: {e}", "red_back")
+            abort_transaction(ctx, records)
+        finally:
+            ctx.transaction_parts = None
+
+
+def abort_transaction(ctx, records):
+    """Abort the open transaction and rewind the consumer to the first records it handled."""
+    ctx.producer.abort_transaction()
+    for topic_partition, messages in records.items():
+        if messages:
+            ctx.consumer.seek(topic_partition, messages[0].offset)
+            ctx.offsets.rewind(topic_partition, messages[0].offset)
+    # the aggregations completed by the aborted transaction are completed again when its records are handled again
+    restore_many_parts(ctx, {message_id: parts for message_id, (parts, _) in ctx.transaction_parts.items()},
+                       {message_id: partition for message_id, (_, partition) in ctx.transaction_parts.items()})
+
+
+def poll_batch(ctx, max_records, max_wait_ms):
+    """
+    Poll Kafka until `max_records` messages were fetched or `max_wait_ms` elapsed.
+
+    :return: Dictionary of TopicPartition -> list of records, in fetch order.
+    """
+    batch = defaultdict(list)
+    fetched = 0
+    deadline = time.monotonic() + max_wait_ms / 1000.0
+
+    while fetched < max_records:
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            break
+        records = poll_records(ctx, remaining_ms, max_records - fetched)
+        for topic_partition, messages in records.items():
+            batch[topic_partition].extend(messages)
+            fetched += len(messages)
+
+    return batch
+
+
+def handle_batches(ctx):
+    config = ctx.config
+    batch_wait_ms = config.batch_wait_ms if config.batch_wait_ms else Config.BATCH_WAIT_MS
+    logger.info(f"Batch mode: up to {config.batch_size} messages per batch, waiting at most {batch_wait_ms} ms")
+
+    while not ctx.stopped:
+        batch = poll_batch(ctx, config.batch_size, batch_wait_ms)
+        if batch:
+            try:
+                process_batch_and_forward(ctx, batch)
+            except Exception as e:
+                logger.error(f"Error processing batch: {e}. Falling back to message by message processing",
+                             "red_back")
+                handle_records(ctx, batch)
+
+        refresh_configuration(ctx)
+        sweep_timeouts(ctx)
+        ctx.offsets.maybe_commit(ctx.consumer)
+
+
+def process_batch_and_forward(ctx, batch):
+    messages = [message for partition_messages in batch.values() for message in partition_messages]
+    timing = ctx.stage_timer.start(size=sum(len(message.value or b'') for message in messages),
+                                   messages=len(messages))
+    decoded = [decode_message(ctx, message) for message in messages]
+    timing.mark('decode')
+    if not ctx.aggregating:
+        futures = forward_batch(ctx, decoded, timing)
+    else:
+        entries = [(message, message_value.get('id'), message_value)
+                   for message, message_value in zip(messages, decoded)]
+        completed = collect_batch_parts(ctx, entries)
+        try:
+            ready_messages = [merge_parts(ctx, parts) for parts in completed.values()]
+            timing.mark('aggregation')
+            futures = forward_batch(ctx, ready_messages, timing)
+        except Exception:
+            # the batch is handled again message by message: put back what was taken from the store
+            restore_many_parts(ctx, completed,
+                               {message_id: message.partition for message, message_id, _ in entries})
+            raise
+
+    # Ack the whole batch at once, when all of its outputs are confirmed
+    ctx.delivery.track_many(messages, futures)
+    ctx.stage_timer.finish_on_delivery(timing, futures)
+    message_logger.debug("Batch of %s messages acked on delivery", len(messages))
+
+
+def forward_batch(ctx, ready_messages, timing=None):
+    """
+    Process a batch of messages and send the results to every output topic, without waiting for the brokers.
+
+    :param timing: MessageTiming of the batch, its process stage ends once the batch is processed
+    :return: List of the send futures
+    """
+    if not ready_messages:
+        return []
+
+    message_logger.info("Processing batch of %s messages...", len(ready_messages), 'green')
+    if ctx.process_batch:
+        with PROCESS_BATCH_SECONDS.labels(ctx.consumer_name).time():
+            processed_messages = ctx.process_batch(ready_messages, ctx.consumer_name, ctx.config.metadatas)
+    else:
+        processed_messages = [run_process(ctx, message) for message in ready_messages]
+    if timing:
+        timing.mark('process')
+
+    futures = []
+    for output_topic in ctx.output_topics:
+        sent = [ctx.producer.send(output_topic, processed_message)
+                for processed_message in processed_messages if processed_message is not None]
+        count_out(ctx.consumer_name, output_topic, sent)
+        futures.extend(sent)
+    message_logger.debug("Batch of %s processed messages sent to Kafka topics %s", len(processed_messages),
+                         ctx.output_topics, 'blue')
+    return futures
+
+
+def handle_parallel(ctx):
+    """
+    Poll Kafka on this thread and process the records on the execution engine lanes.
+
+    Records of a partition are processed in order on the same lane, and only the highest contiguous
+    completed offset of every partition is committed.
+    """
+    while not ctx.stopped:
+        records = poll_records(ctx, Config.POLL_TIMEOUT_MS)
+        for topic_partition, messages in records.items():
+            for message in messages:
+                ctx.engine.submit(topic_partition, handle_record_in_lane, ctx, topic_partition, message)
+        refresh_configuration(ctx)
+        sweep_timeouts(ctx)
+        ctx.offsets.maybe_commit(ctx.consumer)
+
+
+def handle_record_in_lane(ctx, topic_partition, message):
+    """
+    Handle a single Kafka record on an execution lane.
+
+    A failing record is moved to the retry topics. If even that fails, it is handed back to the polling thread,
+    which pauses its partition and re-reads it from the record after NACK_TIME (see `send_nack`), since the consumer
+    can only be rewound from there. The record completes once its outputs (or its retry) are confirmed by the brokers.
+    """
+    futures = []
+    retry = True
+    parts = None
+    timing = ctx.stage_timer.start(message)
     try:
-        send_ack(consumer, processed_message)
-    except:
-        logger.warn(f"Failed to send ack for message {processed_message}", "red_back")
+        message_value = decode_message(ctx, message)
+        message_id = timing.message_id = message_value.get('id')
+        timing.mark('decode')
+
+        if ctx.aggregating:
+            parts = collect_parts(ctx, message, message_id)
+            message_value = merge_parts(ctx, parts) if parts is not None else None
+            timing.mark('aggregation')
+
+        if message_value is not None:
+            futures = process_and_forward(ctx, message_id, message_value, timing)
+        ctx.stage_timer.finish_on_delivery(timing, futures)
+    except Exception as e:
+        if parts is not None:
+            restore_parts(ctx, message_id, parts, message.partition)
+        logger.error(f"Error processing message: {e}", "red_back")
+        try:
+            futures = [ctx.retries.retry(message, e)]
+            retry = False
+        except Exception as retry_error:
+            logger.error(f"Failed to send message to retry: {retry_error}", "red_back")
+            ctx.nacks.put(message)
+            return
+
+    ctx.delivery.track(message, futures, retry)
+
+
+def forward(ctx, processed_message):
+    """
+    Send a processed message to every output topic, without waiting for the brokers.
+
+    :return: List of the send futures
+    """
+    if Config.LOG_PAYLOADS:
+        message_logger.debug("Processed message: %s", processed_message)
+    futures = []
+    for output_topic in ctx.output_topics:
+        future = ctx.producer.send(output_topic, processed_message)
+        count_out(ctx.consumer_name, output_topic, [future])
+        futures.append(future)
+        message_logger.debug("Processed message sent to Kafka topic %s", output_topic, 'blue')
+    return futures
+
+
+def process_and_forward(ctx, message_id, message_value, timing=None):
+    """:param timing: MessageTiming of the message, its process stage ends once the message is processed"""
+    message_logger.info("All %s messages received for ID = %s. Processing...", ctx.total_expected, message_id, 'green')
+    processed_message = run_process(ctx, message_value)
+    if timing:
+        timing.mark('process')
+    return forward(ctx, processed_message)
+
+
+def run_process(ctx, message_value):
+    """Call `process()` on a message, on the execution engine if there is one, and time it."""
+    start = time.perf_counter()
+    try:
+        if ctx.engine:
+            return ctx.engine.run(ctx.process, message_value, ctx.consumer_name, ctx.config.metadatas)
+        return ctx.process(message_value, ctx.consumer_name, ctx.config.metadatas)
+    finally:
+        PROCESS_SECONDS.labels(ctx.consumer_name).observe(time.perf_counter() - start)
 
 
 def aggregate_messages(messages):
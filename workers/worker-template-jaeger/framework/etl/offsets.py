@@ -0,0 +1,225 @@
+import time
+from collections import defaultdict, deque
+from functools import partial
+from threading import Lock
+
+from kafka import ConsumerRebalanceListener
+from kafka.structs import OffsetAndMetadata
+
+from framework.commons.logger import logger
+
+
+class OffsetTracker:
+    """
+    Tracks the offsets in flight for every TopicPartition and commits only the highest contiguous completed one.
+
+    Records may complete out of order (e.g. when processed in parallel); an offset is committed only once every
+    offset before it (in the same partition) completed as well, so a crash never skips an unprocessed record.
+
+    Commits are coalesced: `maybe_commit` sends a single asynchronous commit once `commit_every` records completed
+    or `commit_interval_ms` elapsed, so there is no broker round trip per record. `commit` does a final
+    synchronous commit (on shutdown and on partition revocation).
+
+    `track`, `rewind` and the commit methods must be called from the polling thread, `complete` is safe from any
+    thread.
+    """
+
+    def __init__(self, commit_interval_ms=1000, commit_every=500):
+        self.commit_interval_ms = commit_interval_ms
+        self.commit_every = commit_every
+
+        self._lock = Lock()
+        self._in_flight = defaultdict(deque)
+        self._completed = defaultdict(set)
+        self._committable = {}
+        self._committed = {}
+        self._completed_since_commit = 0
+        self._last_commit = time.monotonic()
+        # records completed since the tracker was created (throughput)
+        self.completed_total = 0
+        # StageTimer recording the duration of the commits
+        self.stage_timer = None
+
+    def track(self, topic_partition, offset):
+        """Register a fetched record, before it is handed over for processing."""
+        with self._lock:
+            self._in_flight[topic_partition].append(offset)
+
+    def complete(self, topic_partition, offset):
+        """Mark a record as done and advance the committable offset of its partition if possible."""
+        with self._lock:
+            in_flight = self._in_flight.get(topic_partition)
+            # ignore records which are not tracked anymore (rewound or revoked)
+            if not in_flight or offset < in_flight[0] or offset > in_flight[-1]:
+                return
+            completed = self._completed[topic_partition]
+            completed.add(offset)
+            self._completed_since_commit += 1
+            self.completed_total += 1
+            while in_flight and in_flight[0] in completed:
+                done = in_flight.popleft()
+                completed.discard(done)
+                # Kafka commits the offset of the next record to read
+                self._committable[topic_partition] = done + 1
+
+    def in_flight(self, topic_partition, offset):
+        """True if the record at `offset` is tracked and not completed yet (neither rewound nor revoked)."""
+        with self._lock:
+            return offset in self._in_flight.get(topic_partition, ()) \
+                and offset not in self._completed.get(topic_partition, ())
+
+    def rewind(self, topic_partition, offset):
+        """Forget the records from `offset` onwards, after the consumer was seeked back to `offset`."""
+        with self._lock:
+            in_flight = self._in_flight.get(topic_partition)
+            while in_flight and in_flight[-1] >= offset:
+                in_flight.pop()
+            completed = self._completed.get(topic_partition)
+            if completed:
+                self._completed[topic_partition] = {done for done in completed if done < offset}
+            # records completed in an aborted transaction are consumed again
+            if self._committable.get(topic_partition, -1) > offset:
+                self._committable[topic_partition] = offset
+
+    def pending(self):
+        """Number of tracked records which are not committable yet."""
+        with self._lock:
+            return sum(len(in_flight) for in_flight in self._in_flight.values())
+
+    def discard(self, topic_partitions):
+        """Forget the state of partitions which were revoked."""
+        with self._lock:
+            for topic_partition in topic_partitions:
+                self._in_flight.pop(topic_partition, None)
+                self._completed.pop(topic_partition, None)
+                self._committable.pop(topic_partition, None)
+                self._committed.pop(topic_partition, None)
+
+    def _take_committable(self):
+        with self._lock:
+            offsets = {
+                topic_partition: OffsetAndMetadata(offset, None)
+                for topic_partition, offset in self._committable.items()
+            }
+            self._committable.clear()
+            self._completed_since_commit = 0
+            self._last_commit = time.monotonic()
+            return offsets
+
+    def _on_committed(self, offsets):
+        with self._lock:
+            for topic_partition, offset_and_metadata in offsets.items():
+                if offset_and_metadata.offset > self._committed.get(topic_partition, -1):
+                    self._committed[topic_partition] = offset_and_metadata.offset
+
+    def _restore(self, offsets):
+        # put back offsets which failed to commit, unless a newer one is already waiting or committed
+        with self._lock:
+            for topic_partition, offset_and_metadata in offsets.items():
+                if topic_partition not in self._in_flight:
+                    continue
+                if offset_and_metadata.offset <= self._committed.get(topic_partition, -1):
+                    continue
+                self._committable.setdefault(topic_partition, offset_and_metadata.offset)
+
+    def _record_commit(self, started):
+        if self.stage_timer:
+            self.stage_timer.record('commit', time.perf_counter() - started)
+
+    def _on_commit_async(self, started, offsets, response):
+        self._record_commit(started)
+        if isinstance(response, Exception):
+            logger.error(f"Failed to commit offsets {offsets}: {response}")
+            self._restore(offsets)
+        else:
+            self._on_committed(offsets)
+            logger.debug("Offsets committed: %s", offsets)
+
+    def maybe_commit(self, consumer):
+        """Asynchronously commit the completed offsets if the count or time threshold was reached."""
+        with self._lock:
+            elapsed_ms = (time.monotonic() - self._last_commit) * 1000
+            due = self._completed_since_commit >= self.commit_every or elapsed_ms >= self.commit_interval_ms
+        if due:
+            self.commit_async(consumer)
+
+    def commit_async(self, consumer):
+        """Asynchronously commit the offsets completed since the last commit."""
+        offsets = self._take_committable()
+        if not offsets:
+            return
+        try:
+            consumer.commit_async(offsets, callback=partial(self._on_commit_async, time.perf_counter()))
+        except Exception as e:
+            logger.error(f"Failed to commit offsets {offsets}: {e}")
+            self._restore(offsets)
+
+    def commit(self, consumer):
+        """Synchronously commit the offsets completed since the last commit."""
+        offsets = self._take_committable()
+        if not offsets:
+            return
+        started = time.perf_counter()
+        try:
+            consumer.commit(offsets)
+            self._record_commit(started)
+            self._on_committed(offsets)
+            logger.debug("Offsets committed: %s", offsets)
+        except Exception as e:
+            logger.error(f"Failed to commit offsets {offsets}: {e}")
+            self._restore(offsets)
+
+    def commit_transaction(self, producer, consumer):
+        """
+        Add the offsets completed since the last commit to the open transaction of `producer` and commit it
+        (exactly-once mode). If it fails the offsets are not restored: the transaction is aborted and its records are
+        consumed again.
+        """
+        offsets = self._take_committable()
+        started = time.perf_counter()
+        if offsets:
+            producer.send_offsets_to_transaction(offsets, consumer)
+        producer.commit_transaction()
+        self._record_commit(started)
+        self._on_committed(offsets)
+        logger.debug("Transaction committed with offsets: %s", offsets)
+
+
+class OffsetCommitListener(ConsumerRebalanceListener):
+    """
+    Commits the completed offsets synchronously before partitions are taken away from the consumer,
+    so the next owner starts exactly after what was processed here.
+    """
+
+    def __init__(self, offsets, consumer, engine=None, before_commit=(), on_revoked=(), on_assigned=()):
+        """
+        :param offsets: OffsetTracker of the consumer
+        :param consumer: KafkaConsumer
+        :param engine: ExecutionEngine to drain before committing, if the records are processed in parallel
+        :param before_commit: Callbacks completing the pending records before the final commit (e.g. producer flush)
+        :param on_revoked: Callbacks receiving the revoked partitions, after their offsets were committed
+        :param on_assigned: Callbacks receiving the assigned partitions
+        """
+        self.offsets = offsets
+        self.consumer = consumer
+        self.engine = engine
+        self.before_commit = list(before_commit)
+        self.on_revoked = list(on_revoked)
+        self.on_assigned = list(on_assigned)
+
+    def on_partitions_revoked(self, revoked):
+        if self.engine:
+            # records already handed to the lanes must complete before their offsets are committed
+            self.engine.drain()
+        for callback in self.before_commit:
+            callback()
+        self.offsets.commit(self.consumer)
+        self.offsets.discard(revoked)
+        for callback in self.on_revoked:
+            callback(revoked)
+        logger.info(f"Partitions revoked: {revoked}")
+
+    def on_partitions_assigned(self, assigned):
+        for callback in self.on_assigned:
+            callback(assigned)
+        logger.info(f"Partitions assigned: {assigned}")
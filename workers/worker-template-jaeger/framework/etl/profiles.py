@@ -0,0 +1,50 @@
+import json
+
+COMPRESSION_TYPES = ('gzip', 'lz4', 'zstd', 'snappy')
+
+
+def _non_negative(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _positive(value):
+    return _non_negative(value) and value > 0
+
+
+# KafkaProducer settings which can be tuned per worker (ConsumerConfig.producer_profile)
+PRODUCER_PROFILE = {
+    'compression_type': lambda value: value is None or value in COMPRESSION_TYPES,
+    'linger_ms': _non_negative,
+    'batch_size': _non_negative,
+    'buffer_memory': _positive,
+    'acks': lambda value: value in (0, 1, 'all'),
+}
+
+# KafkaConsumer settings which can be tuned per worker (ConsumerConfig.consumer_profile)
+CONSUMER_PROFILE = {
+    'fetch_min_bytes': _positive,
+    'fetch_max_wait_ms': _non_negative,
+    'max_poll_records': _positive,
+}
+
+
+def parse_profile(profile, settings):
+    """
+    Parse and validate a Kafka client profile.
+
+    :param profile: JSON object (as text) of setting -> value, may be empty
+    :param settings: PRODUCER_PROFILE or CONSUMER_PROFILE
+    :return: Dictionary of keyword arguments for the Kafka client
+    :raises ValueError: if the profile is not a JSON object, or has an unknown setting or an invalid value
+    """
+    if not profile:
+        return {}
+    values = json.loads(profile)
+    if not isinstance(values, dict):
+        raise ValueError(f"Kafka client profile must be a JSON object: {profile}")
+    for name, value in values.items():
+        if name not in settings:
+            raise ValueError(f"Unknown Kafka client setting: {name}. Expected one of {tuple(settings)}")
+        if not settings[name](value):
+            raise ValueError(f"Invalid value for Kafka client setting {name}: {value}")
+    return values
@@ -0,0 +1,195 @@
+import time
+
+from config import Config
+from framework.commons.logger import logger, message_logger
+from framework.commons.metrics import DEAD_LETTERS, RETRIES
+from framework.streams.backend import new_producer
+from framework.streams.headers import get_header
+
+RETRY_ATTEMPT_HEADER = 'x-retry-attempt'
+RETRY_DUE_HEADER = 'x-retry-due'
+RETRY_ORIGIN_HEADER = 'x-retry-origin'
+RETRY_ERROR_HEADER = 'x-retry-error'
+
+
+def get_attempt(message):
+    attempt = get_header(message, RETRY_ATTEMPT_HEADER)
+    return int(attempt) if attempt else 0
+
+
+def get_due(message):
+    """Timestamp (ms) from which a retried message may be processed again, or None for a regular message."""
+    due = get_header(message, RETRY_DUE_HEADER)
+    return int(due) if due else None
+
+
+def source_topic(message):
+    """The input topic a message was originally consumed from, even after it went through a retry topic."""
+    return get_header(message, RETRY_ORIGIN_HEADER) or message.topic
+
+
+def format_delay(seconds):
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    if seconds % 60 == 0:
+        return f"{seconds // 60}m"
+    return f"{seconds}s"
+
+
+def retry_topic_name(consumer_name, delay):
+    return f"{consumer_name}.retry-{format_delay(delay)}"
+
+
+class RetryRouter:
+    """
+    Moves failed messages to tiered delay topics instead of blocking their partition.
+
+    The n-th retry of a message goes to the n-th delay topic (the last one is reused if there are more retries than
+    tiers), with its attempt count, due timestamp and original topic in the Kafka headers. After `retry_count` retries,
+    the message goes to the dead letter topic. The original bytes are forwarded untouched, so even messages which
+    cannot be decoded are kept.
+    """
+
+    def __init__(self, bootstrap_servers, consumer_name, delays=None, retry_count=None, error_topic=None,
+                 producer=None):
+        """
+        :param producer: Producer without value serializer to send the retries with (e.g. the transactional producer
+                         in exactly-once mode), a dedicated one is created if None
+        """
+        self.delays = delays or Config.RETRY_DELAYS
+        self.retry_count = retry_count if retry_count is not None else Config.RETRY_COUNT
+        self.error_topic = error_topic or Config.ERROR_TOPIC
+        self.consumer_name = consumer_name
+        self.topics = [retry_topic_name(consumer_name, delay) for delay in self.delays]
+        # raw producer: the retried messages are forwarded as they were consumed
+        self._owns_producer = producer is None
+        self.producer = producer or new_producer(bootstrap_servers, Config.KAFKA_BACKEND)
+
+    def retry(self, message, error):
+        """
+        Send a failed message to its next retry topic, or to the dead letter topic after `retry_count` retries.
+
+        :return: Future of the send
+        """
+        attempt = get_attempt(message) + 1
+        headers = [
+            (RETRY_ATTEMPT_HEADER, str(attempt).encode('utf-8')),
+            (RETRY_ORIGIN_HEADER, source_topic(message).encode('utf-8')),
+            (RETRY_ERROR_HEADER, str(error)[:1024].encode('utf-8')),
+        ]
+
+        if attempt > self.retry_count:
+            future = self.producer.send(self.error_topic, value=message.value, key=message.key, headers=headers)
+            DEAD_LETTERS.labels(self.consumer_name).inc()
+            message_logger.info("Message sent to %s topic after %s retries", self.error_topic, attempt - 1)
+            return future
+
+        tier = min(attempt, len(self.delays)) - 1
+        due = int(time.time() * 1000) + self.delays[tier] * 1000
+        headers.append((RETRY_DUE_HEADER, str(due).encode('utf-8')))
+        future = self.producer.send(self.topics[tier], value=message.value, key=message.key, headers=headers,
+                                    partition=self._partition(self.topics[tier], message))
+        RETRIES.labels(self.consumer_name, self.topics[tier]).inc()
+        message_logger.warning("Message sent to %s for retry number %s", self.topics[tier], attempt)
+        return future
+
+    def dead_letter(self, key, value, error, origin):
+        """
+        Send a message which was never consumed as such (e.g. an expired aggregation) to the dead letter topic.
+
+        :param key: Message key, as a string
+        :param value: Serialized message
+        :param error: Reason of the failure
+        :param origin: Where the message comes from
+        :return: Future of the send
+        """
+        headers = [
+            (RETRY_ORIGIN_HEADER, origin.encode('utf-8')),
+            (RETRY_ERROR_HEADER, str(error)[:1024].encode('utf-8')),
+        ]
+        future = self.producer.send(self.error_topic, value=value, key=key.encode('utf-8'), headers=headers)
+        DEAD_LETTERS.labels(self.consumer_name).inc()
+        return future
+
+    def _partition(self, topic, message):
+        # keep a retried message in the same partition number, so it is consumed along with the other messages of
+        # its partition (required by the local aggregation store), if the retry topic has enough partitions
+        partitions = self.producer.partitions_for(topic)
+        return message.partition if partitions and message.partition in partitions else None
+
+    def close(self):
+        if not self._owns_producer:
+            return
+        try:
+            self.producer.close()
+        except Exception as e:
+            logger.error(f"Error closing retry producer: {e}", "red_back")
+
+
+class RetryScheduler:
+    """
+    Holds back the retry topic partitions until their messages are due.
+
+    Every retry topic has a single delay, so its messages are ordered by due time: when a polled message is not due
+    yet, its partition is paused and rewound to that message, then resumed once the message is due. Only the retry
+    partition waits; the input partitions keep flowing. Input partitions are held the same way when a message is
+    nacked (see `send_nack`).
+    """
+
+    def __init__(self, retry_topics):
+        self.retry_topics = set(retry_topics)
+        self._held = {}
+        # Backpressure whose paused partitions must not be resumed here
+        self.backpressure = None
+
+    def holds(self, topic_partition):
+        """True if `topic_partition` is paused until its next message is due."""
+        return topic_partition in self._held
+
+    def release_due(self, consumer, offsets, records):
+        """
+        Filter a poll result: hold the retry partitions whose next message is not due yet, and resume the ones
+        which became due.
+
+        :return: The records which can be processed now.
+        """
+        self.resume_due(consumer)
+        now = int(time.time() * 1000)
+        released = {}
+        for topic_partition, messages in records.items():
+            if topic_partition.topic not in self.retry_topics:
+                released[topic_partition] = messages
+                continue
+
+            due_messages = []
+            for message in messages:
+                due = get_due(message)
+                if due and due > now:
+                    self.hold(consumer, offsets, topic_partition, message.offset, due)
+                    break
+                due_messages.append(message)
+            if due_messages:
+                released[topic_partition] = due_messages
+        return released
+
+    def hold(self, consumer, offsets, topic_partition, offset, due):
+        consumer.pause(topic_partition)
+        consumer.seek(topic_partition, offset)
+        offsets.rewind(topic_partition, offset)
+        self._held[topic_partition] = due
+        message_logger.debug("Retry partition %s paused for %s ms", topic_partition, due - int(time.time() * 1000))
+
+    def resume_due(self, consumer):
+        now = int(time.time() * 1000)
+        due_partitions = [topic_partition for topic_partition, due in self._held.items() if due <= now]
+        for topic_partition in due_partitions:
+            del self._held[topic_partition]
+        # the partitions paused by the backpressure are resumed with the others when it is released
+        due_partitions = [topic_partition for topic_partition in due_partitions
+                          if not (self.backpressure and self.backpressure.holds(topic_partition))]
+        if due_partitions:
+            consumer.resume(*due_partitions)
+
+    def clear(self, revoked=None):
+        """Forget the held partitions (after a rebalance they are fetched again from the committed offsets)."""
+        self._held.clear()
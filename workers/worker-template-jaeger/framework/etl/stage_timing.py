@@ -0,0 +1,156 @@
+import heapq
+import itertools
+import time
+from collections import deque
+from threading import Lock
+
+from config import Config
+from framework.commons.stats import summarize
+
+STAGES = ('decode', 'aggregation', 'process', 'produce', 'commit')
+
+
+class MessageTiming:
+    """
+    Stage durations of one message (or one batch), measured on the monotonic clock: every `mark` closes a stage which
+    lasted since the previous mark.
+    """
+
+    __slots__ = ('message_id', 'size', 'messages', 'topic', 'partition', 'offset', 'stages', '_last')
+
+    def __init__(self, message=None, size=0, messages=1):
+        self.message_id = None
+        self.size = size
+        self.messages = messages
+        self.topic = message.topic if message is not None else None
+        self.partition = message.partition if message is not None else None
+        self.offset = message.offset if message is not None else None
+        self.stages = {}
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def total(self):
+        return sum(self.stages.values())
+
+    def to_dict(self, total):
+        return {
+            'id': self.message_id,
+            'topic': self.topic,
+            'partition': self.partition,
+            'offset': self.offset,
+            'messages': self.messages,
+            'size': self.size,
+            'total_ms': round(total * 1000, 3),
+            'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+            'timestamp': int(time.time() * 1000),
+        }
+
+
+class StageTimer:
+    """
+    Where the time of a message handling loop goes: decode, aggregation, process, produce (until the brokers
+    acknowledged the outputs) and commit (until the brokers acknowledged the offsets, per commit).
+
+    Every stage keeps its last `window` durations, from which `stats` computes rolling percentiles, and the
+    `slow_messages` slowest messages of the last `max_age_s` seconds are kept with their id, size and stage durations.
+    In batch mode a whole batch is timed as one message.
+
+    `start` returns a `MessageTiming` the ETL steps `mark`, `finish` records it. Both are safe from any thread.
+    """
+
+    def __init__(self, window=None, slow_messages=None, max_age_s=None):
+        """
+        :param window: Durations kept by stage, `STAGE_TIMING_WINDOW` by default
+        :param slow_messages: Slowest messages kept, `SLOW_MESSAGES` by default, 0 to keep none
+        :param max_age_s: Seconds a slow message is kept, `SLOW_MESSAGES_MAX_AGE_S` by default
+        """
+        self.window = window or Config.STAGE_TIMING_WINDOW
+        self.slow_messages = slow_messages if slow_messages is not None else Config.SLOW_MESSAGES
+        self.max_age_s = max_age_s or Config.SLOW_MESSAGES_MAX_AGE_S
+
+        self._lock = Lock()
+        self._samples = {stage: deque(maxlen=self.window) for stage in STAGES + ('total',)}
+        # min-heap of (total, sequence, monotonic time, entry): the fastest of the slowest is replaced first
+        self._slowest = []
+        self._sequence = itertools.count()
+        self._last_prune = time.monotonic()
+        self.timed = 0
+
+    def start(self, message=None, size=None, messages=1):
+        """
+        :param message: Kafka record being handled, None for a batch
+        :param size: Bytes handled, the size of the record value by default
+        """
+        if size is None:
+            size = len(message.value) if message is not None and message.value else 0
+        return MessageTiming(message, size, messages)
+
+    def record(self, stage, seconds):
+        """Record a stage which is not timed by message (the commits)."""
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def finish(self, timing):
+        total = timing.total()
+        with self._lock:
+            self.timed += 1
+            for stage, seconds in timing.stages.items():
+                self._samples[stage].append(seconds)
+            self._samples['total'].append(total)
+            if self.slow_messages:
+                self._keep_if_slow(timing, total)
+
+    def finish_on_delivery(self, timing, futures):
+        """Close the produce stage of `timing` and record it once all `futures` are acknowledged (or failed)."""
+        if not futures:
+            self.finish(timing)
+            return
+        remaining = [len(futures)]
+
+        def on_done(_result):
+            with self._lock:
+                remaining[0] -= 1
+                done = remaining[0] == 0
+            if done:
+                timing.mark('produce')
+                self.finish(timing)
+
+        for future in futures:
+            future.add_callback(on_done)
+            future.add_errback(on_done)
+
+    def stats(self):
+        """
+        :return: Messages timed, count / mean / percentiles / max (ms) of every stage and of the total, and the slowest
+                 messages, slowest first
+        """
+        with self._lock:
+            samples = {stage: list(durations) for stage, durations in self._samples.items() if durations}
+            self._prune(time.monotonic())
+            slowest = [entry for _, _, _, entry in sorted(self._slowest, reverse=True)]
+            timed = self.timed
+        return {
+            'timed': timed,
+            'stages': {stage: summarize(durations) for stage, durations in samples.items()},
+            'slowest': slowest,
+        }
+
+    def _keep_if_slow(self, timing, total):
+        now = time.monotonic()
+        if len(self._slowest) >= self.slow_messages and now - self._last_prune >= 1:
+            self._prune(now)
+        if len(self._slowest) < self.slow_messages:
+            heapq.heappush(self._slowest, (total, next(self._sequence), now, timing.to_dict(total)))
+        elif total > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (total, next(self._sequence), now, timing.to_dict(total)))
+
+    def _prune(self, now):
+        self._last_prune = now
+        kept = [slow for slow in self._slowest if now - slow[2] < self.max_age_s]
+        if len(kept) < len(self._slowest):
+            heapq.heapify(kept)
+            self._slowest = kept
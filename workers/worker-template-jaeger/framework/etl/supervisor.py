@@ -0,0 +1,170 @@
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+
+from config import Config
+from framework.commons.logger import logger
+from framework.commons.metrics import mark_process_dead
+from framework.etl.context import contexts
+from models.models import get_engine
+
+# Supervisor of this process, if it runs as a supervisor parent (read by the monitoring API)
+active_supervisor = None
+
+
+def _run_child(target, index, counters):
+    stop_event = threading.Event()
+    # the parent forwards SIGTERM for a graceful drain; Ctrl+C reaches the whole process group, let the parent decide
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # the pooled database connections of the parent must not be shared with the children
+    get_engine().dispose(close=False)
+
+    def report():
+        while not stop_event.wait(1):
+            counters[index] = sum(ctx.offsets.completed_total for ctx in list(contexts.values()) if ctx.offsets)
+
+    threading.Thread(target=report, name='throughput-report', daemon=True).start()
+    target(index, stop_event)
+    # a loop ending without being asked to is a crash, the parent restarts it
+    sys.exit(0 if stop_event.is_set() else 1)
+
+
+class _Child:
+    __slots__ = ('index', 'process', 'started', 'failures', 'restarts', 'restart_at', 'processed', 'throughput')
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.started = None
+        self.failures = 0
+        self.restarts = 0
+        self.restart_at = None
+        self.processed = 0
+        self.throughput = 0.0
+
+
+class Supervisor:
+    """
+    Pre-fork supervisor: runs `processes` consumer processes of the same consumer group, so Kafka spreads the
+    partitions over them and the processing scales past the single core a Python process can use.
+
+    The children are forked from the parent (which serves the HTTP API) and call `target(index, stop_event)`. A child
+    which exits without being asked to is restarted after an exponential backoff (`backoff_s`, doubled on every
+    consecutive failure up to `max_backoff_s`; a child which ran longer than `max_backoff_s` starts over). `stop`
+    forwards SIGTERM: the children set their stop event, drain and commit, and are killed after `stop_timeout_s`.
+
+    Every child publishes the number of records it completed in shared memory; the parent turns it into a throughput
+    every second (see `stats`).
+    """
+
+    def __init__(self, target, processes=None, backoff_s=None, max_backoff_s=None, stop_timeout_s=None):
+        self.target = target
+        self.processes = processes or Config.SUPERVISOR_PROCESSES
+        self.backoff_s = backoff_s or Config.SUPERVISOR_BACKOFF_S
+        self.max_backoff_s = max_backoff_s or Config.SUPERVISOR_MAX_BACKOFF_S
+        self.stop_timeout_s = stop_timeout_s or Config.SUPERVISOR_STOP_TIMEOUT_S
+
+        self._context = multiprocessing.get_context('fork')
+        self._counters = self._context.Array('Q', self.processes, lock=False)
+        self._children = [_Child(index) for index in range(self.processes)]
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Fork the children and supervise them from a background thread."""
+        global active_supervisor
+        active_supervisor = self
+        for child in self._children:
+            self._spawn(child)
+        threading.Thread(target=self._supervise, name='supervisor', daemon=True).start()
+        logger.info(f"Supervisor started {self.processes} consumer processes", 'green')
+
+    def stop(self):
+        """Forward SIGTERM to the children and wait for them to drain (killing the ones which take too long)."""
+        self._stopping.set()
+        with self._lock:
+            processes = [child.process for child in self._children if child.process and child.process.is_alive()]
+        for process in processes:
+            process.terminate()
+        deadline = time.monotonic() + self.stop_timeout_s
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"Consumer process {process.pid} did not stop in {self.stop_timeout_s} s, killing it",
+                               'yellow')
+                process.kill()
+                process.join()
+        logger.info("Supervisor stopped")
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            children = []
+            for child in self._children:
+                alive = bool(child.process and child.process.is_alive())
+                children.append({
+                    'index': child.index,
+                    'pid': child.process.pid if child.process else None,
+                    'alive': alive,
+                    'uptime_s': round(now - child.started, 1) if alive else None,
+                    'restarts': child.restarts,
+                    'processed': child.processed,
+                    'throughput': round(child.throughput, 1) if alive else 0.0,
+                })
+        return {
+            'processes': self.processes,
+            'throughput': round(sum(child['throughput'] for child in children), 1),
+            'children': children,
+        }
+
+    def _spawn(self, child):
+        self._counters[child.index] = 0
+        process = self._context.Process(target=_run_child, args=(self.target, child.index, self._counters),
+                                        name=f"{Config.WORKER_NAME}-{child.index}")
+        process.start()
+        with self._lock:
+            child.process = process
+            child.started = time.monotonic()
+            child.restart_at = None
+            child.processed = 0
+        logger.info(f"Consumer process {child.index} started with pid {process.pid}")
+
+    def _supervise(self):
+        last = time.monotonic()
+        while not self._stopping.wait(1):
+            now = time.monotonic()
+            elapsed = max(now - last, 1e-3)
+            last = now
+            for child in self._children:
+                self._sample(child, elapsed)
+                if self._stopping.is_set():
+                    return
+                self._check(child, now)
+
+    def _sample(self, child, elapsed):
+        processed = self._counters[child.index]
+        with self._lock:
+            child.throughput = max(processed - child.processed, 0) / elapsed
+            child.processed = processed
+
+    def _check(self, child, now):
+        if child.restart_at is not None:
+            if now >= child.restart_at:
+                child.restarts += 1
+                self._spawn(child)
+            return
+        if child.process.is_alive():
+            return
+
+        if now - child.started > self.max_backoff_s:
+            child.failures = 0
+        child.failures += 1
+        delay = min(self.backoff_s * 2 ** (child.failures - 1), self.max_backoff_s)
+        logger.error(f"Consumer process {child.index} (pid {child.process.pid}) exited with code "
+                     f"{child.process.exitcode}, restarting in {delay} s", "red_back")
+        mark_process_dead(child.process.pid)
+        with self._lock:
+            child.restart_at = now + delay
@@ -0,0 +1,67 @@
+import time
+from threading import Lock
+
+from config import Config
+
+TIMEOUT_POLICIES = ('dead_letter', 'partial')
+
+# consumer name -> AggregationTimeoutManager of the running message handling loops (read by the monitoring API)
+timeout_managers = {}
+
+
+class AggregationTimeoutManager:
+    """
+    Sweeps the aggregations which did not receive all their parts before their deadline (first part + `ttl`).
+
+    The sweep runs on the polling thread, at most every `sweep_interval_ms` and `batch` aggregations at a time (the
+    next poll sweeps again if the batch was full). What happens to an expired aggregation is decided by `policy`:
+
+    - `dead_letter`: its parts are sent to the dead letter topic.
+    - `partial`: the parts received are merged, flagged as partial and processed like a complete aggregation.
+    """
+
+    def __init__(self, store, ttl, policy=None, sweep_interval_ms=None, batch=None):
+        """
+        :param store: AggregationStore holding the pending aggregations
+        :param ttl: Timeout in seconds of an aggregation (`ConsumerConfig.timeout`)
+        :param policy: One of TIMEOUT_POLICIES (`ConsumerConfig.timeout_policy`), `dead_letter` by default
+        """
+        policy = policy or 'dead_letter'
+        if policy not in TIMEOUT_POLICIES:
+            raise ValueError(f"Unknown timeout policy: {policy}. Expected one of {TIMEOUT_POLICIES}")
+        self.store = store
+        self.ttl = ttl
+        self.policy = policy
+        self.sweep_interval_ms = sweep_interval_ms or Config.AGGREGATION_SWEEP_INTERVAL_MS
+        self.batch = batch or Config.AGGREGATION_SWEEP_BATCH
+
+        self._lock = Lock()
+        self._last_sweep = time.monotonic()
+        self.outcomes = {'partial': 0, 'dead_letter': 0, 'failed': 0}
+
+    def due_expired(self):
+        """
+        Sweep the store if the sweep interval elapsed.
+
+        :return: Dictionary of key -> (dictionary of source -> serialized part) of the expired aggregations
+        """
+        now = time.monotonic()
+        if (now - self._last_sweep) * 1000 < self.sweep_interval_ms:
+            return {}
+        expired = self.store.sweep(self.batch)
+        if len(expired) < self.batch:
+            self._last_sweep = now
+        return expired
+
+    def record(self, outcome):
+        """Count an expired aggregation handled with `outcome` (`partial`, `dead_letter` or `failed`)."""
+        with self._lock:
+            self.outcomes[outcome] += 1
+
+    def stats(self):
+        stats = self.store.backlog(self.ttl, Config.AGGREGATION_AGE_BUCKETS)
+        with self._lock:
+            stats['timed_out'] = dict(self.outcomes)
+        stats['timeout'] = self.ttl
+        stats['policy'] = self.policy
+        return stats
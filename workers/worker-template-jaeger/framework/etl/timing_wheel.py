@@ -0,0 +1,95 @@
+class HierarchicalTimingWheel:
+    """
+    Hierarchical timing wheel for expiring many keys cheaply.
+
+    Level 0 has `wheel_size` buckets of `tick_ms` each; every upper level has `wheel_size` buckets, each as wide as a
+    full turn of the level below. A key is placed in the lowest level whose range covers its deadline and moves down
+    one level (cascades) when the clock reaches its bucket, so scheduling and cancelling are O(1) and advancing the
+    clock only touches the buckets that are due.
+
+    Keys past the range of the top level are kept in its furthest bucket and re-placed when it cascades.
+    """
+
+    def __init__(self, now_ms, tick_ms=1000, wheel_size=64, levels=3):
+        self.tick_ms = tick_ms
+        self.wheel_size = wheel_size
+        self.levels = levels
+        self._ticks = [tick_ms * wheel_size ** level for level in range(levels)]
+        self._buckets = [[set() for _ in range(wheel_size)] for _ in range(levels)]
+        self._deadlines = {}
+        self._bucket_of = {}
+        self._current = now_ms - now_ms % tick_ms
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def deadline(self, key):
+        return self._deadlines.get(key)
+
+    def schedule(self, key, deadline_ms):
+        """Schedule (or reschedule) `key` to expire at `deadline_ms`."""
+        self.cancel(key)
+        self._deadlines[key] = deadline_ms
+        self._place(key, deadline_ms)
+
+    def cancel(self, key):
+        bucket = self._bucket_of.pop(key, None)
+        if bucket is not None:
+            bucket.discard(key)
+        self._deadlines.pop(key, None)
+
+    def _place(self, key, deadline_ms, cascading=False):
+        # a bucket is expired when the clock reaches its tick, so a key goes in the one of the first tick >= its
+        # deadline; keys already due fire on the next tick, or on this one when cascaded before it is expired
+        deadline_ms = -(-deadline_ms // self.tick_ms) * self.tick_ms
+        deadline_ms = max(deadline_ms, self._current if cascading else self._current + self.tick_ms)
+        delta = deadline_ms - self._current
+        for level, tick in enumerate(self._ticks):
+            if delta < tick * self.wheel_size or level == self.levels - 1:
+                if delta >= tick * self.wheel_size:
+                    # beyond the top level: park it in the furthest bucket, it will be re-placed
+                    deadline_ms = self._current + tick * (self.wheel_size - 1)
+                bucket = self._buckets[level][(deadline_ms // tick) % self.wheel_size]
+                bucket.add(key)
+                self._bucket_of[key] = bucket
+                return
+
+    def _cascade(self):
+        for level in range(1, self.levels):
+            tick = self._ticks[level]
+            if self._current % tick:
+                return
+            bucket = self._buckets[level][(self._current // tick) % self.wheel_size]
+            keys = list(bucket)
+            bucket.clear()
+            for key in keys:
+                self._place(key, self._deadlines[key], cascading=True)
+
+    def advance(self, now_ms):
+        """
+        Move the clock to `now_ms`.
+
+        :return: The keys which expired, in expiration order.
+        """
+        if not self._deadlines:
+            # nothing to expire, no need to walk the buckets
+            self._current = max(self._current, now_ms - now_ms % self.tick_ms)
+            return []
+
+        expired = []
+        while self._current + self.tick_ms <= now_ms:
+            self._current += self.tick_ms
+            self._cascade()
+            bucket = self._buckets[0][(self._current // self.tick_ms) % self.wheel_size]
+            for key in sorted(bucket, key=self._deadlines.get):
+                bucket.discard(key)
+                del self._bucket_of[key]
+                if self._deadlines[key] <= now_ms:
+                    del self._deadlines[key]
+                    expired.append(key)
+                else:
+                    self._place(key, self._deadlines[key])
+        return expired
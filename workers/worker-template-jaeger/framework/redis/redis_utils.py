@@ -3,6 +3,66 @@
 import redis
 from threading import Lock
 
+# KEYS: aggregation hashes (source -> part), followed by the pending set if ARGV[3] > 0
+# ARGV[1]: number of distinct sources completing an aggregation, ARGV[2]: ttl in seconds
+# ARGV[3]: deadline (ms) of the aggregations started by this call, 0 to not track them in the pending set
+# ARGV[4..n]: for every key, its number of parts followed by their source, part pairs
+# returns, for every key, all of its parts if the aggregation is complete, an empty list otherwise
+AGGREGATE_SCRIPT = """
+local expected = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+local deadline = tonumber(ARGV[3])
+local count_keys = #KEYS
+local pending = nil
+if deadline > 0 then
+    pending = KEYS[#KEYS]
+    count_keys = count_keys - 1
+    -- the sweeper reads the parts at the deadline: keep them a while longer
+    ttl = ttl * 2
+end
+local results = {}
+local index = 4
+for k = 1, count_keys do
+    local count = tonumber(ARGV[index])
+    index = index + 1
+    for i = 1, count do
+        redis.call('HSET', KEYS[k], ARGV[index], ARGV[index + 1])
+        index = index + 2
+    end
+    if redis.call('HLEN', KEYS[k]) >= expected then
+        results[k] = redis.call('HGETALL', KEYS[k])
+        redis.call('DEL', KEYS[k])
+        if pending then
+            redis.call('ZREM', pending, KEYS[k])
+        end
+    else
+        redis.call('EXPIRE', KEYS[k], ttl)
+        if pending then
+            -- NX: the deadline counts from the first part
+            redis.call('ZADD', pending, 'NX', deadline, KEYS[k])
+        end
+        results[k] = {}
+    end
+end
+return results
+"""
+
+# KEYS[1]: pending set (aggregation key -> deadline)
+# ARGV[1]: now (ms), ARGV[2]: maximum number of aggregations to pop
+# returns key, parts (source, part list) pairs for the expired aggregations, which are removed
+# (the aggregation hashes are not declared in KEYS: not suitable for a Redis Cluster)
+SWEEP_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local results = {}
+for i, key in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], key)
+    results[#results + 1] = key
+    results[#results + 1] = redis.call('HGETALL', key)
+    redis.call('DEL', key)
+end
+return results
+"""
+
 class RedisSingleton:
     """
     Singleton class to manage a Redis connection.
@@ -22,19 +82,24 @@ class RedisSingleton:
         return cls._instance
 
     def _initialize(self, host, port, db, password):
-        self._client = redis.StrictRedis(
-            host=host,
-            port=port,
-            db=db,
-            password=password,
-            decode_responses=True
-        )
+        self._params = dict(host=host, port=port, db=db, password=password)
+        self._client = redis.StrictRedis(**self._params, decode_responses=True)
+        self._binary_client = None
 
     @property
     def client(self):
         """Get the Redis client instance."""
         return self._client
 
+    @property
+    def binary_client(self):
+        """Get a Redis client instance which returns bytes, for binary values (created on first use)."""
+        if self._binary_client is None:
+            with self._lock:
+                if self._binary_client is None:
+                    self._binary_client = redis.StrictRedis(**self._params, decode_responses=False)
+        return self._binary_client
+
 
 class RedisUtils:
     """
@@ -44,8 +109,15 @@ class RedisUtils:
     checking the existence of keys.
     """
 
-    def __init__(self, host='localhost', port=6379, db=0, password=None):
-        self.redis = RedisSingleton(host, port, db, password).client
+    def __init__(self, host='localhost', port=6379, db=0, password=None, binary=False):
+        """
+        :param binary: Return the values as bytes instead of str (keys and hash fields are still returned as str)
+        """
+        singleton = RedisSingleton(host, port, db, password)
+        self.binary = binary
+        self.redis = singleton.binary_client if binary else singleton.client
+        self._aggregate_script = self.redis.register_script(AGGREGATE_SCRIPT)
+        self._sweep_script = self.redis.register_script(SWEEP_SCRIPT)
 
     def set_key(self, key, value, expire=None):
         """
@@ -153,6 +225,101 @@ class RedisUtils:
         """
         return self.redis.llen(key)
 
+    def aggregate_parts(self, key, parts, expected, ttl):
+        """
+        Atomically add parts to an aggregation and, once it is complete, return and delete all of its parts.
+
+        The parts are stored in a hash by source (e.g. the input topic), so a duplicate from the same source
+        replaces the previous part instead of counting twice. Everything runs in a single server-side script:
+        one round trip, and no other client can complete (or see) the same aggregation in between.
+
+        :param key: Redis key of the aggregation
+        :param parts: Dictionary of source -> serialized part to add
+        :param expected: Number of distinct sources completing the aggregation
+        :param ttl: Expiration time in seconds of an incomplete aggregation
+        :return: Dictionary of source -> serialized part if the aggregation is complete (its key is deleted),
+                 None otherwise
+        """
+        return self.aggregate_many({key: parts}, expected, ttl).get(key)
+
+    def aggregate_many(self, aggregations, expected, ttl, pending=None, deadline=0):
+        """
+        Same as `aggregate_parts`, for many aggregations at once: all of them are updated and checked by a single
+        script call, so a whole batch of messages costs one round trip.
+
+        The script touches several keys, so on a Redis Cluster they must share a hash slot.
+
+        :param aggregations: Dictionary of Redis key -> dictionary of source -> serialized part to add
+        :param expected: Number of distinct sources completing an aggregation
+        :param ttl: Expiration time in seconds of an incomplete aggregation
+        :param pending: Sorted set tracking the incomplete aggregations by deadline (optional, see `sweep_expired`)
+        :param deadline: Deadline (timestamp in ms) of the aggregations started by this call, if `pending` is set
+        :return: Dictionary of Redis key -> (dictionary of source -> serialized part) for the completed aggregations
+        """
+        if not aggregations:
+            return {}
+        keys = list(aggregations)
+        args = [expected, ttl, deadline if pending else 0]
+        for key in keys:
+            parts = aggregations[key]
+            args.append(len(parts))
+            for source, part in parts.items():
+                args.extend((source, part))
+
+        results = self._aggregate_script(keys=keys + [pending] if pending else keys, args=args)
+        return {
+            key: dict(zip(map(self._text, result[::2]), result[1::2]))
+            for key, result in zip(keys, results) if result
+        }
+
+    def restore_parts(self, key, parts, ttl):
+        """
+        Put back the parts of an aggregation returned by `aggregate_parts` (e.g. when processing it failed),
+        so that the next part it receives completes it again.
+
+        :param key: Redis key of the aggregation
+        :param parts: Dictionary of source -> serialized part
+        :param ttl: Expiration time in seconds
+        """
+        self.restore_many({key: parts}, ttl)
+
+    def restore_many(self, aggregations, ttl, pending=None, deadline=0):
+        """
+        Same as `restore_parts`, for many aggregations at once, in a single pipelined round trip.
+
+        :param aggregations: Dictionary of Redis key -> dictionary of source -> serialized part
+        :param ttl: Expiration time in seconds
+        :param pending: Sorted set tracking the incomplete aggregations by deadline (optional)
+        :param deadline: Deadline (timestamp in ms) of the restored aggregations, if `pending` is set
+        """
+        pipeline = self.redis.pipeline()
+        for key, parts in aggregations.items():
+            pipeline.hset(key, mapping=parts)
+            pipeline.expire(key, ttl * 2 if pending else ttl)
+        if pending and aggregations:
+            pipeline.zadd(pending, {key: deadline for key in aggregations}, nx=True)
+        pipeline.execute()
+
+    def sweep_expired(self, pending, now, limit):
+        """
+        Atomically pop the aggregations of `pending` whose deadline passed, with their parts. Concurrent sweepers
+        never get the same aggregation.
+
+        :param pending: Sorted set tracking the incomplete aggregations by deadline
+        :param now: Current timestamp in ms
+        :param limit: Maximum number of aggregations to pop
+        :return: Dictionary of Redis key -> (dictionary of source -> serialized part), in deadline order
+        """
+        results = self._sweep_script(keys=[pending], args=[now, limit])
+        return {
+            self._text(key): dict(zip(map(self._text, parts[::2]), parts[1::2]))
+            for key, parts in zip(results[::2], results[1::2])
+        }
+
+    @staticmethod
+    def _text(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
 
 # Example usage:
 # redis_util = RedisUtils(host='localhost', port=6379, db=0, password=None)
@@ -0,0 +1,55 @@
+from kafka import KafkaConsumer, KafkaProducer
+
+from ..streams.confluent_adapters import ConfluentConsumer, ConfluentProducer
+
+KAFKA_BACKENDS = ('kafka-python', 'confluent')
+
+
+def check_backend(backend):
+    backend = backend or 'kafka-python'
+    if backend not in KAFKA_BACKENDS:
+        raise ValueError(f"Unknown Kafka backend: {backend}. Expected one of {KAFKA_BACKENDS}")
+    return backend
+
+
+def new_consumer(topics, bootstrap_servers, backend=None, **settings):
+    """
+    Create a consumer of the Kafka `backend` (`kafka-python` by default). Both expose the `KafkaConsumer` API used by
+    the ETL loop.
+
+    :param settings: kafka-python consumer settings (group_id, enable_auto_commit, profile...)
+    """
+    if check_backend(backend) == 'confluent':
+        return ConfluentConsumer(*topics, bootstrap_servers=bootstrap_servers, **settings)
+    return KafkaConsumer(*topics, bootstrap_servers=bootstrap_servers, **settings)
+
+
+def new_producer(bootstrap_servers, backend=None, transactional_id=None, **settings):
+    """
+    Create a producer of the Kafka `backend` (`kafka-python` by default). Both expose the `KafkaProducer` API used by
+    the ETL loop.
+
+    :param transactional_id: Transactional producer (exactly-once mode), only supported by the confluent backend
+    :param settings: kafka-python producer settings (value_serializer, profile...)
+    """
+    if check_backend(backend) == 'confluent':
+        return ConfluentProducer(bootstrap_servers, transactional_id=transactional_id, **settings)
+    if transactional_id:
+        raise ValueError("Kafka transactions require the confluent Kafka backend")
+    return KafkaProducer(bootstrap_servers=bootstrap_servers, **settings)
+
+
+def create_stream_client(backend=None, **kwargs):
+    """
+    Get the `StreamClientInterface` singleton of the Kafka `backend` (`kafka-python` by default).
+
+    :param kwargs: Connection and security settings of `KafkaClient.get_instance`
+    """
+    if check_backend(backend) == 'confluent':
+        from ..streams.confluent_client import ConfluentKafkaClient
+        kwargs.pop('api_version', None)
+        kwargs.pop('key_index_store', None)
+        kwargs.pop('reply_topic', None)
+        return ConfluentKafkaClient.get_instance(**kwargs)
+    from ..streams.kafka_client import KafkaClient
+    return KafkaClient.get_instance(**kwargs)
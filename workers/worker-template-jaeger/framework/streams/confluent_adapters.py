@@ -0,0 +1,339 @@
+"""
+confluent-kafka (librdkafka) consumer and producer exposing the subset of the kafka-python API used by the ETL loop,
+so `framework_etl` runs unchanged on either backend. Topic partitions and offsets are exchanged as kafka-python
+`TopicPartition` / `OffsetAndMetadata` structs.
+"""
+import threading
+from collections import defaultdict, deque, namedtuple
+
+from kafka import TopicPartition
+
+from ..commons.logger import logger
+
+try:
+    import confluent_kafka
+    from confluent_kafka import KafkaError, KafkaException
+except ImportError:
+    confluent_kafka = None
+
+ConsumerRecord = namedtuple('ConsumerRecord', ['topic', 'partition', 'offset', 'timestamp', 'key', 'value', 'headers'])
+RecordMetadata = namedtuple('RecordMetadata', ['topic', 'partition', 'offset'])
+
+# kafka-python setting -> librdkafka property (see framework/etl/profiles.py)
+CONSUMER_SETTINGS = {
+    'group_id': 'group.id',
+    'auto_offset_reset': 'auto.offset.reset',
+    'enable_auto_commit': 'enable.auto.commit',
+    'fetch_min_bytes': 'fetch.min.bytes',
+    'fetch_max_wait_ms': 'fetch.wait.max.ms',
+    'isolation_level': 'isolation.level',
+}
+PRODUCER_SETTINGS = {
+    'compression_type': 'compression.type',
+    'linger_ms': 'linger.ms',
+    'batch_size': 'batch.size',
+    'acks': 'acks',
+}
+
+
+def require_confluent():
+    if confluent_kafka is None:
+        raise ImportError("The confluent Kafka backend requires the confluent-kafka package")
+
+
+def to_confluent(topic_partition, offset=None):
+    if offset is None:
+        return confluent_kafka.TopicPartition(topic_partition.topic, topic_partition.partition)
+    return confluent_kafka.TopicPartition(topic_partition.topic, topic_partition.partition, offset)
+
+
+def to_confluent_offsets(offsets):
+    """Dictionary of TopicPartition -> OffsetAndMetadata to a list of confluent TopicPartitions with offsets."""
+    return [to_confluent(topic_partition, offset_and_metadata.offset)
+            for topic_partition, offset_and_metadata in offsets.items()]
+
+
+def from_confluent(partitions):
+    return {TopicPartition(partition.topic, partition.partition) for partition in partitions}
+
+
+def librdkafka_config(bootstrap_servers, settings, mapping, config=None):
+    """
+    Build a librdkafka configuration from kafka-python style settings.
+
+    :param bootstrap_servers: List (or comma-separated string) of brokers
+    :param settings: kafka-python settings, translated with `mapping`
+    :param config: librdkafka properties added as they are (e.g. security)
+    """
+    conf = {'bootstrap.servers': bootstrap_servers if isinstance(bootstrap_servers, str)
+            else ','.join(bootstrap_servers)}
+    for name, value in settings.items():
+        if name not in mapping:
+            raise ValueError(f"Setting {name} is not supported by the confluent Kafka backend")
+        conf[mapping[name]] = value
+    conf.update(config or {})
+    return conf
+
+
+class DeliveryFuture:
+    """
+    Result of `ConfluentProducer.send`, with the kafka-python future API used by the ETL (`add_callback`,
+    `add_errback`, `get`). It is resolved by the librdkafka delivery report, on the producer polling thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._callbacks = []
+        self._errbacks = []
+        self.value = None
+        self.exception = None
+
+    def is_done(self):
+        return self._done.is_set()
+
+    def succeeded(self):
+        return self.is_done() and self.exception is None
+
+    def failed(self):
+        return self.is_done() and self.exception is not None
+
+    def add_callback(self, fn, *args):
+        with self._lock:
+            if not self.is_done():
+                self._callbacks.append((fn, args))
+                return self
+        if self.exception is None:
+            fn(*args, self.value)
+        return self
+
+    def add_errback(self, fn, *args):
+        with self._lock:
+            if not self.is_done():
+                self._errbacks.append((fn, args))
+                return self
+        if self.exception is not None:
+            fn(*args, self.exception)
+        return self
+
+    def get(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Message not delivered after {timeout} s")
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+    def on_delivery(self, error, message):
+        with self._lock:
+            if error is not None:
+                self.exception = KafkaException(error)
+            else:
+                self.value = RecordMetadata(message.topic(), message.partition(), message.offset())
+            self._done.set()
+            callbacks = self._errbacks if error is not None else self._callbacks
+            self._callbacks, self._errbacks = [], []
+        result = self.exception if error is not None else self.value
+        for fn, args in callbacks:
+            try:
+                fn(*args, result)
+            except Exception as e:
+                logger.error(f"Error in delivery callback: {e}", "red_back")
+
+
+class ConfluentConsumer:
+    """
+    librdkafka consumer with the kafka-python `KafkaConsumer` API used by the ETL loop.
+
+    The rebalance listener and the asynchronous commit callbacks are called from `poll`, on the polling thread.
+    """
+
+    def __init__(self, *topics, bootstrap_servers, max_poll_records=500, config=None, **settings):
+        """
+        :param topics: Topics to subscribe to (optional, see `subscribe`)
+        :param max_poll_records: Maximum number of records returned by a `poll` without `max_records`
+        :param config: librdkafka properties added as they are (e.g. security)
+        :param settings: kafka-python settings (see CONSUMER_SETTINGS)
+        """
+        require_confluent()
+        self.max_poll_records = max_poll_records
+        conf = librdkafka_config(bootstrap_servers, settings, CONSUMER_SETTINGS, config)
+        conf['on_commit'] = self._on_commit
+        self._consumer = confluent_kafka.Consumer(conf)
+        self._commit_callbacks = deque()
+        if topics:
+            self.subscribe(list(topics))
+
+    def subscribe(self, topics, listener=None):
+        def on_assign(_consumer, partitions):
+            if listener:
+                listener.on_partitions_assigned(from_confluent(partitions))
+
+        def on_revoke(_consumer, partitions):
+            if listener:
+                listener.on_partitions_revoked(from_confluent(partitions))
+
+        self._consumer.subscribe(list(topics), on_assign=on_assign, on_revoke=on_revoke)
+
+    def poll(self, timeout_ms=0, max_records=None):
+        """
+        :return: Dictionary of TopicPartition -> list of ConsumerRecord, like `KafkaConsumer.poll`
+        """
+        messages = self._consumer.consume(num_messages=max_records or self.max_poll_records,
+                                          timeout=timeout_ms / 1000.0)
+        records = defaultdict(list)
+        for message in messages:
+            error = message.error()
+            if error is not None:
+                if error.code() != KafkaError._PARTITION_EOF:
+                    logger.error(f"Kafka consumer error: {error}", "red_back")
+                continue
+            timestamp_type, timestamp = message.timestamp()
+            records[TopicPartition(message.topic(), message.partition())].append(ConsumerRecord(
+                message.topic(), message.partition(), message.offset(), timestamp, message.key(), message.value(),
+                message.headers() or []
+            ))
+        return dict(records)
+
+    def _on_commit(self, error, partitions):
+        # librdkafka reports the asynchronous commits in order
+        if not self._commit_callbacks:
+            return
+        offsets, callback = self._commit_callbacks.popleft()
+        callback(offsets, KafkaException(error) if error is not None else partitions)
+
+    def commit(self, offsets):
+        self._consumer.commit(offsets=to_confluent_offsets(offsets), asynchronous=False)
+
+    def commit_async(self, offsets, callback=None):
+        self._commit_callbacks.append((offsets, callback or (lambda _offsets, _response: None)))
+        try:
+            self._consumer.commit(offsets=to_confluent_offsets(offsets), asynchronous=True)
+        except Exception:
+            self._commit_callbacks.pop()
+            raise
+
+    def seek(self, topic_partition, offset):
+        self._consumer.seek(to_confluent(topic_partition, offset))
+
+    def pause(self, *topic_partitions):
+        self._consumer.pause([to_confluent(topic_partition) for topic_partition in topic_partitions])
+
+    def resume(self, *topic_partitions):
+        self._consumer.resume([to_confluent(topic_partition) for topic_partition in topic_partitions])
+
+    def assignment(self):
+        return from_confluent(self._consumer.assignment())
+
+    def end_offsets(self, partitions):
+        """:return: Dictionary of TopicPartition -> offset of the next record written to it (high watermark)"""
+        return {topic_partition: self._consumer.get_watermark_offsets(to_confluent(topic_partition), timeout=5)[1]
+                for topic_partition in partitions}
+
+    def position(self, topic_partition):
+        """:return: Offset of the next record fetched from `topic_partition`, None if it was not fetched yet"""
+        offset = self._consumer.position([to_confluent(topic_partition)])[0].offset
+        return offset if offset >= 0 else None
+
+    def consumer_group_metadata(self):
+        return self._consumer.consumer_group_metadata()
+
+    def close(self):
+        self._consumer.close()
+
+
+class ConfluentProducer:
+    """
+    librdkafka producer with the kafka-python `KafkaProducer` API used by the ETL loop, plus the transaction API.
+
+    A background thread serves the delivery reports, so the send futures resolve like the kafka-python ones.
+    """
+
+    def __init__(self, bootstrap_servers, value_serializer=None, transactional_id=None, buffer_memory=None,
+                 config=None, **settings):
+        """
+        :param value_serializer: Called on the values before sending them
+        :param transactional_id: Enables the transactions (`begin_transaction`...), unique by producer instance
+        :param buffer_memory: Maximum size in bytes of the messages waiting to be sent
+        :param config: librdkafka properties added as they are (e.g. security)
+        :param settings: kafka-python settings (see PRODUCER_SETTINGS)
+        """
+        require_confluent()
+        self.value_serializer = value_serializer
+        conf = librdkafka_config(bootstrap_servers, settings, PRODUCER_SETTINGS, config)
+        # partition the keys like the Java and kafka-python producers (see `key_index.default_partition`)
+        conf.setdefault('partitioner', 'murmur2_random')
+        if buffer_memory:
+            conf['queue.buffering.max.kbytes'] = max(buffer_memory // 1024, 1)
+        if transactional_id:
+            conf['transactional.id'] = transactional_id
+        self._producer = confluent_kafka.Producer(conf)
+        if transactional_id:
+            self._producer.init_transactions()
+
+        self._closed = threading.Event()
+        self._poller = threading.Thread(target=self._serve_delivery_reports, daemon=True)
+        self._poller.start()
+
+    def _serve_delivery_reports(self):
+        while not self._closed.is_set():
+            self._producer.poll(0.1)
+
+    def without_serializer(self):
+        """A view of this producer sending the values as they are (e.g. to forward consumed records)."""
+        view = _ProducerView(self)
+        view.value_serializer = None
+        return view
+
+    def send(self, topic, value=None, key=None, headers=None, partition=None):
+        future = DeliveryFuture()
+        if self.value_serializer is not None:
+            value = self.value_serializer(value)
+        kwargs = {'partition': partition} if partition is not None else {}
+        while True:
+            try:
+                self._producer.produce(topic, value=value, key=key, headers=headers, on_delivery=future.on_delivery,
+                                       **kwargs)
+                return future
+            except BufferError:
+                # local queue full: wait for deliveries to free some room
+                self._producer.poll(0.1)
+
+    def partitions_for(self, topic):
+        metadata = self._producer.list_topics(topic, timeout=10)
+        return set(metadata.topics[topic].partitions) if topic in metadata.topics else set()
+
+    def flush(self, timeout=None):
+        remaining = self._producer.flush(timeout if timeout is not None else -1)
+        if remaining:
+            logger.warning(f"{remaining} messages still not delivered after flushing the producer")
+
+    def begin_transaction(self):
+        self._producer.begin_transaction()
+
+    def send_offsets_to_transaction(self, offsets, consumer):
+        """
+        :param offsets: Dictionary of TopicPartition -> OffsetAndMetadata to commit with the transaction
+        :param consumer: ConfluentConsumer which consumed the records
+        """
+        self._producer.send_offsets_to_transaction(to_confluent_offsets(offsets), consumer.consumer_group_metadata())
+
+    def commit_transaction(self):
+        self._producer.commit_transaction()
+
+    def abort_transaction(self):
+        self._producer.abort_transaction()
+
+    def close(self, timeout=None):
+        self.flush(timeout)
+        self._closed.set()
+        self._poller.join()
+
+
+class _ProducerView(ConfluentProducer):
+    """Shares the librdkafka producer of another ConfluentProducer; closing it only flushes."""
+
+    def __init__(self, producer):
+        self.__dict__.update(producer.__dict__)
+
+    def close(self, timeout=None):
+        self.flush(timeout)
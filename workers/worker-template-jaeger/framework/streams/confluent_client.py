@@ -0,0 +1,291 @@
+import time
+from typing import Optional
+
+from ..commons.logger import logger
+from ..streams.confluent_adapters import ConfluentProducer, require_confluent
+from ..streams.consumer_pool import ConsumerPool, security_profile
+from ..streams.delivery import DeliveryReport, encode, send_all
+from ..streams.metadata_cache import MetadataCache, batches, topic_spec
+from ..streams.stream_interface import StreamClientInterface
+
+try:
+    import confluent_kafka
+    from confluent_kafka import KafkaError, KafkaException
+    from confluent_kafka.admin import AdminClient, NewTopic
+except ImportError:
+    confluent_kafka = None
+
+
+def security_config(security_protocol, sasl_mechanism, ssl_check_hostname, ssl_cafile, sasl_plain_username,
+                    sasl_plain_password, ssl_certfile, ssl_keyfile):
+    """librdkafka properties equivalent to the kafka-python security settings of `KafkaClient`."""
+    if security_protocol is None or security_protocol == 'NONE':
+        return {}
+    conf = {
+        'security.protocol': security_protocol,
+        'ssl.endpoint.identification.algorithm': 'https' if ssl_check_hostname else 'none',
+    }
+    for name, value in (('ssl.ca.location', ssl_cafile), ('ssl.certificate.location', ssl_certfile),
+                        ('ssl.key.location', ssl_keyfile)):
+        if value:
+            conf[name] = value
+    if security_protocol.startswith('SASL'):
+        conf['sasl.mechanism'] = sasl_mechanism
+        conf['sasl.username'] = sasl_plain_username
+        conf['sasl.password'] = sasl_plain_password
+    return conf
+
+
+class ConfluentKafkaClient(StreamClientInterface):
+    """`KafkaClient` on top of confluent-kafka (librdkafka), see `create_stream_client`."""
+    _instance = None
+
+    def __init__(
+            self,
+            security_protocol: Optional[str] = 'SSL',  # SASL_SSL
+            sasl_mechanism='PLAIN',  # 'PLAIN, GSSAPI
+            ssl_check_hostname: Optional[bool] = False,
+            ssl_cafile: Optional[str] = None,
+            sasl_plain_username: Optional[str] = None,
+            sasl_plain_password: Optional[str] = None,
+            ssl_certfile: Optional[str] = None,
+            ssl_keyfile: Optional[str] = None,
+
+            auto_offset_reset: Optional[str] = 'earliest',
+            group_id: Optional[str] = 'default_group',
+
+            bootstrap_servers: Optional[str] = '10.10.20.185:9094',
+            metadata_ttl_s: Optional[float] = 30,
+            max_consumers: int = 8
+    ):
+        """
+        :param metadata_ttl_s: Seconds the cluster metadata (topics, partitions, leaders) is cached for
+        :param max_consumers: Maximum number of consumers kept open by `get_consumer` (see `ConsumerPool`)
+        """
+        if ConfluentKafkaClient._instance is not None:
+            raise Exception("This class is a singleton!")
+        require_confluent()
+        self.auto_offset_reset = auto_offset_reset
+        self.group_id = group_id
+        self.bootstrap_servers = bootstrap_servers
+        self.security = security_config(security_protocol, sasl_mechanism, ssl_check_hostname, ssl_cafile,
+                                        sasl_plain_username, sasl_plain_password, ssl_certfile, ssl_keyfile)
+
+        self.producer = ConfluentProducer(bootstrap_servers, config=self.security)
+        self.admin_client = AdminClient(dict(self.security, **{'bootstrap.servers': self._servers()}))
+        self.consumer_pool = ConsumerPool(self._new_consumer, max_consumers)
+        self.metadata = MetadataCache(self._fetch_metadata, metadata_ttl_s)
+        # connect the consumer of the default group before the first API call needs it
+        self.consumer_pool.warm_up(group_id, auto_offset_reset)
+        ConfluentKafkaClient._instance = self
+
+    @classmethod
+    def get_instance(cls, **kwargs):
+        if cls._instance is None:
+            cls._instance = cls(**kwargs)
+        return cls._instance
+
+    def _servers(self):
+        servers = self.bootstrap_servers
+        return servers if isinstance(servers, str) else ','.join(servers)
+
+    def _fetch_metadata(self):
+        """Topic -> {partition: leader} of the whole cluster, for the metadata cache."""
+        metadata = self.admin_client.list_topics(timeout=10)
+        return {name: {partition.id: partition.leader for partition in topic.partitions.values()}
+                for name, topic in metadata.topics.items() if topic.error is None}
+
+    def create_topic(self, topic_name: str, num_partitions: int = 1, replication_factor: int = 1,
+                     retention_time: str = '10000'):
+        self.ensure_topics([{'name': topic_name, 'num_partitions': num_partitions,
+                             'replication_factor': replication_factor, 'retention_time': retention_time}])
+
+    def ensure_topics(self, specs, batch_size: int = 100) -> list:
+        """See `KafkaClient.ensure_topics`."""
+        specs = [topic_spec(spec) for spec in specs]
+        try:
+            existing = self.metadata.topics()
+        except KafkaException as e:
+            logger.error(f"Failed to list the topics: {e}")
+            return []
+        missing = [spec for spec in specs if spec['name'] not in existing]
+        for spec in specs:
+            if spec['name'] in existing:
+                logger.debug(f"Topic {spec['name']} already exists.")
+
+        failed = set()
+        for batch in batches(missing, batch_size):
+            topics = [NewTopic(spec['name'], num_partitions=spec['num_partitions'],
+                               replication_factor=spec['replication_factor'],
+                               config={"retention.ms": spec['retention_time']})
+                      for spec in batch]
+            futures = self.admin_client.create_topics(topics)
+            for spec in batch:
+                try:
+                    futures[spec['name']].result()
+                    logger.debug(f"Topic {spec['name']} created with retention.ms={spec['retention_time']}")
+                except KafkaException as e:
+                    if e.args[0].code() == KafkaError.TOPIC_ALREADY_EXISTS:
+                        logger.debug(f"Topic {spec['name']} already exists.")
+                    else:
+                        logger.error(f"Failed to create topic {spec['name']}: {e}")
+                        failed.add(spec['name'])
+        if missing:
+            self.metadata.invalidate()
+        return [spec['name'] for spec in missing if spec['name'] not in failed]
+
+    def put_message(self, topic_name: str, message: str, key: str = None):
+        try:
+            start_time = time.time()
+            # Wait for send to complete
+            self.put_message_async(topic_name, message, key).get(timeout=10)
+            end_time = time.time()
+            logger.debug(
+                f"Message sent to {topic_name}: {message} with key {key}. Duration time: {(end_time - start_time) * 1000} ms")
+        except (KafkaException, TimeoutError) as e:
+            logger.error(f"Failed to send message to {topic_name}: {e}")
+
+    def put_message_async(self, topic_name: str, message, key: str = None):
+        """:return: DeliveryFuture of the send, see `KafkaClient.put_message_async`"""
+        return self.producer.send(topic_name, key=encode(key) if key else None, value=encode(message))
+
+    def put_messages(self, topic_name: str, messages, key_fn=None, timeout: Optional[float] = 60) -> DeliveryReport:
+        """See `KafkaClient.put_messages`."""
+        return send_all(self.producer, topic_name, messages, key_fn, timeout)
+
+    def flush(self, timeout: Optional[float] = None):
+        self.producer.flush(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """See `KafkaClient.close`."""
+        self.producer.close(timeout)
+        self.consumer_pool.close()
+        if ConfluentKafkaClient._instance is self:
+            ConfluentKafkaClient._instance = None
+
+    def _new_consumer(self, group_id, auto_offset_reset, profile=None):
+        """Consumer of the pool, with the librdkafka security properties of `profile` instead of the client's."""
+        return confluent_kafka.Consumer(dict(dict(profile) if profile else self.security, **{
+            'bootstrap.servers': self._servers(),
+            'group.id': group_id,
+            'auto.offset.reset': auto_offset_reset,
+            'enable.auto.commit': False,
+        }))
+
+    def get_consumer(self, group_id: str, auto_offset_reset: str, security: Optional[dict] = None):
+        """Lease of the pooled consumer of `group_id`, see `KafkaClient.get_consumer`."""
+        return self.consumer_pool.lease(group_id, auto_offset_reset, security_profile(security))
+
+    def _partitions(self, topic_name):
+        return self.metadata.partitions(topic_name)
+
+    def consume_message_by_key(self, topic_name: str, key: str, group_id: str = 'default_group',
+                               auto_offset_reset: str = 'earliest', timeout_ms: int = 10000):
+        try:
+            with self.consumer_pool.lease(group_id, auto_offset_reset) as consumer:
+                partitions = self._partitions(topic_name)
+                if not partitions:
+                    logger.error(f"No partitions found for topic {topic_name}")
+                    return None
+
+                start_time = time.time()
+                for partition in partitions:
+                    tp = confluent_kafka.TopicPartition(topic_name, partition)
+                    low, high = consumer.get_watermark_offsets(tp, timeout=timeout_ms / 1000.0)
+                    if high <= low:
+                        continue
+                    consumer.assign([confluent_kafka.TopicPartition(topic_name, partition, low)])
+
+                    offset = low
+                    while offset < high - 1:
+                        if time.time() - start_time > timeout_ms / 1000.0:
+                            logger.debug(f"Timeout reached while consuming message with key: {key}")
+                            return None
+
+                        msg = consumer.poll(timeout_ms / 1000.0)
+                        if msg is None or msg.error():
+                            continue
+                        offset = msg.offset()
+                        if msg.key() and msg.key().decode('utf-8') == key:
+                            message = msg.value().decode('utf-8')
+                            end_time = time.time()
+                            logger.debug(
+                                f"Consumed message with key: {key} from topic: {topic_name}: {message}. Duration time: {(end_time - start_time) * 1000} ms")
+                            return message
+
+                    logger.debug(f"Reached end of partition {partition} without finding key: {key}")
+        except KafkaException as e:
+            logger.error(f"Failed to consume message by key from {topic_name}: {e}")
+        return None
+
+    def consume_message(self, topic_name: str, group_id: str = 'default_group', auto_offset_reset: str = 'earliest',
+                        timeout_ms: int = 10000):
+        try:
+            start_time = time.time()
+            with self.consumer_pool.lease(group_id, auto_offset_reset) as consumer:
+                partitions = self._partitions(topic_name)
+                if not partitions:
+                    logger.error(f"No partitions found for topic {topic_name}")
+                    return None
+
+                last_message = None
+                for partition in partitions:
+                    tp = confluent_kafka.TopicPartition(topic_name, partition)
+                    low, high = consumer.get_watermark_offsets(tp, timeout=timeout_ms / 1000.0)
+                    if high <= low:
+                        continue
+                    # Move one offset back from the end to get the last message
+                    consumer.assign([confluent_kafka.TopicPartition(topic_name, partition, high - 1)])
+
+                    msg = consumer.poll(timeout_ms / 1000.0)
+                    if msg is not None and not msg.error():
+                        last_message = msg.value().decode('utf-8')
+                        end_time = time.time()
+                        logger.debug(
+                            f"Consumed last message from topic: {topic_name}: {last_message}. Duration time: {(end_time - start_time) * 1000} ms")
+
+                return last_message
+        except KafkaException as e:
+            logger.error(f"Failed to consume last message from {topic_name}: {e}")
+        return None
+
+    def delete_topic(self, topic_name: str):
+        self.delete_topics([topic_name])
+
+    def delete_topics(self, names, batch_size: int = 100) -> list:
+        """See `KafkaClient.delete_topics`."""
+        try:
+            existing = self.metadata.topics()
+        except KafkaException as e:
+            logger.error(f"Failed to list the topics: {e}")
+            return []
+        names = list(dict.fromkeys(names))
+        for name in names:
+            if name not in existing:
+                logger.debug(f"Topic {name} does not exist.")
+        found = [name for name in names if name in existing]
+
+        deleted = set()
+        for batch in batches(found, batch_size):
+            try:
+                futures = self.admin_client.delete_topics(batch)
+            except KafkaException as e:
+                logger.error(f"Failed to delete topics {batch}: {e}")
+                continue
+            for name, future in futures.items():
+                try:
+                    future.result()
+                    logger.debug(f"Topic {name} deleted.")
+                    deleted.add(name)
+                except KafkaException as e:
+                    logger.error(f"Failed to delete topic {name}: {e}")
+        if found:
+            self.metadata.invalidate()
+        return [name for name in found if name in deleted]
+
+    def topic_exists(self, topic_name: str) -> bool:
+        try:
+            return self.metadata.exists(topic_name)
+        except KafkaException as e:
+            logger.error(f"Failed to check if topic {topic_name} exists: {e}")
+            return False
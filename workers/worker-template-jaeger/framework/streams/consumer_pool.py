@@ -0,0 +1,119 @@
+"""
+Pool of the consumers the stream clients read topics with on demand (`consume_message`...), so the API calls reuse
+connected consumers instead of creating one per call, and the number of open consumers stays bounded.
+"""
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from ..commons.logger import logger
+
+
+def security_profile(settings):
+    """Hashable form of the security settings of a consumer, part of its key in the pool (None: the client's)."""
+    return tuple(sorted(settings.items())) if settings else None
+
+
+class _Entry:
+    def __init__(self):
+        # held while the consumer is created or lent
+        self.lock = threading.Lock()
+        self.consumer = None
+        self.evicted = False
+
+
+class ConsumerPool:
+    """
+    Consumers keyed by (group id, offset reset, security profile), at most `max_size` of them: when there are more,
+    the least recently used idle consumers are closed.
+
+    Consumers are not thread safe: `lease` lends a consumer to one caller at a time, the other callers of the same key
+    wait for it. `warm_up` creates and connects a consumer in the background, ahead of its first use.
+    """
+
+    def __init__(self, consumer_factory, max_size=8):
+        """
+        :param consumer_factory: Creates the consumer of a key: `consumer_factory(group_id, auto_offset_reset, profile)`
+        :param max_size: Maximum number of open consumers (exceeded only while all of them are lent)
+        """
+        self.consumer_factory = consumer_factory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            self._entries.move_to_end(key)
+            return entry
+
+    @contextmanager
+    def lease(self, group_id, auto_offset_reset, profile=None):
+        """Consumer of the key, for the duration of the `with` block."""
+        key = (group_id, auto_offset_reset, profile)
+        while True:
+            entry = self._entry(key)
+            entry.lock.acquire()
+            if not entry.evicted:
+                break
+            # evicted between the lookup and the lock: take the new entry
+            entry.lock.release()
+        try:
+            if entry.consumer is None:
+                entry.consumer = self.consumer_factory(group_id, auto_offset_reset, profile)
+            yield entry.consumer
+        finally:
+            entry.lock.release()
+            self._evict()
+
+    def warm_up(self, group_id, auto_offset_reset, profile=None, topics=()):
+        """Create the consumer of the key and fetch the metadata of `topics` in the background."""
+        def run():
+            try:
+                with self.lease(group_id, auto_offset_reset, profile) as consumer:
+                    for topic in topics:
+                        consumer.partitions_for_topic(topic)
+            except Exception as e:
+                logger.warning(f"Failed to warm up the consumer of group {group_id}: {e}")
+
+        threading.Thread(target=run, name='consumer-warm-up', daemon=True).start()
+
+    def _evict(self):
+        evicted = []
+        with self._lock:
+            for key in list(self._entries):
+                if len(self._entries) <= self.max_size:
+                    break
+                entry = self._entries[key]
+                if not entry.lock.acquire(blocking=False):
+                    continue
+                del self._entries[key]
+                entry.evicted = True
+                evicted.append((key, entry))
+        for key, entry in evicted:
+            try:
+                if entry.consumer is not None:
+                    logger.debug(f"Closing the consumer of group {key[0]} ({key[1]}), least recently used")
+                    entry.consumer.close()
+            except Exception as e:
+                logger.warning(f"Failed to close the consumer of group {key[0]}: {e}")
+            finally:
+                entry.consumer = None
+                entry.lock.release()
+
+    def close(self):
+        """Close every consumer, waiting for the ones lent."""
+        with self._lock:
+            entries, self._entries = list(self._entries.values()), OrderedDict()
+        for entry in entries:
+            with entry.lock:
+                entry.evicted = True
+                if entry.consumer is not None:
+                    entry.consumer.close()
+                    entry.consumer = None
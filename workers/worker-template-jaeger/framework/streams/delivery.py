@@ -0,0 +1,142 @@
+"""
+Pipelined sends of many messages: every message is handed to the producer without waiting for the delivery of the
+previous ones, so they share the producer batches and round trips, and the results are gathered in a `DeliveryReport`
+(see `StreamClientInterface.put_messages`).
+"""
+import json
+import threading
+import time
+
+from ..commons.logger import logger
+from ..commons.stats import summarize
+
+
+def encode(value):
+    """Bytes as they are, str as UTF-8, anything else as JSON."""
+    if value is None or isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return json.dumps(value).encode('utf-8')
+
+
+class DeliveryReport:
+    """
+    Outcome of a `put_messages`: number of messages delivered, the messages which were not (index in the input,
+    message, error) and the send -> acknowledgement latencies.
+
+    It is filled by the delivery callbacks of the producer, on its I/O thread.
+    """
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.sent = 0
+        self.successes = 0
+        self.failures = []
+        self.latencies = []
+        self.duration_s = None
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._completed = threading.Condition(self._lock)
+        self._pending = {}
+
+    @property
+    def ok(self):
+        return not self.failures
+
+    def _add(self, index, message):
+        with self._lock:
+            self._pending[index] = message
+            self.sent += 1
+
+    def _on_success(self, index, started, _metadata):
+        with self._lock:
+            # a message already failed by `_wait` (timeout) stays failed
+            if index not in self._pending:
+                return
+            del self._pending[index]
+            self.successes += 1
+            self.latencies.append(time.monotonic() - started)
+            self._completed.notify_all()
+
+    def _on_failure(self, index, message, error):
+        with self._lock:
+            if index not in self._pending:
+                return
+            del self._pending[index]
+            self.failures.append((index, message, error))
+            self._completed.notify_all()
+
+    def _fail(self, index, message, error):
+        """A message the producer did not accept."""
+        with self._lock:
+            self.sent += 1
+            self.failures.append((index, message, error))
+
+    def _wait(self, timeout=None):
+        """Wait for the delivery of every message sent; the ones still pending after `timeout` s are failed."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            while self._pending:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._completed.wait(remaining)
+            for index, message in self._pending.items():
+                self.failures.append((index, message, TimeoutError(f"Message not delivered after {timeout} s")))
+            self._pending.clear()
+            self.failures.sort(key=lambda failure: failure[0])
+            self.duration_s = time.monotonic() - self._started
+
+    def to_dict(self):
+        return {
+            'topic': self.topic,
+            'sent': self.sent,
+            'successes': self.successes,
+            'failures': [{'index': index, 'error': str(error)} for index, _, error in self.failures],
+            'duration_s': round(self.duration_s, 3) if self.duration_s is not None else None,
+            'latency': summarize(self.latencies) if self.latencies else None,
+        }
+
+    def __repr__(self):
+        return (f"DeliveryReport(topic={self.topic}, sent={self.sent}, successes={self.successes}, "
+                f"failures={len(self.failures)})")
+
+
+def send_all(producer, topic, messages, key_fn=None, timeout=None, encode_values=True):
+    """
+    Send `messages` to `topic` without waiting between them, then wait for their delivery.
+
+    :param producer: KafkaProducer or ConfluentProducer
+    :param messages: Iterable of messages (str, bytes or JSON serializable values), consumed lazily
+    :param key_fn: Called on every message to get its key, no key if None
+    :param timeout: Seconds to wait for the deliveries once everything is sent, None to wait for all of them
+    :param encode_values: False to leave the messages to the value serializer of the producer
+    :return: DeliveryReport
+    """
+    report = DeliveryReport(topic)
+    for index, message in enumerate(messages):
+        started = time.monotonic()
+        try:
+            key = key_fn(message) if key_fn else None
+            # blocks only when the producer buffer is full, until the deliveries free some room
+            future = producer.send(topic, key=encode(key), value=encode(message) if encode_values else message)
+        except Exception as e:
+            report._fail(index, message, e)
+            continue
+        report._add(index, message)
+        future.add_callback(report._on_success, index, started)
+        future.add_errback(report._on_failure, index, message)
+
+    try:
+        producer.flush(timeout)
+    except Exception as e:
+        # kafka-python raises on timeout, the messages still pending are failed below
+        logger.debug(f"Flush of the messages sent to {topic} interrupted: {e}")
+    report._wait(timeout)
+    if report.failures:
+        logger.warning(f"{len(report.failures)} of {report.sent} messages not delivered to {topic}: "
+                       f"{report.failures[0][2]}")
+    else:
+        logger.debug(f"{report.sent} messages sent to {topic} in {report.duration_s * 1000:.1f} ms")
+    return report
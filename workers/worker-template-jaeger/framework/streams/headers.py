@@ -0,0 +1,11 @@
+def get_header(record, name):
+    """
+    Value of the header `name` of a consumed record, decoded as UTF-8, None if the record does not have it.
+
+    Header values may be None (confluent-kafka returns None for a header without value): such a header is treated as
+    missing.
+    """
+    for key, value in record.headers or []:
+        if key == name and value is not None:
+            return value.decode('utf-8')
+    return None
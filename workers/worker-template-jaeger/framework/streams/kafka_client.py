@@ -1,11 +1,19 @@
+import threading
 import time
+from socket import gethostname
 from typing import Optional
 
 from kafka import KafkaProducer, KafkaConsumer, TopicPartition
 from kafka.admin import KafkaAdminClient, NewTopic
-from kafka.errors import KafkaError, TopicAlreadyExistsError, NoBrokersAvailable
+from kafka.errors import KafkaError, TopicAlreadyExistsError, NoBrokersAvailable, UnknownTopicOrPartitionError
 
 from ..commons.logger import logger
+from ..streams.consumer_pool import ConsumerPool, security_profile
+from ..streams.delivery import DeliveryReport, encode, send_all
+from ..streams.headers import get_header
+from ..streams.key_index import KeyIndex, KeyIndexStore, default_partition
+from ..streams.metadata_cache import MetadataCache, batches, topic_spec
+from ..streams.reply_router import CORRELATION_ID_HEADER, REPLY_TO_HEADER, ReplyRouter, new_correlation_id
 from ..streams.stream_interface import StreamClientInterface
 
 
@@ -28,8 +36,20 @@ class KafkaClient(StreamClientInterface):
             auto_offset_reset: Optional[str] = 'earliest',
             group_id: Optional[str] = 'default_group',
 
-            bootstrap_servers: Optional[str] = '10.10.20.185:9094'
+            bootstrap_servers: Optional[str] = '10.10.20.185:9094',
+            key_index_store: Optional[KeyIndexStore] = None,
+            reply_topic: Optional[str] = None,
+            metadata_ttl_s: Optional[float] = 30,
+            max_consumers: int = 8
     ):
+        """
+        :param key_index_store: Where the key index of `consume_message_by_key` is kept (see `create_key_index_store`),
+                                in memory if None
+        :param reply_topic: Topic the replies to the `request`s of this process are sent to, `replies.<hostname>` if
+                            None
+        :param metadata_ttl_s: Seconds the cluster metadata (topics, partitions, leaders) is cached for
+        :param max_consumers: Maximum number of consumers kept open by `get_consumer` (see `ConsumerPool`)
+        """
         if KafkaClient._instance is not None:
             raise Exception("This class is a singleton!")
         self.security_protocol = security_protocol
@@ -47,6 +67,15 @@ class KafkaClient(StreamClientInterface):
 
         self.bootstrap_servers = bootstrap_servers
 
+        self.key_index = KeyIndex(self._new_reader, key_index_store)
+        self._reader = None
+        self._reader_lock = threading.Lock()
+        self.reply_topic = reply_topic or f"replies.{gethostname()}"
+        self._reply_router = None
+        self._reply_router_lock = threading.Lock()
+        self.metadata = MetadataCache(self._fetch_metadata, metadata_ttl_s)
+        self.consumer_pool = ConsumerPool(self._new_consumer, max_consumers)
+
         if self.security_protocol==None or self.security_protocol=='NONE':
             try:
                 self.producer = KafkaProducer(
@@ -60,7 +89,6 @@ class KafkaClient(StreamClientInterface):
                     auto_offset_reset=self.auto_offset_reset,
                     group_id=self.group_id,
                 )
-                self.consumers = {}
             except NoBrokersAvailable as e:
                 logger.error(f"Kafka brokers are not available: {e}")
                 raise
@@ -117,10 +145,11 @@ class KafkaClient(StreamClientInterface):
 
                     bootstrap_servers=self.bootstrap_servers
                 )
-                self.consumers = {}
             except NoBrokersAvailable as e:
                 logger.error(f"Kafka brokers are not available: {e}")
                 raise
+        # connect the consumer of the default group before the first API call needs it
+        self.consumer_pool.warm_up(self.group_id, self.auto_offset_reset)
         KafkaClient._instance = self
 
     @classmethod
@@ -139,7 +168,11 @@ class KafkaClient(StreamClientInterface):
             auto_offset_reset: Optional[str] = 'earliest',
             group_id: Optional[str] = 'default_group',
 
-            bootstrap_servers: Optional[str] = '10.10.20.185:9094'
+            bootstrap_servers: Optional[str] = '10.10.20.185:9094',
+            key_index_store: Optional[KeyIndexStore] = None,
+            reply_topic: Optional[str] = None,
+            metadata_ttl_s: Optional[float] = 30,
+            max_consumers: int = 8
     ):
         if cls._instance is None:
             cls._instance = cls(
@@ -156,176 +189,416 @@ class KafkaClient(StreamClientInterface):
                 auto_offset_reset=auto_offset_reset,
                 group_id=group_id,
 
-                bootstrap_servers=bootstrap_servers
+                bootstrap_servers=bootstrap_servers,
+                key_index_store=key_index_store,
+                reply_topic=reply_topic,
+                metadata_ttl_s=metadata_ttl_s,
+                max_consumers=max_consumers
             )
         return cls._instance
 
+    def _connection_settings(self):
+        """kafka-python settings of the brokers and of the security of this client."""
+        if self.security_protocol is None or self.security_protocol == 'NONE':
+            return {'bootstrap_servers': self.bootstrap_servers}
+        return {
+            'security_protocol': self.security_protocol,
+            'sasl_mechanism': self.sasl_mechanism,
+            'ssl_check_hostname': self.ssl_check_hostname,
+            'ssl_cafile': self.ssl_cafile,
+            'sasl_plain_username': self.sasl_plain_username,
+            'sasl_plain_password': self.sasl_plain_password,
+            'ssl_certfile': self.ssl_certfile,
+            'ssl_keyfile': self.ssl_keyfile,
+            'bootstrap_servers': self.bootstrap_servers,
+        }
+
+    def _new_consumer(self, group_id, auto_offset_reset, profile=None):
+        """Consumer of the pool, with the security settings of `profile` instead of the client's if given."""
+        settings = self._connection_settings()
+        settings.update(profile or ())
+        return KafkaConsumer(group_id=group_id, auto_offset_reset=auto_offset_reset, **settings)
+
+    def _new_reader(self):
+        """Consumer reading partitions directly, without consumer group nor committed offsets."""
+        return KafkaConsumer(group_id=None, enable_auto_commit=False, auto_offset_reset='earliest',
+                             **self._connection_settings())
+
+    def _fetch_metadata(self):
+        """Topic -> {partition: leader} of the whole cluster, for the metadata cache."""
+        return {topic['topic']: {partition['partition']: partition['leader'] for partition in topic['partitions']}
+                for topic in self.admin_client.describe_topics()}
+
     def create_topic(self, topic_name: str, num_partitions: int = 1, replication_factor: int = 1,
                      retention_time: str = '10000'):
-        if self.topic_exists(topic_name):
-            logger.debug(f"Topic {topic_name} already exists.")
-            return
-
-        topic_list = [
-            NewTopic(
-                name=topic_name,
-                num_partitions=num_partitions,
-                replication_factor=replication_factor,
-                topic_configs={"retention.ms": retention_time}
-            )
-        ]
+        self.ensure_topics([{'name': topic_name, 'num_partitions': num_partitions,
+                             'replication_factor': replication_factor, 'retention_time': retention_time}])
+
+    def ensure_topics(self, specs, batch_size: int = 100) -> list:
+        """
+        Create the topics which do not exist yet, `batch_size` topics per request to the brokers.
+
+        :param specs: Topic names, or dictionaries with the `name` and the optional `num_partitions`,
+                      `replication_factor` and `retention_time` of the topics (see `create_topic`)
+        :return: Names of the topics created (the ones which failed to be created are left out)
+        """
+        specs = [topic_spec(spec) for spec in specs]
         try:
-            self.admin_client.create_topics(new_topics=topic_list, validate_only=False)
-            logger.debug(f"Topic {topic_name} created with retention.ms={retention_time}")
-        except TopicAlreadyExistsError:
-            logger.debug(f"Topic {topic_name} already exists.")
+            existing = self.metadata.topics()
         except KafkaError as e:
-            logger.error(f"Failed to create topic {topic_name}: {e}")
+            logger.error(f"Failed to list the topics: {e}")
+            return []
+        missing = [spec for spec in specs if spec['name'] not in existing]
+        for spec in specs:
+            if spec['name'] in existing:
+                logger.debug(f"Topic {spec['name']} already exists.")
+
+        failed = set()
+        for batch in batches(missing, batch_size):
+            try:
+                self.admin_client.create_topics(new_topics=[self._new_topic(spec) for spec in batch],
+                                                validate_only=False)
+                for spec in batch:
+                    logger.debug(f"Topic {spec['name']} created with retention.ms={spec['retention_time']}")
+            except KafkaError:
+                # kafka-python raises the error of the first failed topic only, the brokers still create the other
+                # topics of the request: create them one by one to get the error of each one
+                failed.update(self._create_each(batch))
+        if missing:
+            self.metadata.invalidate()
+        return [spec['name'] for spec in missing if spec['name'] not in failed]
+
+    @staticmethod
+    def _new_topic(spec):
+        return NewTopic(
+            name=spec['name'],
+            num_partitions=spec['num_partitions'],
+            replication_factor=spec['replication_factor'],
+            topic_configs={"retention.ms": spec['retention_time']}
+        )
+
+    def _create_each(self, specs):
+        """:return: Names of the topics of `specs` which failed to be created"""
+        failed = []
+        for spec in specs:
+            try:
+                self.admin_client.create_topics(new_topics=[self._new_topic(spec)], validate_only=False)
+                logger.debug(f"Topic {spec['name']} created with retention.ms={spec['retention_time']}")
+            except TopicAlreadyExistsError:
+                logger.debug(f"Topic {spec['name']} already exists.")
+            except KafkaError as e:
+                logger.error(f"Failed to create topic {spec['name']}: {e}")
+                failed.append(spec['name'])
+        return failed
 
     def put_message(self, topic_name: str, message: str, key: str = None):
         try:
             start_time = time.time()
-            future = self.producer.send(topic_name, key=key.encode('utf-8') if key else None,
-                                        value=message.encode('utf-8'))
             # Wait for send to complete
-            future.get(timeout=10)
+            self.put_message_async(topic_name, message, key).get(timeout=10)
             end_time = time.time()
             logger.debug(
                 f"Message sent to {topic_name}: {message} with key {key}. Duration time: {(end_time - start_time) * 1000} ms")
         except KafkaError as e:
             logger.error(f"Failed to send message to {topic_name}: {e}")
 
+    def put_message_async(self, topic_name: str, message, key: str = None):
+        """
+        Send `message` (str, bytes or JSON serializable value) without waiting for its delivery.
+
+        :return: Future of the send (`get(timeout)` to wait for it, `add_callback` / `add_errback`)
+        """
+        return self.producer.send(topic_name, key=encode(key) if key else None, value=encode(message))
+
+    def put_messages(self, topic_name: str, messages, key_fn=None, timeout: Optional[float] = 60) -> DeliveryReport:
+        """
+        Send many messages at once: they are pipelined in the producer batches instead of waiting for every
+        delivery in turn (see `send_all`).
+
+        :param messages: Iterable of messages (str, bytes or JSON serializable values)
+        :param key_fn: Called on every message to get its key, no key if None
+        :param timeout: Seconds to wait for the deliveries once all the messages are sent
+        :return: DeliveryReport of the successes, failures and latencies
+        """
+        return send_all(self.producer, topic_name, messages, key_fn, timeout)
+
+    def flush(self, timeout: Optional[float] = None):
+        """Wait for the delivery of every message sent so far."""
+        self.producer.flush(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Deliver the messages still buffered, then close the producer, consumers, tailers and admin client. The
+        singleton is released: the next `get_instance` creates a new client.
+        """
+        try:
+            self.producer.flush(timeout)
+        except KafkaError as e:
+            logger.error(f"Failed to flush the producer: {e}")
+        self.producer.close(timeout)
+        if self._reply_router is not None:
+            self._reply_router.stop()
+        self.key_index.stop()
+        for consumer in [self.consumer, self._reader]:
+            if consumer is not None:
+                consumer.close()
+        self.consumer_pool.close()
+        self.admin_client.close()
+        if KafkaClient._instance is self:
+            KafkaClient._instance = None
+
+    def request(self, topic_name: str, message: str, timeout: float = 10, key: str = None) -> str:
+        """
+        Send `message` to `topic_name` and wait for its reply (see `request_async`).
+
+        :return: Value of the reply
+        :raises TimeoutError: if no reply came within `timeout` seconds
+        """
+        future = self.request_async(topic_name, message, timeout, key)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            self._reply_router.discard(future.correlation_id)
+            raise
+
+    def request_async(self, topic_name: str, message: str, timeout: float = 10, key: str = None):
+        """
+        Send `message` to `topic_name` with a correlation id and `reply_topic` in its headers, without waiting. The
+        service handling it answers with `reply`. The replies are read by a single consumer shared by every caller of
+        the process (see `ReplyRouter`).
+
+        :return: concurrent.futures.Future resolved with the value of the reply (failed with TimeoutError after
+                 `timeout` seconds); blocking callers use `result()`, asyncio code awaits `asyncio.wrap_future(future)`
+        """
+        router = self._get_reply_router()
+        correlation_id = new_correlation_id()
+        future = router.register(correlation_id, timeout)
+        try:
+            send = self.producer.send(topic_name, key=key.encode('utf-8') if key else None,
+                                      value=message.encode('utf-8'),
+                                      headers=[(CORRELATION_ID_HEADER, correlation_id.encode('utf-8')),
+                                               (REPLY_TO_HEADER, self.reply_topic.encode('utf-8'))])
+        except KafkaError as e:
+            router.fail(correlation_id, e)
+            return future
+
+        send.add_errback(lambda error: router.fail(correlation_id, error))
+        return future
+
+    def reply(self, request_record, message: str):
+        """
+        Answer a record sent with `request`: send `message` to its reply topic, with its correlation id.
+
+        :return: Future of the send, None if the record does not expect a reply
+        """
+        reply_topic = get_header(request_record, REPLY_TO_HEADER)
+        correlation_id = get_header(request_record, CORRELATION_ID_HEADER)
+        if reply_topic is None or correlation_id is None:
+            logger.debug(f"Record {request_record.topic}-{request_record.partition}@{request_record.offset} "
+                         f"does not expect a reply")
+            return None
+        return self.producer.send(reply_topic, value=message.encode('utf-8'),
+                                  headers=[(CORRELATION_ID_HEADER, correlation_id.encode('utf-8'))])
+
+    def _get_reply_router(self):
+        with self._reply_router_lock:
+            if self._reply_router is None:
+                self.create_topic(self.reply_topic, retention_time=str(60 * 60 * 1000))
+                self._reply_router = ReplyRouter(self._new_reader, self.reply_topic)
+            router = self._reply_router
+        router.start()
+        return router
+
     def get_consumer(
             self,
             group_id: str,
             auto_offset_reset: str,
-            topic_name: str,
-
+            topic_name: str = None,
+            security: Optional[dict] = None
     ):
-        if group_id not in self.consumers:
-            try:
-                if self.security_protocol == None or self.security_protocol == 'NONE':
-                    self.consumers[group_id] = KafkaConsumer(
-                        bootstrap_servers=self.bootstrap_servers,
-                        auto_offset_reset=self.auto_offset_reset,
-                        group_id=self.group_id,
-                    )
-                else:
-                    self.consumers[group_id] = KafkaConsumer(
-                        security_protocol=self.security_protocol,
-                        sasl_mechanism=self.sasl_mechanism,
-                        ssl_check_hostname=self.ssl_check_hostname,
-                        ssl_cafile=self.ssl_cafile,
-                        sasl_plain_username=self.sasl_plain_username,
-                        sasl_plain_password=self.sasl_plain_password,
-                        ssl_certfile=self.ssl_certfile,
-                        ssl_keyfile=self.ssl_keyfile,
-
-                        # # api_version = self.api_version
-                        auto_offset_reset=auto_offset_reset,
-                        group_id=group_id,
-                        # # value_deserializer=lambda x: x.decode('utf-8'),
-
-                        bootstrap_servers=self.bootstrap_servers
-                    )
-            except Exception as e:
-                logger.debug(f'e : {e}')
-            # Warm up the consumer by polling once
-            try:
-                self.consumers[group_id].poll(1.0)
-            except Exception as e:
-                logger.debug(f'e : {e}')
-        try:
-            return self.consumers[group_id]
-        except Exception as e:
-            logger.debug(f'e : {e}')
-            return None
+        """
+        Lease of the pooled consumer of `group_id` (see `ConsumerPool.lease`), to use in a `with` block:
+
+            with client.get_consumer('my_group', 'earliest') as consumer:
+                consumer.assign(...)
+
+        The consumer is lent to the block only: it goes back to the pool at its end, where the least recently used
+        consumers are closed to make room for others. Raises at the start of the block if it cannot be created.
+
+        :param security: kafka-python security settings replacing the client's (e.g. another SASL user)
+        """
+        return self.consumer_pool.lease(group_id, auto_offset_reset, security_profile(security))
+
+    def index_topic(self, topic_name: str):
+        """Start indexing the keys of `topic_name` in the background, ahead of its first `consume_message_by_key`."""
+        self.key_index.add_topic(topic_name)
 
     def consume_message_by_key(self, topic_name: str, key: str, group_id: str = 'default_group',
                                auto_offset_reset: str = 'earliest', timeout_ms: int = 10000):
+        """
+        Value of the last message of `key` in `topic_name`, None if there is none.
+
+        The keys of the topic are indexed in the background from its first lookup (see `KeyIndex`): an indexed key is
+        fetched with a single read. Otherwise only the partition the default partitioner assigns to the key is read,
+        from where the index stopped, so a message produced to an explicit partition is found once it is indexed.
+        The lookups read without consumer group, `group_id` and `auto_offset_reset` are not used anymore.
+        """
+        start_time = time.time()
+        deadline = start_time + timeout_ms / 1000.0
         try:
-            consumer = self.get_consumer(group_id, auto_offset_reset, topic_name)
-            partitions = consumer.partitions_for_topic(topic_name)
-            if not partitions:
-                logger.error(f"No partitions found for topic {topic_name}")
-                return None
-
-            start_time = time.time()
-            for partition in partitions:
-                tp = TopicPartition(topic_name, partition)
-                consumer.assign([tp])
-                end_offsets = consumer.end_offsets([tp])[tp]
-                consumer.seek_to_beginning(tp)
-
-                while consumer.position(tp) < end_offsets:
-                    if time.time() - start_time > timeout_ms / 1000.0:
-                        logger.debug(f"Timeout reached while consuming message with key: {key}")
+            self.key_index.add_topic(topic_name)
+            with self._reader_lock:
+                if self._reader is None:
+                    self._reader = self._new_reader()
+                record = None
+                location = self.key_index.lookup(topic_name, key)
+                if location is not None:
+                    record = self._read_at(TopicPartition(topic_name, location[0]), location[1], deadline)
+                    if record is not None and (record.key is None or record.key.decode('utf-8') != key):
+                        # the indexed record is gone (retention), look for a later one
+                        record = None
+                if record is None:
+                    partitions = self._reader.partitions_for_topic(topic_name)
+                    if not partitions:
+                        logger.error(f"No partitions found for topic {topic_name}")
                         return None
+                    partition = default_partition(key, partitions)
+                    record = self._scan(TopicPartition(topic_name, partition), key,
+                                        self.key_index.position(topic_name, partition), deadline)
 
-                    msg = consumer.poll(timeout_ms / 1000.0)
-                    if msg:
-                        for record in msg.values():
-                            for rec in record:
-                                if rec.key and rec.key.decode('utf-8') == key:
-                                    message = rec.value.decode('utf-8')
-                                    end_time = time.time()
-                                    logger.debug(
-                                        f"Consumed message with key: {key} from topic: {topic_name}: {message}. Duration time: {(end_time - start_time) * 1000} ms")
-                                    return message
-
-                logger.debug(f"Reached end of partition {partition} without finding key: {key}")
+            if record is None:
+                logger.debug(f"Key {key} not found in topic {topic_name}")
+                return None
+            message = record.value.decode('utf-8')
+            end_time = time.time()
+            logger.debug(
+                f"Consumed message with key: {key} from topic: {topic_name}: {message}. Duration time: {(end_time - start_time) * 1000} ms")
+            return message
         except KafkaError as e:
             logger.error(f"Failed to consume message by key from {topic_name}: {e}")
         return None
 
+    def _read_at(self, tp, offset, deadline):
+        """First record of `tp` from `offset`, None if there is none before `deadline`."""
+        self._reader.assign([tp])
+        self._reader.seek(tp, offset)
+        end_offset = self._reader.end_offsets([tp])[tp]
+        while self._reader.position(tp) < end_offset and time.time() < deadline:
+            records = self._reader.poll(timeout_ms=max(int((deadline - time.time()) * 1000), 1), max_records=1)
+            if records.get(tp):
+                return records[tp][0]
+        return None
+
+    def _scan(self, tp, key, from_offset, deadline):
+        """Last record of `key` in `tp` from `from_offset`, None if there is none (or `deadline` is reached)."""
+        end_offset = self._reader.end_offsets([tp])[tp]
+        if from_offset >= end_offset:
+            return None
+        self._reader.assign([tp])
+        self._reader.seek(tp, from_offset)
+        found = None
+        while self._reader.position(tp) < end_offset:
+            if time.time() > deadline:
+                logger.debug(f"Timeout reached while consuming message with key: {key}")
+                break
+            records = self._reader.poll(timeout_ms=max(int((deadline - time.time()) * 1000), 1))
+            for rec in records.get(tp, []):
+                if rec.offset < end_offset and rec.key and rec.key.decode('utf-8') == key:
+                    found = rec
+        return found
+
     def consume_message(self, topic_name: str, group_id: str = 'default_group', auto_offset_reset: str = 'earliest',
                         timeout_ms: int = 10000):
         try:
             start_time = time.time()
-            consumer = self.get_consumer(group_id, auto_offset_reset, topic_name)
-            partitions = consumer.partitions_for_topic(topic_name)
-            if not partitions:
-                logger.error(f"No partitions found for topic {topic_name}")
-                return None
+            with self.consumer_pool.lease(group_id, auto_offset_reset) as consumer:
+                partitions = consumer.partitions_for_topic(topic_name)
+                if not partitions:
+                    logger.error(f"No partitions found for topic {topic_name}")
+                    return None
+
+                tps = [TopicPartition(topic_name, partition) for partition in sorted(partitions)]
+                # keep the assignment of the previous call on the same topic
+                if consumer.assignment() != set(tps):
+                    consumer.assign(tps)
+                end_offsets = consumer.end_offsets(tps)
+                pending = {tp for tp in tps if end_offsets[tp] > 0}
+                for tp in pending:
+                    # Move one offset back from the end to get the last message
+                    consumer.seek(tp, end_offsets[tp] - 1)
+
+                last_messages = {}
+                deadline = start_time + timeout_ms / 1000.0
+                while pending and time.time() < deadline:
+                    records = consumer.poll(timeout_ms=max(int((deadline - time.time()) * 1000), 1))
+                    for tp, recs in records.items():
+                        if recs and tp in pending:
+                            last_messages[tp] = recs[-1].value.decode('utf-8')
+                            pending.discard(tp)
 
             last_message = None
-            for partition in partitions:
-                tp = TopicPartition(topic_name, partition)
-                consumer.assign([tp])
-                consumer.seek_to_end(tp)
-                # Move one offset back from the end to get the last message
-                end_offset = consumer.position(tp)
-                consumer.seek(tp, end_offset - 1)
-
-                msg = consumer.poll(timeout_ms / 1000.0)
-                if msg:
-                    for record in msg.values():
-                        for rec in record:
-                            last_message = rec.value.decode('utf-8')
-                            end_time = time.time()
-                            logger.debug(
-                                f"Consumed last message from topic: {topic_name}: {last_message}. Duration time: {(end_time - start_time) * 1000} ms")
-
+            for tp in tps:
+                if tp in last_messages:
+                    last_message = last_messages[tp]
+            if last_message is not None:
+                end_time = time.time()
+                logger.debug(
+                    f"Consumed last message from topic: {topic_name}: {last_message}. Duration time: {(end_time - start_time) * 1000} ms")
             return last_message
         except KafkaError as e:
             logger.error(f"Failed to consume last message from {topic_name}: {e}")
         return None
 
     def delete_topic(self, topic_name: str):
-        if not self.topic_exists(topic_name):
-            logger.debug(f"Topic {topic_name} does not exist.")
-            return
+        self.delete_topics([topic_name])
+
+    def delete_topics(self, names, batch_size: int = 100) -> list:
+        """
+        Delete the topics which exist, `batch_size` topics per request to the brokers.
 
+        :return: Names of the topics deleted (the ones which failed to be deleted are left out)
+        """
         try:
-            self.admin_client.delete_topics([topic_name])
-            logger.debug(f"Topic {topic_name} deleted.")
+            existing = self.metadata.topics()
         except KafkaError as e:
-            logger.error(f"Failed to delete topic {topic_name}: {e}")
+            logger.error(f"Failed to list the topics: {e}")
+            return []
+        names = list(dict.fromkeys(names))
+        for name in names:
+            if name not in existing:
+                logger.debug(f"Topic {name} does not exist.")
+        found = [name for name in names if name in existing]
+
+        failed = set()
+        for batch in batches(found, batch_size):
+            try:
+                self.admin_client.delete_topics(batch)
+                logger.debug(f"Topics {batch} deleted.")
+            except KafkaError:
+                # as for `ensure_topics`: delete them one by one to get the error of each one
+                failed.update(self._delete_each(batch))
+        if found:
+            self.metadata.invalidate()
+        return [name for name in found if name not in failed]
+
+    def _delete_each(self, names):
+        """:return: Names of the topics of `names` which failed to be deleted"""
+        failed = []
+        for name in names:
+            try:
+                self.admin_client.delete_topics([name])
+                logger.debug(f"Topic {name} deleted.")
+            except UnknownTopicOrPartitionError:
+                # deleted by the batch request
+                logger.debug(f"Topic {name} deleted.")
+            except KafkaError as e:
+                logger.error(f"Failed to delete topic {name}: {e}")
+                failed.append(name)
+        return failed
 
     def topic_exists(self, topic_name: str) -> bool:
         try:
-            cluster_metadata = self.admin_client.list_topics()
-            return topic_name in cluster_metadata
+            return self.metadata.exists(topic_name)
         except KafkaError as e:
             logger.error(f"Failed to check if topic {topic_name} exists: {e}")
             return False
@@ -0,0 +1,259 @@
+"""
+Key -> (partition, offset) index of Kafka topics, kept up to date by a background tailer, so a message is fetched by
+key with a single read instead of a scan of the topic (see `KafkaClient.consume_message_by_key`).
+"""
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from kafka import TopicPartition
+from kafka.partitioner.default import murmur2
+
+from ..commons.logger import logger
+
+KEY_INDEX_STORES = ('memory', 'redis', 'disk')
+
+
+def default_partition(key, partitions):
+    """
+    Partition the default partitioner of the producers (murmur2, as the Java client) assigns to `key`.
+
+    :param key: Message key, as a string
+    :param partitions: Partition ids of the topic
+    """
+    partitions = sorted(partitions)
+    return partitions[(murmur2(key.encode('utf-8')) & 0x7fffffff) % len(partitions)]
+
+
+class KeyIndexStore(ABC):
+    """Where a `KeyIndex` keeps the location of the last record of every key, and how far it indexed each partition."""
+
+    @abstractmethod
+    def get(self, topic, key):
+        """:return: (partition, offset) of the last indexed record of `key`, None if the key is not indexed"""
+        pass
+
+    @abstractmethod
+    def put_many(self, topic, locations, positions):
+        """
+        :param locations: Dictionary of key -> (partition, offset) of its last record
+        :param positions: Dictionary of partition -> next offset to index
+        """
+        pass
+
+    @abstractmethod
+    def positions(self, topic):
+        """:return: Dictionary of partition -> next offset to index"""
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryKeyIndexStore(KeyIndexStore):
+    """Index in the memory of the process, rebuilt from the beginning of the topics on every start."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locations = {}
+        self._positions = {}
+
+    def get(self, topic, key):
+        return self._locations.get(topic, {}).get(key)
+
+    def put_many(self, topic, locations, positions):
+        with self._lock:
+            self._locations.setdefault(topic, {}).update(locations)
+            self._positions.setdefault(topic, {}).update(positions)
+
+    def positions(self, topic):
+        with self._lock:
+            return dict(self._positions.get(topic, {}))
+
+
+class RedisKeyIndexStore(KeyIndexStore):
+    """
+    Index in Redis, shared by the workers and kept across restarts: a hash `<prefix>:<topic>` of key ->
+    `partition:offset` and a hash `<prefix>:<topic>:positions` of partition -> next offset to index.
+    """
+
+    def __init__(self, redis_client, prefix='key-index'):
+        """:param redis_client: Redis client returning str (e.g. `RedisUtils.redis`)"""
+        self.redis = redis_client
+        self.prefix = prefix
+
+    def get(self, topic, key):
+        location = self.redis.hget(f"{self.prefix}:{topic}", key)
+        if location is None:
+            return None
+        partition, offset = location.split(':')
+        return int(partition), int(offset)
+
+    def put_many(self, topic, locations, positions):
+        pipeline = self.redis.pipeline()
+        if locations:
+            pipeline.hset(f"{self.prefix}:{topic}", mapping={key: f"{partition}:{offset}"
+                                                             for key, (partition, offset) in locations.items()})
+        if positions:
+            pipeline.hset(f"{self.prefix}:{topic}:positions", mapping=positions)
+        pipeline.execute()
+
+    def positions(self, topic):
+        return {int(partition): int(offset)
+                for partition, offset in self.redis.hgetall(f"{self.prefix}:{topic}:positions").items()}
+
+
+class DiskKeyIndexStore(KeyIndexStore):
+    """Index in a SQLite file, kept across restarts of the process."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS locations (topic TEXT, key TEXT, partition INTEGER, "
+                             "offset INTEGER, PRIMARY KEY (topic, key))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS positions (topic TEXT, partition INTEGER, offset INTEGER, "
+                             "PRIMARY KEY (topic, partition))")
+
+    def get(self, topic, key):
+        with self._lock:
+            return self._db.execute("SELECT partition, offset FROM locations WHERE topic = ? AND key = ?",
+                                    (topic, key)).fetchone()
+
+    def put_many(self, topic, locations, positions):
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?)",
+                                 [(topic, key, partition, offset) for key, (partition, offset) in locations.items()])
+            self._db.executemany("INSERT OR REPLACE INTO positions VALUES (?, ?, ?)",
+                                 [(topic, partition, offset) for partition, offset in positions.items()])
+
+    def positions(self, topic):
+        with self._lock:
+            return dict(self._db.execute("SELECT partition, offset FROM positions WHERE topic = ?", (topic,)))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def create_key_index_store(store=None, redis_client=None, path=None):
+    """
+    :param store: One of KEY_INDEX_STORES, `memory` by default
+    :param redis_client: Redis client of the `redis` store
+    :param path: SQLite file of the `disk` store
+    """
+    store = store or 'memory'
+    if store == 'memory':
+        return MemoryKeyIndexStore()
+    if store == 'redis':
+        return RedisKeyIndexStore(redis_client)
+    if store == 'disk':
+        return DiskKeyIndexStore(path)
+    raise ValueError(f"Unknown key index store: {store}. Expected one of {KEY_INDEX_STORES}")
+
+
+class KeyIndex:
+    """
+    Tails the indexed topics from a consumer without consumer group, on a background thread, and records where the
+    last record of every key is. It resumes from the positions saved in the store, and picks up new partitions every
+    `refresh_interval_s`.
+
+    Records without key are skipped. Only the last record of a key is indexed: a key written several times resolves
+    to its latest value.
+    """
+
+    def __init__(self, consumer_factory, store=None, poll_timeout_ms=500, refresh_interval_s=60):
+        """
+        :param consumer_factory: Creates the KafkaConsumer of the tailer (no group id, no auto commit)
+        :param store: KeyIndexStore, in memory by default
+        """
+        self.consumer_factory = consumer_factory
+        self.store = store or MemoryKeyIndexStore()
+        self.poll_timeout_ms = poll_timeout_ms
+        self.refresh_interval_s = refresh_interval_s
+
+        self._lock = threading.Lock()
+        self._topics = set()
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_topic(self, topic):
+        """Start indexing `topic` (no-op if it already is)."""
+        with self._lock:
+            if topic in self._topics:
+                return
+            self._topics.add(topic)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='key-index', daemon=True)
+                self._thread.start()
+        self._changed.set()
+
+    def lookup(self, topic, key):
+        """:return: (partition, offset) of the last record of `key` indexed so far, None if there is none"""
+        return self.store.get(topic, key)
+
+    def position(self, topic, partition):
+        """Offset from which the records of `partition` are not indexed yet."""
+        return self.store.positions(topic).get(partition, 0)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.store.close()
+
+    def _run(self):
+        consumer = None
+        next_refresh = 0
+        while not self._stopped.is_set():
+            try:
+                if consumer is None:
+                    consumer = self.consumer_factory()
+                if self._changed.is_set() or time.monotonic() >= next_refresh:
+                    self._changed.clear()
+                    self._assign(consumer)
+                    next_refresh = time.monotonic() + self.refresh_interval_s
+                records = consumer.poll(timeout_ms=self.poll_timeout_ms)
+                if records:
+                    self._index(records)
+            except Exception as e:
+                logger.error(f"Key index tailer failed: {e}. Retrying in 5 seconds...")
+                if consumer is not None:
+                    consumer.close()
+                    consumer = None
+                self._changed.set()
+                self._stopped.wait(5)
+        if consumer is not None:
+            consumer.close()
+
+    def _assign(self, consumer):
+        with self._lock:
+            topics = list(self._topics)
+        partitions = {TopicPartition(topic, partition)
+                      for topic in topics for partition in consumer.partitions_for_topic(topic) or ()}
+        if partitions == consumer.assignment():
+            return
+        consumer.assign(list(partitions))
+        for topic_partition in partitions:
+            position = self.store.positions(topic_partition.topic).get(topic_partition.partition)
+            if position is None:
+                consumer.seek_to_beginning(topic_partition)
+            else:
+                consumer.seek(topic_partition, position)
+        logger.debug(f"Key index tailing {len(partitions)} partitions of {topics}")
+
+    def _index(self, records):
+        by_topic = {}
+        for topic_partition, messages in records.items():
+            if not messages:
+                continue
+            locations, positions = by_topic.setdefault(topic_partition.topic, ({}, {}))
+            for message in messages:
+                if message.key is not None:
+                    locations[message.key.decode('utf-8', 'replace')] = (message.partition, message.offset)
+            positions[topic_partition.partition] = messages[-1].offset + 1
+        for topic, (locations, positions) in by_topic.items():
+            self.store.put_many(topic, locations, positions)
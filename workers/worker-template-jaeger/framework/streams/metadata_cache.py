@@ -0,0 +1,74 @@
+"""
+Cluster metadata (topics, partitions and their leaders) cached for a few seconds, so the topic administration of the
+stream clients does not fetch the metadata of the whole cluster on every call.
+"""
+import threading
+import time
+
+
+class MetadataCache:
+    """
+    Topic -> {partition: leader broker id} of the cluster, fetched at most once every `ttl_s` seconds. The clients
+    `invalidate` it when they create or delete topics, so their own changes are seen right away.
+    """
+
+    def __init__(self, fetch, ttl_s=30):
+        """
+        :param fetch: Returns the current metadata of the cluster, as a dictionary of topic -> {partition: leader}
+        :param ttl_s: Seconds the fetched metadata is used for, 0 to fetch it every time
+        """
+        self.fetch = fetch
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._topics = None
+        self._expires = 0
+
+    def _current(self):
+        with self._lock:
+            if self._topics is None or time.monotonic() >= self._expires:
+                self._topics = self.fetch()
+                self._expires = time.monotonic() + self.ttl_s
+            return self._topics
+
+    def invalidate(self):
+        with self._lock:
+            self._topics = None
+
+    def topics(self):
+        """:return: Set of the topic names"""
+        return set(self._current())
+
+    def exists(self, topic):
+        return topic in self._current()
+
+    def partition_count(self, topic):
+        """:return: Number of partitions of `topic`, 0 if it does not exist"""
+        return len(self._current().get(topic, {}))
+
+    def partitions(self, topic):
+        """:return: Sorted partition ids of `topic`"""
+        return sorted(self._current().get(topic, {}))
+
+    def leaders(self, topic):
+        """:return: Dictionary of partition -> id of its leader broker (-1 if it has none)"""
+        return dict(self._current().get(topic, {}))
+
+
+def topic_spec(spec):
+    """
+    Arguments of `create_topic` from a topic spec of `ensure_topics`: a topic name, or a dictionary with its `name` and
+    optional `num_partitions`, `replication_factor` and `retention_time`.
+    """
+    if isinstance(spec, str):
+        spec = {'name': spec}
+    return {
+        'name': spec['name'],
+        'num_partitions': spec.get('num_partitions', 1),
+        'replication_factor': spec.get('replication_factor', 1),
+        'retention_time': str(spec.get('retention_time', '10000')),
+    }
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,157 @@
+"""
+Request/reply over Kafka: requests carry a correlation id and the topic to reply to in their headers, and the replies
+of every request of the process are read by a single consumer and handed to the caller waiting for them (see
+`KafkaClient.request`).
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from kafka import TopicPartition
+
+from ..commons.logger import logger
+from ..streams.headers import get_header
+
+CORRELATION_ID_HEADER = 'x-correlation-id'
+REPLY_TO_HEADER = 'x-reply-to'
+
+
+def new_correlation_id():
+    return uuid.uuid4().hex
+
+
+class ReplyRouter:
+    """
+    Tails a reply topic from one long-lived consumer, from its end and without consumer group (every process reading
+    the topic sees every reply and keeps its own), and resolves the pending requests by correlation id. When the
+    consumer fails, it is recreated and resumes from the positions it had read up to, so the replies sent meanwhile are
+    still read.
+
+    A request is a `concurrent.futures.Future`: callers block on `result()` or, from asyncio code, await
+    `asyncio.wrap_future(future)`. A request without reply after its timeout fails with TimeoutError.
+    """
+
+    def __init__(self, consumer_factory, reply_topic, poll_timeout_ms=100):
+        """
+        :param consumer_factory: Creates the KafkaConsumer reading the replies (no group id, no auto commit)
+        :param reply_topic: Topic the replies of this process are sent to
+        """
+        self.consumer_factory = consumer_factory
+        self.reply_topic = reply_topic
+        self.poll_timeout_ms = poll_timeout_ms
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._error = None
+        # TopicPartition -> next offset to read, kept across the consumers (router thread only)
+        self._positions = {}
+
+    def start(self, timeout=10):
+        """Start reading the reply topic, and wait until the replies sent from now on are read."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='reply-router', daemon=True)
+                self._thread.start()
+        if not self._ready.wait(timeout):
+            raise TimeoutError(f"Reply topic {self.reply_topic} not ready after {timeout} s: {self._error}")
+
+    def register(self, correlation_id, timeout):
+        """
+        :return: Future resolved with the value of the reply to `correlation_id`
+        """
+        future = Future()
+        future.correlation_id = correlation_id
+        with self._lock:
+            self._pending[correlation_id] = (future, time.monotonic() + timeout)
+        return future
+
+    def discard(self, correlation_id):
+        with self._lock:
+            self._pending.pop(correlation_id, None)
+
+    def fail(self, correlation_id, error):
+        """Fail the request `correlation_id` with `error` (e.g. the request could not be sent), if still pending."""
+        with self._lock:
+            pending = self._pending.pop(correlation_id, None)
+        if pending is not None:
+            future, _ = pending
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            pending, self._pending = list(self._pending.values()), {}
+        for future, _ in pending:
+            future.cancel()
+
+    def _run(self):
+        consumer = None
+        while not self._stopped.is_set():
+            try:
+                if consumer is None:
+                    consumer = self._open()
+                    self._ready.set()
+                for topic_partition, records in consumer.poll(timeout_ms=self.poll_timeout_ms).items():
+                    for record in records:
+                        self._resolve(record)
+                        self._positions[topic_partition] = record.offset + 1
+                self._expire()
+            except Exception as e:
+                self._error = e
+                logger.error(f"Reply router of {self.reply_topic} failed: {e}. Retrying in 1 second...")
+                if consumer is not None:
+                    consumer.close()
+                    consumer = None
+                self._stopped.wait(1)
+        if consumer is not None:
+            consumer.close()
+
+    def _open(self):
+        consumer = self.consumer_factory()
+        partitions = [TopicPartition(self.reply_topic, partition)
+                      for partition in consumer.partitions_for_topic(self.reply_topic) or ()]
+        if not partitions:
+            consumer.close()
+            raise ValueError(f"No partitions found for topic {self.reply_topic}")
+        consumer.assign(partitions)
+        new_partitions = [topic_partition for topic_partition in partitions if topic_partition not in self._positions]
+        if new_partitions:
+            consumer.seek_to_end(*new_partitions)
+        for topic_partition in partitions:
+            if topic_partition in self._positions:
+                consumer.seek(topic_partition, self._positions[topic_partition])
+            else:
+                # resolve the end offset now, so no reply sent after `start` returns is skipped
+                self._positions[topic_partition] = consumer.position(topic_partition)
+        return consumer
+
+    def _resolve(self, record):
+        correlation_id = get_header(record, CORRELATION_ID_HEADER)
+        if correlation_id is None:
+            return
+        with self._lock:
+            pending = self._pending.pop(correlation_id, None)
+        if pending is not None:
+            future, _ = pending
+            if future.set_running_or_notify_cancel():
+                future.set_result(record.value.decode('utf-8') if record.value is not None else None)
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [correlation_id for correlation_id, (_, deadline) in self._pending.items() if deadline <= now]
+            futures = [self._pending.pop(correlation_id)[0] for correlation_id in expired]
+        for future in futures:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(TimeoutError(f"No reply to request {future.correlation_id}"))
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import Optional
 
 
 class StreamClientInterface(ABC):
@@ -12,6 +13,22 @@ class StreamClientInterface(ABC):
     def put_message(self, topic_name: str, message: str, key: str):
         pass
 
+    @abstractmethod
+    def put_message_async(self, topic_name: str, message, key: str = None):
+        pass
+
+    @abstractmethod
+    def put_messages(self, topic_name: str, messages, key_fn=None, timeout: Optional[float] = 60):
+        pass
+
+    @abstractmethod
+    def flush(self, timeout: Optional[float] = None):
+        pass
+
+    @abstractmethod
+    def close(self, timeout: Optional[float] = None):
+        pass
+
     @abstractmethod
     def consume_message_by_key(self, topic_name: str, key: str, group_id: str = 'default_group',
                                auto_offset_reset: str = 'earliest', timeout_ms: int = 10000):
@@ -26,6 +43,14 @@ class StreamClientInterface(ABC):
     def delete_topic(self, topic_name: str):
         pass
 
+    @abstractmethod
+    def ensure_topics(self, specs, batch_size: int = 100) -> list:
+        pass
+
+    @abstractmethod
+    def delete_topics(self, names, batch_size: int = 100) -> list:
+        pass
+
     @abstractmethod
     def topic_exists(self, topic_name: str) -> bool:
         pass
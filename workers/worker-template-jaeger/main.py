@@ -9,10 +9,14 @@ from setuptools._distutils.util import strtobool
 
 import config
 from framework.etl.framework_etl import fetch_configuration, create_kafka_consumer, create_kafka_producer, \
-    handle_message, close_resources
+    handle_message, close_resources, transactional_id
+from framework.etl.profiles import CONSUMER_PROFILE, PRODUCER_PROFILE, parse_profile
+from framework.streams.backend import new_producer
 from config import Config
 from models.instances import cors, jwt, bcrypt, talisman, flask_instrumentor, req_instrumentor, kafka_instrumentor
+from framework.commons.codec import get_codec
 from framework.commons.logger import logger
+from framework.commons.metrics import register_metrics_endpoint
 from framework.api.dynamic import generate_endpoints_from_config
 from framework.api.server import create_api, create_app
 from flask import Flask
@@ -60,12 +64,22 @@ def get_file_names(path):
     return file_names
 
 
-def kafka_listener():
+def kafka_listener(consumer_name=Config.WORKER_NAME, producer=None, retry_producer=None, stop_event=None,
+                   instance=None):
+    """
+    Run the message handling loop of `consumer_name`, in its own consumer group.
+
+    :param producer: Producer shared with the other consumers of the process (host mode), a dedicated one is created
+                     if None
+    :param retry_producer: Producer without value serializer shared for the retry topics (host mode)
+    :param stop_event: Event stopping the loop gracefully (supervisor)
+    :param instance: Index of the consumer process on this host (supervisor)
+    """
     consumer = None
-    producer = None
+    own_producer = producer is None
     try:
         # Fetch configuration from the database
-        config = fetch_configuration(Config.WORKER_NAME)
+        config = fetch_configuration(consumer_name)
 
         # Parse topics and Kafka bootstrap server from configuration
         KAFKA_INPUT_TOPICS = config.topics_input.split(',')
@@ -73,8 +87,13 @@ def kafka_listener():
         KAFKA_BOOTSTRAP_SERVERS = config.kafka_bootstrap_server.split(',')
 
         # Create Kafka consumer and producer with retry mechanisms
-        consumer = create_kafka_consumer(KAFKA_INPUT_TOPICS, KAFKA_BOOTSTRAP_SERVERS)
-        producer = create_kafka_producer(KAFKA_BOOTSTRAP_SERVERS, KAFKA_OUTPUT_TOPICS)
+        consumer = create_kafka_consumer(KAFKA_INPUT_TOPICS, KAFKA_BOOTSTRAP_SERVERS,
+                                         parse_profile(config.consumer_profile, CONSUMER_PROFILE), consumer_name)
+        if own_producer:
+            producer = create_kafka_producer(KAFKA_BOOTSTRAP_SERVERS, KAFKA_OUTPUT_TOPICS,
+                                             get_codec(config.codec or Config.CODEC),
+                                             parse_profile(config.producer_profile, PRODUCER_PROFILE),
+                                             transactional_id(consumer_name, instance))
         #
         # #
         # directory_path = '/media/stefan/hdd/CanalTelegramCG/JustVideosToProcess'
@@ -87,12 +106,13 @@ def kafka_listener():
         # #
 
         # Handle incoming Kafka messages
-        handle_message(consumer, producer, KAFKA_INPUT_TOPICS, KAFKA_OUTPUT_TOPICS)
+        handle_message(consumer, producer, KAFKA_INPUT_TOPICS, KAFKA_OUTPUT_TOPICS, consumer_name,
+                       retry_producer=retry_producer, close_producer=own_producer, stop_event=stop_event)
 
     except Exception as e:
-        logger.error(f"Unexpected error in main execution: {e}")
+        logger.error(f"Unexpected error in main execution of {consumer_name}: {e}")
     finally:
-        close_resources(consumer, producer)
+        close_resources(consumer, producer if own_producer else None)
 
 
 def start_kafka_thread():
@@ -102,13 +122,43 @@ def start_kafka_thread():
     kafka_thread.start()
 
 
-if __name__ == '__main__':
-    if bool(strtobool(config.Config.DISABLE_KAFKA)):
-        logger.info("Kafka is disabled. Skipping...")
-    else:
-        start_kafka_thread()  # Start Kafka listener in a separate thread
-        print('started kafka listeners...')
-
+def start_host_threads(worker_names):
+    """
+    Host mode: run the message handling loop of every consumer of `worker_names` in this process, one thread (and
+    consumer group) each. The consumers share the Flask app, the Redis connection pool, the tracer and one producer
+    (plus one retry producer) by Kafka cluster, codec and producer profile; only their consumers are their own.
+    """
+    shared_producers = {}
+    for worker_name in worker_names:
+        producer = retry_producer = None
+        # a transactional producer runs one transaction at a time: each consumer gets its own in exactly-once mode
+        if not Config.KAFKA_EXACTLY_ONCE:
+            try:
+                config = fetch_configuration(worker_name)
+                key = (config.kafka_bootstrap_server, config.codec or Config.CODEC, config.producer_profile or '')
+                if key not in shared_producers:
+                    bootstrap_servers = config.kafka_bootstrap_server.split(',')
+                    shared_producers[key] = (
+                        create_kafka_producer(bootstrap_servers, config.topics_output.split(','),
+                                              get_codec(config.codec or Config.CODEC),
+                                              parse_profile(config.producer_profile, PRODUCER_PROFILE)),
+                        new_producer(bootstrap_servers, Config.KAFKA_BACKEND)
+                    )
+            except Exception as e:
+                logger.error(f"Skipping {worker_name}: {e}")
+                continue
+            producer, retry_producer = shared_producers[key]
+
+        kafka_thread = threading.Thread(target=kafka_listener, args=(worker_name, producer, retry_producer),
+                                        name=f"kafka-{worker_name}")
+        kafka_thread.daemon = True
+        kafka_thread.start()
+    logger.info(f"Host mode: {len(worker_names)} consumers sharing {len(shared_producers)} producers")
+
+
+def run_api():
+    """Serve the generated API and the monitoring endpoints on port 5005 (blocks until the server stops)."""
+    global app
     app = create_app(app)
     api = create_api(
         app, version=VERSION,
@@ -117,6 +167,7 @@ if __name__ == '__main__':
         iam_server=None
     )
     generate_endpoints_from_config(api)
+    register_metrics_endpoint(app)
     init_instances(app)
     with app.app_context():
         # db_init_test_data()
@@ -138,3 +189,16 @@ if __name__ == '__main__':
         )
         pass
     logger.info('{platform: %s, status: dead}' % (platform.system().lower()))
+
+
+if __name__ == '__main__':
+    if bool(strtobool(config.Config.DISABLE_KAFKA)):
+        logger.info("Kafka is disabled. Skipping...")
+    else:
+        if Config.WORKER_NAMES:
+            start_host_threads(Config.WORKER_NAMES)
+        else:
+            start_kafka_thread()  # Start Kafka listener in a separate thread
+        print('started kafka listeners...')
+
+    run_api()
@@ -21,4 +21,21 @@ def process(message, consumer_name, metadatas):
         dict: The final processed message.
     """
     message['language'] = 'romanian'
-    return message
\ No newline at end of file
+    return message
+
+def process_batch(messages, consumer_name, metadatas):
+    """
+    Process a batch of Kafka messages at once (used when the consumer has `batch_size` > 1).
+
+    Override this function when the processing benefits from batching (e.g. bulk API calls or vectorised models).
+    By default, every message is processed with `process()`.
+
+    Args:
+        messages (list): The aggregated messages of the batch.
+        consumer_name (str): The name of the consumer, as defined in `config.py`.
+        metadatas (str): Additional metadata from the consumer configuration.
+
+    Returns:
+        list: The processed messages. `None` entries are not forwarded.
+    """
+    return [process(message, consumer_name, metadatas) for message in messages]
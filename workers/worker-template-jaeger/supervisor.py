@@ -0,0 +1,32 @@
+"""
+Entry point running SUPERVISOR_PROCESSES consumer processes of WORKER_NAME on this host (see
+`framework.etl.supervisor.Supervisor`), while the parent process serves the API and reports their throughput on
+`GET /monitoring/workers`.
+"""
+import signal
+import sys
+
+from framework.commons.logger import logger
+from framework.etl.supervisor import Supervisor
+from main import kafka_listener, run_api
+from models.instances import kafka_instrumentor
+
+
+def run_consumer(index, stop_event):
+    kafka_instrumentor.instrument()
+    kafka_listener(stop_event=stop_event, instance=index)
+
+
+if __name__ == '__main__':
+    supervisor = Supervisor(run_consumer)
+    supervisor.start()
+
+    def shutdown(signum, frame):
+        logger.info(f"Signal {signum} received, draining the consumer processes...")
+        supervisor.stop()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    run_api()
+    supervisor.stop()
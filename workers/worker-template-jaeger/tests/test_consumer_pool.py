@@ -0,0 +1,60 @@
+import unittest
+
+from framework.streams.consumer_pool import ConsumerPool
+
+
+class FakeConsumer:
+
+    def __init__(self, group_id):
+        self.group_id = group_id
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConsumerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+
+        def factory(group_id, auto_offset_reset, profile):
+            consumer = FakeConsumer(group_id)
+            self.created.append(consumer)
+            return consumer
+
+        self.pool = ConsumerPool(factory, max_size=2)
+
+    def test_reuses_the_consumer_of_a_key(self):
+        with self.pool.lease('g', 'earliest') as first:
+            pass
+        with self.pool.lease('g', 'earliest') as second:
+            self.assertIs(second, first)
+        self.assertEqual(len(self.created), 1)
+
+    def test_closes_the_least_recently_used_consumers(self):
+        for group_id in ('a', 'b', 'a', 'c'):
+            with self.pool.lease(group_id, 'earliest'):
+                pass
+        self.assertEqual(len(self.pool), 2)
+        self.assertEqual([consumer.group_id for consumer in self.created if consumer.closed], ['b'])
+
+    def test_lent_consumers_are_not_closed(self):
+        with self.pool.lease('a', 'earliest') as lent:
+            for group_id in ('b', 'c', 'd'):
+                with self.pool.lease(group_id, 'earliest'):
+                    pass
+            self.assertFalse(lent.closed)
+        self.assertLessEqual(len(self.pool), 2)
+
+    def test_close(self):
+        for group_id in ('a', 'b'):
+            with self.pool.lease(group_id, 'earliest'):
+                pass
+        self.pool.close()
+        self.assertTrue(all(consumer.closed for consumer in self.created))
+        self.assertEqual(len(self.pool), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
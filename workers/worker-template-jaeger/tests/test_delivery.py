@@ -0,0 +1,94 @@
+import unittest
+
+from kafka import TopicPartition
+from kafka.consumer.fetcher import ConsumerRecord
+
+from framework.etl.delivery import DeliveryTracker
+from framework.etl.offsets import OffsetTracker
+
+TP = TopicPartition('topic_input', 0)
+
+
+class FakeFuture:
+    """Send future resolved by the test instead of the producer I/O thread."""
+
+    def __init__(self):
+        self.callbacks = []
+        self.errbacks = []
+
+    def add_callback(self, fn, *args):
+        self.callbacks.append((fn, args))
+
+    def add_errback(self, fn, *args):
+        self.errbacks.append((fn, args))
+
+    def succeed(self):
+        for fn, args in self.callbacks:
+            fn(*args, None)
+
+    def fail(self, error):
+        for fn, args in self.errbacks:
+            fn(*args, error)
+
+
+def record(offset):
+    return ConsumerRecord(TP.topic, TP.partition, offset, 0, 0, None, b'{}', [], None, -1, 2, -1)
+
+
+class DeliveryTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.offsets = OffsetTracker()
+        for offset in range(3):
+            self.offsets.track(TP, offset)
+        self.retried = []
+        self.undelivered = []
+
+    def tracker(self, on_failure=None):
+        def retry(message, error):
+            self.retried.append(message.offset)
+            if on_failure:
+                on_failure(message, error)
+
+        return DeliveryTracker(self.offsets, [], retry, on_undelivered=self.undelivered.append)
+
+    def test_completes_once_every_output_is_confirmed(self):
+        tracker = self.tracker()
+        futures = [FakeFuture(), FakeFuture()]
+        tracker.track(record(0), futures)
+        futures[0].succeed()
+        self.assertTrue(self.offsets.in_flight(TP, 0))
+        futures[1].succeed()
+        self.assertFalse(self.offsets.in_flight(TP, 0))
+        self.assertEqual(tracker.pending(), 0)
+
+    def test_failed_output_is_retried(self):
+        tracker = self.tracker()
+        future = FakeFuture()
+        tracker.track(record(1), [future])
+        future.fail(RuntimeError("not delivered"))
+        self.assertEqual(self.retried, [1])
+        self.assertEqual(self.undelivered, [])
+
+    def test_failed_retry_send_is_handed_back(self):
+        def fail(message, error):
+            raise RuntimeError("retry topic unavailable")
+
+        tracker = self.tracker(on_failure=fail)
+        future = FakeFuture()
+        tracker.track(record(1), [future])
+        future.fail(RuntimeError("not delivered"))
+        self.assertEqual([message.offset for message in self.undelivered], [1])
+
+    def test_failed_retry_delivery_is_handed_back(self):
+        tracker = self.tracker()
+        future = FakeFuture()
+        tracker.track(record(2), [future], retry=False)
+        future.fail(RuntimeError("not delivered"))
+        self.assertEqual(self.retried, [])
+        self.assertEqual([message.offset for message in self.undelivered], [2])
+        self.assertTrue(self.offsets.in_flight(TP, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import unittest
+
+from kafka import TopicPartition
+
+from framework.etl.offsets import OffsetCommitListener, OffsetTracker
+
+TP = TopicPartition('topic_input', 0)
+OTHER_TP = TopicPartition('topic_input', 1)
+
+
+class FakeConsumer:
+    """Records the commits instead of sending them to a broker."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.commits = []
+
+    def commit(self, offsets):
+        if self.fail:
+            raise RuntimeError("commit failed")
+        self.commits.append({tp: meta.offset for tp, meta in offsets.items()})
+
+    def commit_async(self, offsets, callback=None):
+        response = RuntimeError("commit failed") if self.fail else {}
+        if not self.fail:
+            self.commits.append({tp: meta.offset for tp, meta in offsets.items()})
+        callback(offsets, response)
+
+
+def tracked(offsets, tp=TP, **kwargs):
+    tracker = OffsetTracker(**kwargs)
+    for offset in offsets:
+        tracker.track(tp, offset)
+    return tracker
+
+
+class OffsetTrackerTest(unittest.TestCase):
+
+    def test_commits_only_contiguous_offsets(self):
+        tracker = tracked(range(5))
+        consumer = FakeConsumer()
+        tracker.complete(TP, 2)
+        tracker.complete(TP, 1)
+        tracker.commit(consumer)
+        self.assertEqual(consumer.commits, [])
+
+        tracker.complete(TP, 0)
+        tracker.commit(consumer)
+        # the committed offset is the next record to read
+        self.assertEqual(consumer.commits, [{TP: 3}])
+        self.assertEqual(tracker.pending(), 2)
+
+    def test_commits_every_partition_independently(self):
+        tracker = tracked(range(3))
+        tracker.track(OTHER_TP, 10)
+        tracker.track(OTHER_TP, 11)
+        consumer = FakeConsumer()
+        tracker.complete(OTHER_TP, 10)
+        tracker.complete(TP, 1)
+        tracker.commit(consumer)
+        self.assertEqual(consumer.commits, [{OTHER_TP: 11}])
+
+    def test_nothing_committed_twice(self):
+        tracker = tracked(range(2))
+        consumer = FakeConsumer()
+        tracker.complete(TP, 0)
+        tracker.commit(consumer)
+        tracker.commit(consumer)
+        self.assertEqual(consumer.commits, [{TP: 1}])
+
+    def test_rewind_forgets_the_records_from_offset(self):
+        tracker = tracked(range(5))
+        consumer = FakeConsumer()
+        tracker.complete(TP, 3)
+        tracker.rewind(TP, 2)
+        # records 2.. are consumed again: their earlier completions do not count
+        tracker.complete(TP, 0)
+        tracker.complete(TP, 1)
+        tracker.complete(TP, 3)
+        tracker.commit(consumer)
+        self.assertEqual(consumer.commits, [{TP: 2}])
+        self.assertEqual(tracker.pending(), 0)
+
+        tracker.track(TP, 2)
+        tracker.track(TP, 3)
+        tracker.complete(TP, 3)
+        tracker.complete(TP, 2)
+        tracker.commit(consumer)
+        self.assertEqual(consumer.commits[-1], {TP: 4})
+
+    def test_rewind_lowers_the_committable_offset(self):
+        tracker = tracked(range(4))
+        consumer = FakeConsumer()
+        for offset in range(4):
+            tracker.complete(TP, offset)
+        # e.g. aborted transaction: the records from 1 are consumed again
+        tracker.rewind(TP, 1)
+        tracker.commit(consumer)
+        self.assertEqual(consumer.commits, [{TP: 1}])
+
+    def test_revoked_partitions_are_forgotten(self):
+        tracker = tracked(range(3))
+        consumer = FakeConsumer()
+        tracker.complete(TP, 0)
+        tracker.discard([TP])
+        tracker.complete(TP, 1)
+        tracker.commit(consumer)
+        self.assertEqual(consumer.commits, [])
+        self.assertEqual(tracker.pending(), 0)
+
+    def test_in_flight_until_completed_rewound_or_revoked(self):
+        tracker = tracked(range(4))
+        tracker.complete(TP, 1)
+        self.assertTrue(tracker.in_flight(TP, 0))
+        self.assertFalse(tracker.in_flight(TP, 1))
+        tracker.rewind(TP, 3)
+        self.assertFalse(tracker.in_flight(TP, 3))
+        tracker.discard([TP])
+        self.assertFalse(tracker.in_flight(TP, 0))
+
+    def test_failed_commit_is_retried(self):
+        tracker = tracked(range(2))
+        tracker.complete(TP, 0)
+        tracker.commit_async(FakeConsumer(fail=True))
+        consumer = FakeConsumer()
+        tracker.commit_async(consumer)
+        self.assertEqual(consumer.commits, [{TP: 1}])
+
+    def test_failed_commit_does_not_override_a_newer_offset(self):
+        tracker = tracked(range(3))
+        tracker.complete(TP, 0)
+        offsets = tracker._take_committable()
+        tracker.complete(TP, 1)
+        tracker._restore(offsets)
+        consumer = FakeConsumer()
+        tracker.commit(consumer)
+        self.assertEqual(consumer.commits, [{TP: 2}])
+
+    def test_maybe_commit_waits_for_the_count_threshold(self):
+        tracker = tracked(range(3), commit_interval_ms=60000, commit_every=2)
+        consumer = FakeConsumer()
+        tracker.complete(TP, 0)
+        tracker.maybe_commit(consumer)
+        self.assertEqual(consumer.commits, [])
+        tracker.complete(TP, 1)
+        tracker.maybe_commit(consumer)
+        self.assertEqual(consumer.commits, [{TP: 2}])
+
+
+class OffsetCommitListenerTest(unittest.TestCase):
+
+    def test_revocation_completes_and_commits_before_forgetting(self):
+        tracker = tracked(range(2))
+        consumer = FakeConsumer()
+        calls = []
+
+        class Engine:
+            def drain(self):
+                calls.append('drain')
+                tracker.complete(TP, 0)
+
+        listener = OffsetCommitListener(tracker, consumer, engine=Engine(),
+                                        before_commit=[lambda: calls.append('flush')],
+                                        on_revoked=[lambda revoked: calls.append(('revoked', revoked))])
+        listener.on_partitions_revoked({TP})
+        self.assertEqual(calls, ['drain', 'flush', ('revoked', {TP})])
+        self.assertEqual(consumer.commits, [{TP: 1}])
+        self.assertEqual(tracker.pending(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+
+from framework.etl.timing_wheel import HierarchicalTimingWheel
+
+
+def wheel(now_ms=0, **kwargs):
+    kwargs.setdefault('tick_ms', 10)
+    kwargs.setdefault('wheel_size', 8)
+    return HierarchicalTimingWheel(now_ms, **kwargs)
+
+
+class HierarchicalTimingWheelTest(unittest.TestCase):
+
+    def test_expires_keys_at_their_deadline(self):
+        timers = wheel()
+        timers.schedule('a', 30)
+        self.assertEqual(timers.advance(20), [])
+        self.assertIn('a', timers)
+        self.assertEqual(timers.advance(30), ['a'])
+        self.assertNotIn('a', timers)
+        self.assertEqual(len(timers), 0)
+
+    def test_expires_keys_in_deadline_order(self):
+        timers = wheel()
+        timers.schedule('late', 55)
+        timers.schedule('early', 12)
+        timers.schedule('middle', 51)
+        self.assertEqual(timers.advance(100), ['early', 'middle', 'late'])
+
+    def test_deadline_within_a_tick_expires_on_the_next_tick(self):
+        timers = wheel()
+        timers.schedule('a', 25)
+        self.assertEqual(timers.advance(25), [])
+        self.assertEqual(timers.advance(30), ['a'])
+        self.assertEqual(timers.advance(200), [])
+
+    def test_keys_already_due_expire_on_the_next_tick(self):
+        timers = wheel(now_ms=100)
+        timers.schedule('a', 50)
+        self.assertEqual(timers.advance(110), ['a'])
+
+    def test_cancel(self):
+        timers = wheel()
+        timers.schedule('a', 30)
+        timers.schedule('b', 30)
+        timers.cancel('a')
+        timers.cancel('unknown')
+        self.assertEqual(timers.advance(30), ['b'])
+
+    def test_reschedule_replaces_the_deadline(self):
+        timers = wheel()
+        timers.schedule('a', 30)
+        timers.schedule('a', 70)
+        self.assertEqual(timers.deadline('a'), 70)
+        self.assertEqual(len(timers), 1)
+        self.assertEqual(timers.advance(60), [])
+        self.assertEqual(timers.advance(70), ['a'])
+
+    def test_cascades_from_the_upper_levels(self):
+        # level 0 covers 80 ms, level 1 640 ms, level 2 5120 ms
+        timers = wheel()
+        timers.schedule('level1', 300)
+        timers.schedule('level2', 2000)
+        self.assertEqual(timers.advance(290), [])
+        self.assertEqual(timers.advance(300), ['level1'])
+        self.assertEqual(timers.advance(1990), [])
+        self.assertEqual(timers.advance(2000), ['level2'])
+
+    def test_keys_beyond_the_top_level_are_kept(self):
+        timers = wheel(levels=2)
+        # past the 640 ms range of the wheel
+        timers.schedule('a', 2000)
+        self.assertEqual(timers.advance(1990), [])
+        self.assertEqual(timers.advance(2000), ['a'])
+
+    def test_advance_without_keys_moves_the_clock(self):
+        timers = wheel()
+        self.assertEqual(timers.advance(1000), [])
+        timers.schedule('a', 1020)
+        self.assertEqual(timers.advance(1010), [])
+        self.assertEqual(timers.advance(1020), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,7 +9,7 @@ import config
 # Configure the tracer provider
 trace.set_tracer_provider(
     TracerProvider(
-        resource=Resource.create({SERVICE_NAME: config.Config.WORKER_NAME})
+        resource=Resource.create({SERVICE_NAME: config.Config.WORKER_NAME or ','.join(config.Config.WORKER_NAMES)})
     )
 )
 
@@ -8,6 +8,7 @@ from kafka.errors import NoBrokersAvailable, KafkaError
 from framework.commons.logger import logger
 
 from framework.etl.framework_etl import create_kafka_producer
+from framework.streams.delivery import send_all
 
 
 def get_file_names(path):
@@ -36,6 +37,10 @@ print(files)
 KAFKA_BOOTSTRAP_SERVERS = 'localhost'
 producer = create_kafka_producer(KAFKA_BOOTSTRAP_SERVERS, 'topic_output_mist')
 
-for file in files:
-    producer.send('topic_input_mist', {'path': f'https://wowza-qlive.dcti.ro:7443/0039df70-6240-47cf-8fb4-dfe5316a4d14/{file}'})
-    print(f'{file} sent to kafka')
+report = send_all(producer, 'topic_input_mist',
+                  ({'path': f'https://wowza-qlive.dcti.ro:7443/0039df70-6240-47cf-8fb4-dfe5316a4d14/{file}'}
+                   for file in files),
+                  encode_values=False)
+print(f'{report.successes} of {len(files)} files sent to kafka')
+for index, _, error in report.failures:
+    print(f'{files[index]} not sent to kafka: {error}')